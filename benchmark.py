@@ -0,0 +1,366 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from decimal import Decimal
+
+from calculator import Calculator
+from daily_prices import backfillDailyPrices
+from database import Database
+from equity_curve import EquityCurve
+from extract import Extract
+from fixed_point_calculator import FixedPointCalculator
+from list_order import ListOrder
+from parallel_calculator import ParallelCalculator
+from price_provider import PriceFetcher, StubPriceProvider
+from process_order import ProcessOrder
+from profit import Profit
+from vectorized_calculator import VectorizedCalculator
+
+from PySide2.QtCore import QCoreApplication
+from PySide2.QtSql import QSqlQuery
+from PySide2.QtWidgets import QApplication
+
+# Empty database shipped with the needed schema
+SCHEMA_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples', 'database.db')
+
+def createTemporaryDatabase(directory):
+    fileName = os.path.join(directory, 'database.db')
+    shutil.copyfile(SCHEMA_DATABASE, fileName)
+    return Database(fileName)
+
+class DecimalCalculator(Calculator):
+    # Calculator with decimal arithmetic, as a reference for the float and fixed point ones
+    def __init__(self, db):
+        super().__init__(db)
+        self.taxes = sum(Decimal(str(percentage)) for percentage in [self.TAX_SALES_PERCENTAGE, self.TAX_EMOLUMENTS_PERCENTAGE,
+                                                                      self.TAX_IR_PERCENTAGE, self.getCustomTaxRate()]) / 100
+        self.taxFee = Decimal(str(self.getCustomTaxFee()))
+
+    def getTransactionValueWithTaxes(self, amount, unitValue, isSell):
+        totalWithoutTaxes = amount * Decimal(str(unitValue))
+        if (isSell):
+            return totalWithoutTaxes * (1 - self.taxes) - self.taxFee
+        return totalWithoutTaxes * (1 + self.taxes) + self.taxFee
+
+def generateOrders(numOrders, seed=0, numCodes=100, ordersPerDay=20, sellRatio=0.4):
+    # Deterministic orders over numCodes stocks, ordersPerDay a day from 2010 on. About
+    # sellRatio of them are sales, only selling what's been bought
+    rng = random.Random(seed)
+    codes = ['TICK' + str(i) for i in range(numCodes)]
+    amounts = dict.fromkeys(codes, 0)
+    date = datetime.date(2010, 1, 4)
+    orders = []
+    for i in range(numOrders):
+        if (i % ordersPerDay == 0):
+            date += datetime.timedelta(days=1)
+        code = rng.choice(codes)
+        if (amounts[code] > 0 and rng.random() < sellRatio):
+            amount = rng.randint(1, amounts[code] // 100) * 100
+            orders.append([date, 'V', code, '', amount, round(rng.uniform(1, 100), 2)])
+            amounts[code] -= amount
+        else:
+            amount = rng.randint(1, 10) * 100
+            orders.append([date, 'C', code, '', amount, round(rng.uniform(1, 100), 2)])
+            amounts[code] += amount
+    return orders
+
+def getOrdersPerDay(numOrders, numYears):
+    # Spread orders over numYears
+    return max(1, -(-numOrders // (numYears * 365)))
+
+def writeCeiSpreadsheet(fileName, orders):
+    # Write orders as exported by CEI (see examples/spreadsheet_cei.xls), needs xlwt.
+    # A sheet holds at most 65536 rows, returns the number of orders written
+    import xlwt
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet('Negociações de Ativos')
+    header = ['Data Negócio', '', 'C/V', 'Mercado', 'Prazo', 'Código', 'Especificação do Ativo', 'Quantidade', 'Preço (R$)', 'Valor Total (R$)']
+    for column, value in enumerate(header):
+        sheet.write(10, column + 1, value)
+    orders = orders[:65536 - 13]
+    for row, order in enumerate(orders, 11):
+        values = [order[0].strftime('%d/%m/%y'), '', order[1], 'Mercado a Vista', '', order[2], order[2] + ' ON',
+                  float(order[4]), float(order[5]), float(order[4] * order[5])]
+        for column, value in enumerate(values):
+            sheet.write(row, column + 1, value)
+    # An empty row ends the orders
+    sheet.write(len(orders) + 12, 1, 'Fim')
+    workbook.save(fileName)
+    return len(orders)
+
+def addOrdersByConcatenation(orders):
+    # Insert path used before bound bulk inserts, kept for comparison
+    insertData = "INSERT INTO orders ('date', 'type', 'code', 'name', 'amount', 'value') VALUES "
+    for order in orders:
+        insertData += "("
+        insertData += "'" + order[0].strftime('%Y-%m-%d') + "',"
+        insertData += "'" + order[1] + "',"
+        insertData += "'" + order[2] + "',"
+        insertData += "'" + order[3] + "',"
+        insertData += "'" + str(order[4]) + "',"
+        insertData += "'" + str(order[5]) + "'"
+        insertData += "),"
+    insertData = insertData[:-1]
+    insertData += ';'
+    insertQuery = QSqlQuery()
+    insertQuery.exec_(insertData)
+    return not insertQuery.lastError().isValid()
+
+def timeIt(function, *args):
+    start = time.perf_counter()
+    ret = function(*args)
+    return [time.perf_counter() - start, ret]
+
+def benchmarkAddOrders(numOrders):
+    orders = generateOrders(numOrders)
+    with tempfile.TemporaryDirectory() as directory:
+        db = createTemporaryDatabase(directory)
+        concatenationTime, concatenationRet = timeIt(addOrdersByConcatenation, orders)
+        db.deleteOrders()
+        bulkTime, bulkRet = timeIt(db.addOrders, orders)
+        db.db.close()
+    print('addOrders with ' + str(numOrders) + ' orders')
+    print('  concatenated statement: %.3fs (%s)' % (concatenationTime, 'ok' if concatenationRet else 'failed'))
+    print('  bound bulk insert:      %.3fs (%d rows)' % (bulkTime, bulkRet))
+
+def measureMemory(function, *args):
+    tracemalloc.start()
+    ret = function(*args)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return [allocated, ret]
+
+def loadOrderStore(db):
+    # Drop the cached store so it's loaded again
+    db.orderStore = None
+    return db.getOrderStore()
+
+def benchmarkOrderStore(numOrders):
+    with tempfile.TemporaryDirectory() as directory:
+        db = createTemporaryDatabase(directory)
+        db.addOrders(generateOrders(numOrders))
+        rowsTime = timeIt(db.getOrdersInAscendingDate)[0]
+        rowsMemory = measureMemory(db.getOrdersInAscendingDate)[0]
+        storeTime = timeIt(loadOrderStore, db)[0]
+        storeMemory = measureMemory(loadOrderStore, db)[0]
+        db.db.close()
+    print('Loading ' + str(numOrders) + ' orders')
+    print('  list of rows: %.3fs, %.1f bytes/order' % (rowsTime, rowsMemory / numOrders))
+    print('  order store:  %.3fs, %.1f bytes/order' % (storeTime, storeMemory / numOrders))
+
+def runCalculator(db, store):
+    return [Calculator(db).getProfitsAndLosses(store), Calculator(db).getMonthlyReport(store)]
+
+def runVectorizedCalculator(db, store):
+    vectorizedCalculator = VectorizedCalculator(db, store)
+    return [vectorizedCalculator.getProfitsAndLosses(), vectorizedCalculator.getMonthlyReport()]
+
+def benchmarkVectorizedCalculator(numOrders):
+    with tempfile.TemporaryDirectory() as directory:
+        db = createTemporaryDatabase(directory)
+        db.addOrders(generateOrders(numOrders))
+        store = db.getOrderStore()
+        calculatorTime, calculatorRet = timeIt(runCalculator, db, store)
+        vectorizedTime, vectorizedRet = timeIt(runVectorizedCalculator, db, store)
+        db.db.close()
+    maxDifference = max([abs(a[5] - b[5]) for a, b in zip(calculatorRet[0], vectorizedRet[0])] + [0])
+    print('Profits and losses plus monthly report of ' + str(numOrders) + ' orders')
+    print('  Calculator:           %.3fs' % calculatorTime)
+    print('  VectorizedCalculator: %.3fs (%.1fx faster, max profit difference R$%g)' % (vectorizedTime, calculatorTime / vectorizedTime, maxDifference))
+
+def runParallelCalculator(db, store, numWorkers, chunkSize):
+    parallelCalculator = ParallelCalculator(db, store, numWorkers, chunkSize)
+    return [parallelCalculator.getProfitsAndLosses(), parallelCalculator.getMonthlyReport()]
+
+def benchmarkParallelCalculator(numOrders, chunkSize):
+    with tempfile.TemporaryDirectory() as directory:
+        db = createTemporaryDatabase(directory)
+        db.addOrders(generateOrders(numOrders, numCodes=2000))
+        store = db.getOrderStore()
+        print('ParallelCalculator over ' + str(numOrders) + ' orders of 2000 stocks, chunks of ' + str(chunkSize) +
+              ' orders (' + str(multiprocessing.cpu_count()) + ' cores available)')
+        firstTime = None
+        for numWorkers in [1, 2, 4, 8]:
+            workersTime = timeIt(runParallelCalculator, db, store, numWorkers, chunkSize)[0]
+            firstTime = firstTime if firstTime else workersTime
+            print('  %d workers: %.3fs (%.2fx)' % (numWorkers, workersTime, firstTime / workersTime))
+        db.db.close()
+
+def benchmarkFixedPointCalculator(numOrders):
+    with tempfile.TemporaryDirectory() as directory:
+        db = createTemporaryDatabase(directory)
+        db.updateTaxValues(2.5, 0.0, 0.0)
+        db.addOrders(generateOrders(numOrders))
+        store = db.getOrderStore()
+        orders = list(store)
+        # Reports get the OrderStore, whose rows are built when iterated. FixedPointCalculator reads its arrays instead
+        print('Monthly report of ' + str(numOrders) + ' orders, from the OrderStore and from its rows, profit difference '
+              'from Decimal over all months')
+        decimalTime, decimalReport = timeIt(DecimalCalculator(db).getMonthlyReport, store)
+        print('  Decimal:     %.3fs' % decimalTime)
+        for name, calculatorClass in [['float', Calculator], ['fixed point', FixedPointCalculator]]:
+            storeTime, report = timeIt(calculatorClass(db).getMonthlyReport, store)
+            rowsTime = timeIt(calculatorClass(db).getMonthlyReport, orders)[0]
+            assert list(report) == list(decimalReport)
+            difference = sum(abs(Decimal(repr(report[month][1])) - decimalReport[month][1]) for month in report)
+            print('  %-12s %.3fs (%.2fx Decimal), rows %.3fs, R$%.6f' % (name + ':', storeTime, decimalTime / storeTime, rowsTime, difference))
+        db.db.close()
+
+def benchmarkPriceFetcher(numCodes, latencyInSeconds, seed):
+    codes = ['TICK' + str(i) for i in range(numCodes)]
+    print('Fetching prices of ' + str(numCodes) + ' stocks from the stub provider, %.3fs a request' % latencyInSeconds)
+    for batchSize in [1, 10, 50, 200]:
+        provider = StubPriceProvider(latencyInSeconds, seed, maxBatchSize=batchSize)
+        fetchTime, prices = timeIt(PriceFetcher(provider, seed).fetch, codes, time.time())
+        print('  batches of %3d: %.3fs, %d requests, %d prices' % (batchSize, fetchTime, provider.numRequests, len(prices)))
+    # An hour without connection, checking every second as FetchPriceWorker does. Time is simulated
+    provider = StubPriceProvider(seed=seed, failureRate=1.0)
+    fetcher = PriceFetcher(provider, seed)
+    for now in range(3600):
+        fetcher.fetch(codes, now)
+    numRetries = 3600 * -(-numCodes // provider.maxBatchSize)
+    print('  1 hour offline: %d requests with backoff, %d retrying every second' % (provider.numRequests, numRetries))
+    # Codes never found back off on their own, without holding back the others
+    numMissingCodes = numCodes // 10
+    provider = StubPriceProvider(seed=seed, missingCodes=codes[:numMissingCodes])
+    fetcher = PriceFetcher(provider, seed)
+    for now in range(3600):
+        fetcher.fetch(codes, now)
+    numMissingRequested = provider.numCodesRequested - 3600 * (numCodes - numMissingCodes)
+    print('  1 hour with %d codes not found: requested %d times with backoff, %d retrying every second' %
+          (numMissingCodes, numMissingRequested, 3600 * numMissingCodes))
+
+def benchmarkEquityCurve(numOrders, numCodes, seed):
+    with tempfile.TemporaryDirectory() as directory:
+        db = createTemporaryDatabase(directory)
+        db.addOrders(generateOrders(numOrders, seed=seed, numCodes=numCodes))
+        store = db.getOrderStore()
+        lastDateStr = store.getDateStrs()[-1]
+        backfillTime, [numPrices, failedCodes] = timeIt(backfillDailyPrices, db, StubPriceProvider(seed=seed), lastDateStr)
+        print('Equity curve of ' + str(numOrders) + ' orders of ' + str(numCodes) + ' stocks, ' + str(numPrices) + ' daily prices')
+        print('  backfill from the stub provider: %.3fs' % backfillTime)
+        curveTime, [days, values, costs, unrealized] = timeIt(EquityCurve(db, store).getEquityCurve, '', lastDateStr)
+        print('  %d days: %.3fs' % (len(days), curveTime))
+        db.db.close()
+
+def runCalculatorReport(db, methodName, *args):
+    return getattr(Calculator(db), methodName)(*args)
+
+def runSuite(numOrders, seed, numCodes, ordersPerDay, sellRatio):
+    # Return {name: seconds} of every step of the pipeline, from the spreadsheet to the tables,
+    # and the number of orders in the spreadsheet (None without xlwt)
+    timings = {}
+    numSpreadsheetOrders = None
+    with tempfile.TemporaryDirectory() as directory:
+        db = createTemporaryDatabase(directory)
+        orders = generateOrders(numOrders, seed, numCodes, ordersPerDay, sellRatio)
+        timings['Database.addOrders'] = timeIt(db.addOrders, orders)[0]
+        timings['Database.getOrdersInAscendingDate'], ordersInAscendingDate = timeIt(db.getOrdersInAscendingDate)
+        timings['Database.getOrderStore'] = timeIt(loadOrderStore, db)[0]
+        lastYear = int(ordersInAscendingDate[-1][1][:4])
+        for methodName, args in [['getProfitsAndLosses', []], ['getMonthlyReport', []], ['getYearExtract', []],
+                                 ['getFreeTaxesReport', [lastYear]], ['getPayingTaxesReport', [lastYear]]]:
+            timings['Calculator.' + methodName] = timeIt(runCalculatorReport, db, methodName, ordersInAscendingDate, *args)[0]
+        timings['Database.getLedger'] = timeIt(db.getLedger)[0]
+
+        try:
+            fileName = os.path.join(directory, 'orders.xls')
+            numSpreadsheetOrders = writeCeiSpreadsheet(fileName, orders)
+            timings['ProcessOrder.processFile'] = timeIt(ProcessOrder(fileName).processFile, fileName)[0]
+        except ImportError:
+            timings['ProcessOrder.processFile'] = None
+
+        # Views fill their table when built, from the order store and ledger shared by every view.
+        # A new data version makes each one load them again, as the first view shown after a change
+        db.bumpDataVersion()
+        timings['ListOrder()'] = timeIt(ListOrder, db)[0]
+        db.bumpDataVersion()
+        timings['Profit()'] = timeIt(Profit, db)[0]
+        # The ledger is computed by the first fill and shared by the next one
+        extract = Extract(db)
+        db.bumpDataVersion()
+        timings['Extract.fillTable'] = timeIt(extract.fillTable, lastYear)[0]
+        timings['Extract.fillTable from the ledger'] = timeIt(extract.fillTable, lastYear)[0]
+        db.db.close()
+    return [timings, numSpreadsheetOrders]
+
+def benchmarkSuite(sizes, seed, numCodes, numYears, sellRatio, outputFileName):
+    # Tables load their .ui files relatively to the sources
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for numOrders in sizes:
+        ordersPerDay = getOrdersPerDay(numOrders, numYears)
+        timings, numSpreadsheetOrders = runSuite(numOrders, seed, numCodes, ordersPerDay, sellRatio)
+        results.append({'orders': numOrders, 'seed': seed, 'codes': numCodes, 'ordersPerDay': ordersPerDay, 'sellRatio': sellRatio,
+                        'spreadsheetOrders': numSpreadsheetOrders, 'seconds': timings})
+    output = json.dumps({'date': datetime.datetime.now().isoformat(timespec='seconds'), 'results': results}, indent=2)
+    if (outputFileName):
+        with open(outputFileName, 'w') as outputFile:
+            outputFile.write(output + '\n')
+    else:
+        print(output)
+
+def checkQueryPlans(numOrders):
+    with tempfile.TemporaryDirectory() as directory:
+        db = createTemporaryDatabase(directory)
+        db.addOrders(generateOrders(numOrders))
+        # Let the planner know about the data distribution, as a long-lived database would
+        QSqlQuery(db.db).exec_('ANALYZE')
+        for queryStr in Database.HOT_QUERIES:
+            print(queryStr)
+            for detail in db.getQueryPlan(queryStr):
+                print('  ' + detail)
+        badQueries = db.checkQueryPlans()
+        db.db.close()
+    for queryStr in badQueries:
+        print('FAILED, query is not answered through an index: ' + queryStr)
+    return len(badQueries) == 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the swingtrade database and calculations')
+    parser.add_argument('benchmark', choices=['add_orders', 'order_store', 'query_plan', 'vectorized', 'parallel', 'fixed_point', 'prices', 'equity', 'suite'])
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--chunk-size', type=int, default=ParallelCalculator.DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--latency', type=float, default=0.05)
+    # Options of the suite, which writes JSON results
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--codes', type=int, default=100)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--sell-ratio', type=float, default=0.4)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    if (args.benchmark == 'suite'):
+        # Tables are filled without showing them
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        app = QApplication(sys.argv)
+    else:
+        app = QCoreApplication(sys.argv)
+    if (args.benchmark == 'add_orders'):
+        benchmarkAddOrders(args.orders)
+    elif (args.benchmark == 'order_store'):
+        benchmarkOrderStore(args.orders)
+    elif (args.benchmark == 'query_plan'):
+        sys.exit(0 if checkQueryPlans(args.orders) else 1)
+    elif (args.benchmark == 'vectorized'):
+        benchmarkVectorizedCalculator(args.orders)
+    elif (args.benchmark == 'parallel'):
+        benchmarkParallelCalculator(args.orders, args.chunk_size)
+    elif (args.benchmark == 'fixed_point'):
+        benchmarkFixedPointCalculator(args.orders)
+    elif (args.benchmark == 'prices'):
+        benchmarkPriceFetcher(args.codes, args.latency, args.seed)
+    elif (args.benchmark == 'equity'):
+        benchmarkEquityCurve(args.orders, args.codes, args.seed)
+    elif (args.benchmark == 'suite'):
+        benchmarkSuite(args.sizes, args.seed, args.codes, args.years, args.sell_ratio, args.output)
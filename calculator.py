@@ -1,42 +1,69 @@
+import calendar
 import datetime
 import sys
 
+from fee_schedule import FeeSchedule
+
 class Calculator:
     NO_TAXES_SELLING_PER_YEAR_LIMIT = 20000.00
     TAX_PAY_PERCENTAGE = 15.0
-    TAX_SALES_PERCENTAGE = 0.0275
-    TAX_EMOLUMENTS_PERCENTAGE = 0.004105
-    TAX_IR_PERCENTAGE = 0.005
+    TAX_SALES_PERCENTAGE = FeeSchedule.TAX_SALES_PERCENTAGE
+    TAX_EMOLUMENTS_PERCENTAGE = FeeSchedule.TAX_EMOLUMENTS_PERCENTAGE
+    TAX_IR_PERCENTAGE = FeeSchedule.TAX_IR_PERCENTAGE
 
     def __init__(self, db):
         # This is a map of "Stock code" to "Average price" and "Amount"
         # The map will be updated as we iterate on each order
         self.stocks = {}
         self.db = db
-        self.taxValues = self.db.getTaxValues()
+        self.feeSchedule = self.db.getFeeSchedule()
+        # Date of the last order replayed when saving checkpoints, see getOrdersAfterCheckpoint
+        self.checkpointDate = None
+        self.monthKeys = {}
 
     def getCustomTaxFee(self):
-        return self.taxValues[0]
+        return self.feeSchedule.taxFee
 
     def getCustomTaxRate(self):
-        return self.taxValues[1]
+        return self.feeSchedule.taxRate
 
     def getInitLossToDiscount(self):
-        return self.taxValues[2]
+        return self.feeSchedule.lossToDiscount
 
     def getTransactionValueWithTaxes(self, amount, unitValue, isSell):
-        # Taxes for sales and emoluments
-        taxes = (self.TAX_SALES_PERCENTAGE + self.TAX_EMOLUMENTS_PERCENTAGE + self.TAX_IR_PERCENTAGE + self.getCustomTaxRate()) / 100
-        totalWithoutTaxes = amount * unitValue
-        taxRate = (1 - taxes) if isSell else (1 + taxes)
-        taxFee = -self.getCustomTaxFee() if isSell else self.getCustomTaxFee()
-        return (totalWithoutTaxes * taxRate) + taxFee
+        # Taxes for sales and emoluments are combined in the fee schedule multipliers
+        feeSchedule = self.feeSchedule
+        if (isSell):
+            return amount * unitValue * feeSchedule.sellMultiplier - feeSchedule.taxFee
+        return amount * unitValue * feeSchedule.buyMultiplier + feeSchedule.taxFee
 
     def updateAverageValue(self, oldAmount, oldValue, addingAmount, addingValue):
         # Buying a stock requires updating amount and value (weighted-average)
         return (oldAmount * oldValue + self.getTransactionValueWithTaxes(addingAmount, addingValue, False)) / (oldAmount + addingAmount)
 
+    def getOrdersAfterCheckpoint(self, checkpointYear, upToYear):
+        # Restore stocks from the latest checkpoint until the end of checkpointYear and
+        # return only the orders after it, up to the end of upToYear. While these
+        # orders are replayed a checkpoint is saved at the end of each month, as long as
+        # orders and config are still the ones of the stored data version they were read at
+        self.db.getDataVersion()
+        self.checkpointDataVersion = self.db.storedDataVersion
+        self.checkpointDate, stocks = self.db.getCheckpoint(str(checkpointYear) + '-12-31')
+        self.stocks = stocks
+        return self.db.getOrderStore().sliceAfterDateUpToYear(self.checkpointDate, upToYear)
+
+    def saveCheckpointIfMonthEnded(self, dateStr):
+        # Orders come in ascending date, so once one from a later month shows up
+        # the stocks hold the position at the end of the previous order's month
+        if (self.checkpointDate and self.checkpointDate[:7] < dateStr[:7]):
+            date = datetime.datetime.strptime(self.checkpointDate, '%Y-%m-%d')
+            monthEnd = date.replace(day=calendar.monthrange(date.year, date.month)[1])
+            self.db.addCheckpoint(monthEnd.strftime('%Y-%m-%d'), self.stocks, self.checkpointDataVersion)
+        self.checkpointDate = dateStr
+
     def updateStockAverageValueAndAmount(self, order):
+        if (self.checkpointDate is not None):
+            self.saveCheckpointIfMonthEnded(order[1])
         if (not order[3] in self.stocks):
             self.stocks[order[3]] = [0, 0]
         amount = self.stocks[order[3]][0]
@@ -55,6 +82,22 @@ class Calculator:
             self.updateStockAverageValueAndAmount(order)
         return self.stocks
 
+    def getSaleProfit(self, order):
+        # Must be called after updating stock average value and amount with the selling order,
+        # returns [totalSellingValueWithoutTaxes, averageBuyingValue, profit]
+        totalSellingValue = self.getTransactionValueWithTaxes(order[5], order[6], True)
+        totalSellingValueWithoutTaxes = order[5] * order[6]
+        averageBuyingValue = self.stocks[order[3]][1]
+        totalBuyingValue = averageBuyingValue * order[5]
+        return [totalSellingValueWithoutTaxes, averageBuyingValue, totalSellingValue - totalBuyingValue]
+
+    def getMonthKey(self, dateStr):
+        # Months are keyed as 'Jan 20', parse each month only once
+        if (dateStr[:7] not in self.monthKeys):
+            date = datetime.datetime.strptime(dateStr, '%Y-%m-%d')
+            self.monthKeys[dateStr[:7]] = date.strftime('%b %y')
+        return self.monthKeys[dateStr[:7]]
+
     def getProfitsAndLosses(self, ordersInAscendingDate):
         ret = []
         for order in ordersInAscendingDate:
@@ -63,10 +106,7 @@ class Calculator:
             # that's a selling operation and calculate profit/loss
             if (order[2] != 'V'):
                 continue
-            totalSellingValue = self.getTransactionValueWithTaxes(order[5], order[6], True)
-            averageBuyingValue = self.stocks[order[3]][1]
-            totalBuyingValue = averageBuyingValue * order[5]
-            profit = totalSellingValue - totalBuyingValue
+            totalSellingValueWithoutTaxes, averageBuyingValue, profit = self.getSaleProfit(order)
             ret.append([order[1], order[3], averageBuyingValue, order[5], order[6], profit])
         return ret
 
@@ -78,49 +118,37 @@ class Calculator:
             # that's a selling operation and calculate profit/loss
             if (order[2] != 'V'):
                 continue
-            # Calculate total selling value, profits, etc.
-            totalSellingValue = self.getTransactionValueWithTaxes(order[5], order[6], True)
-            totalSellingValueWithoutTaxes = order[5] * order[6]
-            averageBuyingValue = self.stocks[order[3]][1]
-            totalBuyingValue = averageBuyingValue * order[5]
-            profit = totalSellingValue - totalBuyingValue
+            totalSellingValueWithoutTaxes, averageBuyingValue, profit = self.getSaleProfit(order)
             # Update corresponding month with variables calculated
-            date = datetime.datetime.strptime(order[1], '%Y-%m-%d')
-            dateString = date.strftime('%b %y')
+            dateString = self.getMonthKey(order[1])
             if dateString not in ret:
                 ret[dateString] = [0, 0]
             ret[dateString][0] += totalSellingValueWithoutTaxes
             ret[dateString][1] += profit
         return ret
 
-    def getFreeTaxesReport(self, ordersInAscendingDate, year):
-        profits = self.getMonthlyReport(ordersInAscendingDate)
-        # Return {month: [totalSales, realProfit]}
+    def getFreeTaxesReportsPerYear(self, monthlyReport):
+        # Return {year: {month: [totalSales, realProfit]}}
         ret = {}
-        for key, value in profits.items():
-            # Ignore months outside asked year
-            date = datetime.datetime.strptime(key, '%b %y')
-            if date.year != year:
-                continue
+        for key, value in monthlyReport.items():
             # Ignore months with value bigger than tax limit or that gave losses
             if value[0] > self.NO_TAXES_SELLING_PER_YEAR_LIMIT or value[1] < 0:
                 continue
-            ret[key] = value
+            date = datetime.datetime.strptime(key, '%b %y')
+            ret.setdefault(date.year, {})[key] = value
         return ret
 
-    def getPayingTaxesReport(self, ordersInAscendingDate, year):
-        profits = self.getMonthlyReport(ordersInAscendingDate)
-        # Return {month: [totalSales, lossToDiscount, discountedLoss, profit, taxToPay]}
+    def getPayingTaxesReportsPerYear(self, monthlyReport):
+        # Return {year: {month: [totalSales, lossToDiscount, discountedLoss, profit, taxToPay]}}
         ret = {}
         lossToDiscount = self.getInitLossToDiscount()
-        for key, value in profits.items():
+        for key, value in monthlyReport.items():
             date = datetime.datetime.strptime(key, '%b %y')
             # If that gave a prejudice, let's accumulate it
             if (value[1] <= 0):
                 lossToDiscount += -value[1]
                 # This month is to be reported, show discounted loss until now
-                if date.year == year:
-                    ret[key] = [value[0], lossToDiscount, 0, value[1], 0]
+                ret.setdefault(date.year, {})[key] = [value[0], lossToDiscount, 0, value[1], 0]
                 continue
             # Ignore months with value sold smaller than when we pay taxes
             if value[0] <= self.NO_TAXES_SELLING_PER_YEAR_LIMIT:
@@ -130,12 +158,17 @@ class Calculator:
             lossToDiscount -= value[1]
             if (lossToDiscount < 0):
                 lossToDiscount = 0
-            # Ignore months outside asked year
-            if date.year != year:
-                continue
             discountedLoss = oldLossToDiscount - lossToDiscount
             realProfitAfterDiscountedLosses = value[1] - discountedLoss
             if (realProfitAfterDiscountedLosses < 0):
                 realProfitAfterDiscountedLosses = 0
-            ret[key] = [value[0], lossToDiscount, discountedLoss, value[1], realProfitAfterDiscountedLosses*(self.TAX_PAY_PERCENTAGE/100)]
+            ret.setdefault(date.year, {})[key] = [value[0], lossToDiscount, discountedLoss, value[1], realProfitAfterDiscountedLosses*(self.TAX_PAY_PERCENTAGE/100)]
         return ret
+
+    def getFreeTaxesReport(self, ordersInAscendingDate, year):
+        # Return {month: [totalSales, realProfit]}
+        return self.getFreeTaxesReportsPerYear(self.getMonthlyReport(ordersInAscendingDate)).get(year, {})
+
+    def getPayingTaxesReport(self, ordersInAscendingDate, year):
+        # Return {month: [totalSales, lossToDiscount, discountedLoss, profit, taxToPay]}
+        return self.getPayingTaxesReportsPerYear(self.getMonthlyReport(ordersInAscendingDate)).get(year, {})
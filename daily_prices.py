@@ -0,0 +1,101 @@
+import csv
+import datetime
+import sys
+
+from price_provider import PriceProviderError
+from process_order import getFloatFromStr
+
+# Columns of daily prices in CSV files, separated by commas or semicolons
+DAILY_PRICE_FILE_COLUMNS = ['date', 'code', 'close']
+CSV_SOURCE = 'csv'
+
+def getMarketCode(code):
+    # Codes of the odd lot market (e.g. PETR4F) trade at the prices of the regular market
+    return code[:-1] if code.endswith('F') and code[:-1][-1:].isdigit() else code
+
+def getDateStrFromStr(dateStr):
+    # Dates as YYYY-MM-DD or as CEI writes them, DD/MM/YYYY
+    for dateFormat in ['%Y-%m-%d', '%d/%m/%Y']:
+        try:
+            return datetime.datetime.strptime(dateStr.strip(), dateFormat).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    raise ValueError(dateStr)
+
+def getCloseFromStr(closeStr):
+    try:
+        return float(closeStr)
+    except ValueError:
+        return getFloatFromStr(closeStr)
+
+def getBackfillDates(db, lastDateStr):
+    # Returns {code: first date missing} of codes traded, from the day after their last price or
+    # from their first order up to lastDateStr. Prices older than the ones stored aren't looked for
+    lastPriceDates = db.getLastDailyPriceDates()
+    firstDates = {}
+    for code, firstOrderDateStr in db.getFirstOrderDates().items():
+        code = getMarketCode(code)
+        firstDates[code] = min(firstDates.get(code, firstOrderDateStr), firstOrderDateStr)
+    for code, lastPriceDateStr in lastPriceDates.items():
+        if (code in firstDates):
+            nextDate = datetime.date.fromisoformat(lastPriceDateStr) + datetime.timedelta(days=1)
+            firstDates[code] = nextDate.isoformat()
+    return {code: firstDateStr for code, firstDateStr in firstDates.items() if firstDateStr <= lastDateStr}
+
+def backfillDailyPrices(db, provider, lastDateStr):
+    # Downloads the prices missing up to lastDateStr. Codes are batched in order of their first missing
+    # date, so batches span few extra days. Returns [number of prices added, codes not fetched],
+    # stopping at the first failed request
+    firstDates = getBackfillDates(db, lastDateStr)
+    codes = sorted(firstDates, key=lambda code: firstDates[code])
+    numPrices = 0
+    failedCodes = []
+    for start in range(0, len(codes), provider.maxBatchSize):
+        batch = codes[start:start + provider.maxBatchSize]
+        try:
+            closes = provider.getDailyCloses(batch, firstDates[batch[0]], lastDateStr)
+        except PriceProviderError:
+            failedCodes.extend(codes[start:])
+            break
+        prices = []
+        for code in batch:
+            if (code not in closes):
+                failedCodes.append(code)
+                continue
+            # The batch starts at its earliest date, prices already stored are kept
+            prices.extend([[dateStr, code, close] for dateStr, close in closes[code] if dateStr >= firstDates[code]])
+        if (not db.addDailyPrices(prices, provider.getSource())):
+            failedCodes.extend(codes[start:])
+            break
+        numPrices += len(prices)
+    return [numPrices, failedCodes]
+
+def importDailyPricesFromCsv(db, fileName):
+    # Returns [number of prices added, error message], nothing is added unless every row is valid
+    prices = []
+    try:
+        with open(fileName, newline='', encoding='utf-8-sig') as csvFile:
+            headerLine = csvFile.readline()
+            delimiter = ';' if headerLine.count(';') > headerLine.count(',') else ','
+            header = [column.strip().lower() for column in headerLine.split(delimiter)]
+            if (header != DAILY_PRICE_FILE_COLUMNS):
+                return [0, 'Colunas inválidas, esperadas: ' + delimiter.join(DAILY_PRICE_FILE_COLUMNS)]
+            for lineNum, row in enumerate(csv.reader(csvFile, delimiter=delimiter), 2):
+                if (len(row) == 0):
+                    continue
+                if (len(row) != len(DAILY_PRICE_FILE_COLUMNS)):
+                    return [0, 'Linha ' + str(lineNum) + ': número de colunas inválido']
+                try:
+                    dateStr = getDateStrFromStr(row[0])
+                except ValueError:
+                    return [0, 'Linha ' + str(lineNum) + ': data inválida "' + row[0] + '"']
+                try:
+                    close = getCloseFromStr(row[2])
+                except ValueError:
+                    return [0, 'Linha ' + str(lineNum) + ': preço inválido "' + row[2] + '"']
+                prices.append([dateStr, getMarketCode(row[1].strip().upper()), close])
+    except (OSError, UnicodeDecodeError):
+        return [0, 'Não foi possível ler o arquivo ' + fileName]
+    if (not db.addDailyPrices(prices, CSV_SOURCE)):
+        return [0, 'Não foi possível salvar as cotações']
+    return [len(prices), '']
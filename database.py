@@ -1,12 +1,173 @@
+import logging
 import sys
 
+import numpy as np
+
+from fee_schedule import FeeSchedule
+from ledger import Ledger
+from order_store import OrderStore
+
+from PySide2.QtCore import QByteArray
 from PySide2.QtSql import QSqlDatabase, QSqlQuery
 
+logger = logging.getLogger(__name__)
+
+class DatabaseError(Exception):
+    pass
+
 class Database:
-    def __init__(self):
-        self.db = QSqlDatabase.addDatabase('QSQLITE')
-        self.db.setDatabaseName('database.db')
+    # Queries run on every tab refresh, keep them as plain ranges on indexed columns so
+    # SQLite never has to scan the table or sort the result (see checkQueryPlans)
+    SELECT_ORDERS_IN_ASCENDING_DATE = 'SELECT * FROM orders ORDER BY date ASC, id ASC'
+    SELECT_ORDERS_WITHIN_DATES_IN_ASCENDING_DATE = 'SELECT * FROM orders WHERE date >= ? AND date < ? ORDER BY date ASC, id ASC'
+    SELECT_ORDERS_AFTER_DATE_IN_ASCENDING_DATE = 'SELECT * FROM orders WHERE date > ? ORDER BY date ASC, id ASC'
+    SELECT_FIRST_DATE_FROM_DATE = 'SELECT MIN(date) FROM orders WHERE date >= ?'
+    SELECT_LAST_CHECKPOINT_UP_TO_DATE = 'SELECT MAX(date) FROM checkpoints WHERE date <= ?'
+    HOT_QUERIES = [SELECT_ORDERS_IN_ASCENDING_DATE, SELECT_ORDERS_WITHIN_DATES_IN_ASCENDING_DATE, SELECT_ORDERS_AFTER_DATE_IN_ASCENDING_DATE,
+                   SELECT_FIRST_DATE_FROM_DATE, SELECT_LAST_CHECKPOINT_UP_TO_DATE]
+
+    def __init__(self, fileName='database.db', connectionName=None):
+        # Each thread needs its own connection, named apart from the default one
+        if (connectionName):
+            self.db = QSqlDatabase.addDatabase('QSQLITE', connectionName)
+        else:
+            self.db = QSqlDatabase.addDatabase('QSQLITE')
+        self.db.setDatabaseName(fileName)
         self.opened = self.db.open()
+        if (self.opened):
+            self.updateSchema()
+        # Bumped on every change to orders or config, see getDataVersion
+        self.dataVersion = 0
+        self.sqliteDataVersion = None
+        self.storedDataVersion = self.getStoredDataVersion()
+        # Earliest date of orders changed since the ledger was last updated, see getLedger
+        self.firstChangedDateStr = None
+        # Taxes from config, see getFeeSchedule
+        self.feeSchedule = None
+        # Orders as columns, see getOrderStore
+        self.orderStore = None
+        self.orderStoreDataVersion = None
+        # Reports computed in a single pass over the orders, see getLedger
+        self.ledger = None
+        self.ledgerDataVersion = None
+        # Bumped on every change to daily prices, which don't change orders, see addDailyPrices
+        self.dailyPricesVersion = 0
+
+    def getFileName(self):
+        return self.db.databaseName()
+
+    def close(self):
+        # Named connections must be removed once done, this object is unusable after it
+        connectionName = self.db.connectionName()
+        self.db.close()
+        self.db = None
+        QSqlDatabase.removeDatabase(connectionName)
+
+    def updateSchema(self):
+        # Databases created by older versions lack these, create them if needed.
+        # This fails silently if there's no orders table, which isValid reports
+        query = QSqlQuery(self.db)
+        query.exec_('CREATE INDEX IF NOT EXISTS date_code_index ON orders (date ASC, code ASC)')
+        query.exec_('CREATE INDEX IF NOT EXISTS code_date_index ON orders (code ASC, date ASC)')
+        # Stocks' amount and average value at the end of a month, see Calculator.getOrdersAfterCheckpoint.
+        # Every checkpoint has a row with an empty code, so checkpoints without stocks can be found too
+        query.exec_('CREATE TABLE IF NOT EXISTS checkpoints (date TEXT NOT NULL, code TEXT NOT NULL, amount INTEGER NOT NULL, '
+                    'value NUMERIC NOT NULL, PRIMARY KEY (date, code))')
+        # Content hash of imported files, see importOrders
+        query.exec_('CREATE TABLE IF NOT EXISTS imports (hash TEXT NOT NULL PRIMARY KEY, first_date TEXT NOT NULL, '
+                    'last_date TEXT NOT NULL, num_orders INTEGER NOT NULL)')
+        # Text of each page of PDF files by content hash, see process_note.getPageTexts
+        query.exec_('CREATE TABLE IF NOT EXISTS pdf_texts (hash TEXT NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL, PRIMARY KEY (hash, page))')
+        # Latest quote of each code, kept for ttl seconds since timestamp (seconds since the epoch)
+        query.exec_('CREATE TABLE IF NOT EXISTS quotes (code TEXT NOT NULL PRIMARY KEY, price NUMERIC NOT NULL, timestamp INTEGER NOT NULL, '
+                    'source TEXT NOT NULL, ttl INTEGER NOT NULL)')
+        # Fees actually charged by each imported brokerage note
+        query.exec_('CREATE TABLE IF NOT EXISTS brokerage_notes (hash TEXT NOT NULL, number TEXT NOT NULL, date TEXT NOT NULL, '
+                    'fees NUMERIC NOT NULL, num_orders INTEGER NOT NULL, PRIMARY KEY (hash, number))')
+        # Closing price of each code on each trading day, keyed by date as they're read a range of dates at a time
+        query.exec_('CREATE TABLE IF NOT EXISTS daily_prices (date TEXT NOT NULL, code TEXT NOT NULL, close NUMERIC NOT NULL, '
+                    'source TEXT NOT NULL, PRIMARY KEY (date, code))')
+        # Options besides taxes, see getSetting
+        query.exec_('CREATE TABLE IF NOT EXISTS settings (key TEXT NOT NULL PRIMARY KEY, value TEXT NOT NULL)')
+        # Ledger of the last session as of the stored data version and its last order date, see saveLedger.
+        # first_changed_date is the earliest date of orders changed after it was saved
+        query.exec_('CREATE TABLE IF NOT EXISTS ledger_state (data_version INTEGER NOT NULL, last_date TEXT NOT NULL, '
+                    'first_changed_date TEXT, average_values BLOB, profits BLOB)')
+        query.exec_('CREATE TABLE IF NOT EXISTS ledger_months (month TEXT NOT NULL PRIMARY KEY, total_sales NUMERIC NOT NULL, '
+                    'profit NUMERIC NOT NULL)')
+        query.exec_('CREATE TABLE IF NOT EXISTS ledger_stocks (year INTEGER NOT NULL, code TEXT NOT NULL, amount INTEGER NOT NULL, '
+                    'value NUMERIC NOT NULL, PRIMARY KEY (year, code))')
+
+    def bumpDataVersion(self, firstDateStr=''):
+        # firstDateStr is the earliest date of the changed orders, empty when anything may have changed.
+        # The change is stored too, for other connections and the ledger saved by saveLedger
+        self.bumpLocalDataVersion(firstDateStr)
+        query = QSqlQuery(self.db)
+        query.exec_("INSERT OR IGNORE INTO settings (key, value) VALUES ('data_version', '0')")
+        query.exec_("UPDATE settings SET value = value + 1 WHERE key = 'data_version'")
+        query.prepare('UPDATE ledger_state SET first_changed_date = ? WHERE first_changed_date IS NULL OR first_changed_date > ?')
+        query.bindValue(0, firstDateStr)
+        query.bindValue(1, firstDateStr)
+        query.exec_()
+        self.storedDataVersion = self.getStoredDataVersion()
+
+    def bumpLocalDataVersion(self, firstDateStr=''):
+        self.dataVersion += 1
+        if (self.firstChangedDateStr is None or firstDateStr < self.firstChangedDateStr):
+            self.firstChangedDateStr = firstDateStr
+
+    def getStoredDataVersion(self):
+        return int(self.getSetting('data_version', '0'))
+
+    def getDataVersion(self):
+        # Changes made through this object bump the version directly, SQLite's
+        # data_version tells about commits made by other connections/processes.
+        # Their commits only count if they bumped the stored version, others
+        # (e.g. quotes or a saved ledger) leave orders and config as they were
+        query = QSqlQuery(self.db)
+        if (query.exec_('PRAGMA data_version') and query.next()):
+            sqliteDataVersion = query.value(0)
+            if (sqliteDataVersion != self.sqliteDataVersion):
+                storedDataVersion = self.getStoredDataVersion()
+                if (self.sqliteDataVersion is not None and storedDataVersion != self.storedDataVersion):
+                    self.bumpLocalDataVersion()
+                    # Config may have been changed as well
+                    self.feeSchedule = None
+                self.storedDataVersion = storedDataVersion
+                self.sqliteDataVersion = sqliteDataVersion
+        return self.dataVersion
+
+    def raiseQueryError(self, query):
+        # For readers whose partial result would pass for real data, e.g. an empty portfolio
+        error = query.lastError().text()
+        logger.error('Query failed: %s (%s)', query.lastQuery(), error)
+        raise DatabaseError(error)
+
+    def getQueryPlan(self, queryStr):
+        plan = []
+        # Placeholders are bound to NULL, values don't change the plan
+        query = QSqlQuery(self.db)
+        query.prepare('EXPLAIN QUERY PLAN ' + queryStr)
+        for i in range(queryStr.count('?')):
+            query.bindValue(i, None)
+        if (not query.exec_()):
+            return plan
+        while (query.next()):
+            plan.append(query.value(3))
+        return plan
+
+    def checkQueryPlans(self):
+        # Return {query: plan} for every hot query that scans the table or sorts its result
+        ret = {}
+        for queryStr in self.HOT_QUERIES:
+            plan = self.getQueryPlan(queryStr)
+            if (len(plan) == 0):
+                ret[queryStr] = plan
+            for detail in plan:
+                if ((detail.startswith('SCAN') and 'INDEX' not in detail) or 'TEMP B-TREE' in detail):
+                    ret[queryStr] = plan
+                    break
+        return ret
 
     def isValid(self):
         # By default SQLite will create a new file, so opening should never fail...
@@ -14,21 +175,25 @@ class Database:
             return False
         # That said, also check if database contains orders table
         # TODO: Check if database structure (tables) are as expected
-        query = QSqlQuery()
+        query = QSqlQuery(self.db)
         query.exec_('SELECT 1 FROM orders')
         return not query.lastError().isValid()
 
     def updateTaxValues(self, taxFee, taxRate, lossToDiscount):
-        wipeQuery = QSqlQuery()
+        wipeQuery = QSqlQuery(self.db)
         wipeQuery.exec_('DELETE FROM config')
+        self.bumpDataVersion()
+        self.feeSchedule = None
+        # Average values include custom taxes, no checkpoint is valid anymore
+        self.eraseCheckpointsFromDate('')
 
         insertData = "INSERT INTO config ('tax_fee', 'tax_rate', 'loss_to_discount') VALUES "
         insertData += "('" + str(taxFee) + "', '" + str(taxRate) + "', '" + str(lossToDiscount) + "');"
-        insertQuery = QSqlQuery()
+        insertQuery = QSqlQuery(self.db)
         insertQuery.exec_(insertData)
 
     def getTaxValues(self):
-        query = QSqlQuery()
+        query = QSqlQuery(self.db)
         query.exec_('SELECT * FROM config LIMIT 1')
         if (query.lastError().isValid()):
             return [0, 0, 0]
@@ -38,8 +203,34 @@ class Database:
             return [query.result().data(0), query.result().data(1), query.result().data(2)]
         return [0, 0, 0]
 
+    def getSetting(self, key, default=''):
+        query = QSqlQuery(self.db)
+        query.prepare('SELECT value FROM settings WHERE key = ?')
+        query.bindValue(0, key)
+        if (not query.exec_() or not query.next()):
+            return default
+        return query.value(0)
+
+    def updateSetting(self, key, value):
+        # Settings change how orders are calculated, as taxes do
+        query = QSqlQuery(self.db)
+        query.prepare('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)')
+        query.bindValue(0, key)
+        query.bindValue(1, str(value))
+        if (not query.exec_()):
+            return False
+        self.bumpDataVersion()
+        self.eraseCheckpointsFromDate('')
+        return True
+
+    def getFeeSchedule(self):
+        # Loaded once and shared by every calculator until taxes are updated
+        if (self.feeSchedule is None):
+            self.feeSchedule = FeeSchedule.fromTaxValues(self.getTaxValues())
+        return self.feeSchedule
+
     def getNumOrders(self):
-        query = QSqlQuery()
+        query = QSqlQuery(self.db)
         query.exec_('SELECT COUNT(*) FROM orders')
         if (query.lastError().isValid()):
             return -1
@@ -47,14 +238,18 @@ class Database:
         return query.result().data(0)
     
     def getYearsWithOrders(self):
+        # Jump from year to year through the date index instead of scanning all orders
         years = []
-        query = QSqlQuery()
-        query.exec_('SELECT DISTINCT strftime("%Y", date) FROM orders')
-        if (query.lastError().isValid()):
-            return []
-        result = query.result()
-        while (result.fetchNext()):
-            years.append(result.data(0))
+        query = QSqlQuery(self.db)
+        query.prepare(self.SELECT_FIRST_DATE_FROM_DATE)
+        nextYearStr = '0000'
+        while (True):
+            query.bindValue(0, nextYearStr + '-01-01')
+            if (not query.exec_() or not query.next() or not query.value(0)):
+                break
+            year = query.value(0)[:4]
+            years.append(year)
+            nextYearStr = str(int(year) + 1).zfill(4)
         return years
 
     def getOrdersFromResult(self, query):
@@ -67,52 +262,527 @@ class Database:
         return data
 
     def getOrdersInAscendingDate(self):
-        query = QSqlQuery()
-        query.exec_('SELECT * FROM orders ORDER BY date(date) ASC')
+        query = QSqlQuery(self.db)
+        query.exec_(self.SELECT_ORDERS_IN_ASCENDING_DATE)
         return self.getOrdersFromResult(query)
 
-    def getOrdersInAscendingDateUpToYear(self, year):
-        query = QSqlQuery()
-        query.exec_('SELECT * FROM orders WHERE strftime("%Y", date) <= "' + str(year) + '" ORDER BY date(date) ASC')
+    def iterateOrdersInAscendingDate(self):
+        # Same as getOrdersInAscendingDate, one order at a time so they're never all in memory
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        if (not query.exec_(self.SELECT_ORDERS_IN_ASCENDING_DATE)):
+            return
+        result = query.result()
+        while (result.fetchNext()):
+            yield [result.data(0), result.data(1), result.data(2), result.data(3), result.data(4), result.data(5), result.data(6)]
+
+    def getOrderNamesAndValues(self):
+        # Returns [names, values] of orders as laid out by getOrderStore, which doesn't keep names
+        # and whose values went through text with SQLite's 15 significant digits
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        if (not query.exec_('SELECT name, value FROM orders ORDER BY date ASC, id ASC')):
+            return [[], []]
+        names = []
+        values = []
+        result = query.result()
+        while (result.fetchNext()):
+            names.append(result.data(0))
+            values.append(result.data(1))
+        return [names, values]
+
+    def getOrderStore(self):
+        # Load orders once per data version, every tab and calculator shares the store.
+        # Each column comes as a single string concatenated by SQLite, in the order of
+        # the inner query, which is much faster than reading each value of each row.
+        # Dates come as days since 1970-01-01 and a query per year keeps strings bounded.
+        # Raises DatabaseError if a query fails, the store isn't kept then
+        dataVersion = self.getDataVersion()
+        if (self.orderStore is not None and self.orderStoreDataVersion == dataVersion):
+            return self.orderStore
+        columns = [[], [], [], [], [], []]
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        query.prepare('SELECT group_concat(id), group_concat(CAST(julianday(date) - 2440587.5 AS INTEGER)), group_concat(type, ""), group_concat(code), '
+                      'group_concat(amount), group_concat(value) FROM (' + self.SELECT_ORDERS_WITHIN_DATES_IN_ASCENDING_DATE + ')')
+        for year in self.getYearsWithOrders():
+            query.bindValue(0, year + '-01-01')
+            query.bindValue(1, str(int(year) + 1).zfill(4) + '-01-01')
+            if (not query.exec_() or not query.next()):
+                self.raiseQueryError(query)
+            for i in range(len(columns)):
+                columns[i].append(str(query.value(i)))
+        self.orderStore = OrderStore.fromStrings(','.join(columns[0]), ','.join(columns[1]), ''.join(columns[2]),
+                                                 ','.join(columns[3]), ','.join(columns[4]), ','.join(columns[5]))
+        self.orderStoreDataVersion = dataVersion
+        return self.orderStore
+
+    def getLedger(self):
+        # Computed once per data version and shared by every tab. When orders only changed
+        # after the last one processed (e.g. a new month was imported), the ledger is
+        # extended with them instead of processing every order again. The ledger is saved
+        # for the next session, which goes on from it the same way (see loadLedger)
+        dataVersion = self.getDataVersion()
+        if (self.ledger is not None and self.ledgerDataVersion == dataVersion):
+            return self.ledger
+        if (self.ledger is not None and self.ledger.lastDateStr and self.firstChangedDateStr and
+            self.firstChangedDateStr > self.ledger.lastDateStr):
+            self.ledger.appendOrders(self.getOrdersAfterDate(self.ledger.lastDateStr))
+            self.saveLedger(self.ledger)
+        else:
+            self.ledger = self.loadLedger()
+            if (self.ledger is None):
+                self.ledger = Ledger(self, self.getOrderStore())
+                self.saveLedger(self.ledger)
+        self.ledgerDataVersion = dataVersion
+        self.firstChangedDateStr = None
+        return self.ledger
+
+    def saveLedger(self, ledger):
+        # Stocks at the end of each year and months are kept as rows. Sales are the selling orders up
+        # to the last date in ascending order, only their average buying value and profit are kept,
+        # as arrays of doubles. Losses to discount follow from months and config, see updateTaxesReports
+        if (not self.db.transaction()):
+            return False
+        query = QSqlQuery(self.db)
+        succeeded = (query.exec_('DELETE FROM ledger_state') and query.exec_('DELETE FROM ledger_months') and
+                     query.exec_('DELETE FROM ledger_stocks'))
+        query.prepare('INSERT INTO ledger_state (data_version, last_date, average_values, profits) VALUES (?, ?, ?, ?)')
+        query.bindValue(0, self.storedDataVersion)
+        query.bindValue(1, ledger.lastDateStr)
+        query.bindValue(2, QByteArray(np.array([row[2] for row in ledger.profitsAndLosses], dtype=np.float64).tobytes()))
+        query.bindValue(3, QByteArray(np.array([row[5] for row in ledger.profitsAndLosses], dtype=np.float64).tobytes()))
+        succeeded = succeeded and query.exec_()
+        query.prepare('INSERT INTO ledger_months (month, total_sales, profit) VALUES (?, ?, ?)')
+        for month, value in ledger.monthlyReport.items():
+            if (not succeeded):
+                break
+            query.bindValue(0, month)
+            query.bindValue(1, value[0])
+            query.bindValue(2, value[1])
+            succeeded = query.exec_()
+        query.prepare('INSERT INTO ledger_stocks (year, code, amount, value) VALUES (?, ?, ?, ?)')
+        for year, extract in ledger.yearExtracts.items():
+            for code, stock in extract.items():
+                if (not succeeded):
+                    break
+                query.bindValue(0, year)
+                query.bindValue(1, code)
+                query.bindValue(2, stock[0])
+                query.bindValue(3, stock[1])
+                succeeded = query.exec_()
+        return self.commitOrRollback(succeeded)
+
+    def loadLedger(self):
+        # Return the ledger saved by saveLedger if the stored data version is still the same, or if
+        # only orders after its last date changed, which it's extended with. None if it can't be used
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        if (not query.exec_('SELECT data_version, last_date, first_changed_date, average_values, profits FROM ledger_state') or
+            not query.next()):
+            return None
+        lastDateStr = query.value(1)
+        appendOrders = query.value(0) != self.storedDataVersion
+        if (appendOrders and not (lastDateStr and (query.value(2) or '') > lastDateStr)):
+            return None
+        averageValues = np.frombuffer(query.value(3).data(), dtype=np.float64).tolist() if query.value(3) else []
+        profits = np.frombuffer(query.value(4).data(), dtype=np.float64).tolist() if query.value(4) else []
+        store = self.getOrderStore()
+        if (lastDateStr):
+            store = store.take(np.flatnonzero((store.types == OrderStore.SELL) & (store.days <= OrderStore.getDayFromDateStr(lastDateStr))))
+        else:
+            store = OrderStore.empty()
+        if (len(store) != len(profits) or len(averageValues) != len(profits)):
+            return None
+        profitsAndLosses = list(map(list, zip(store.getDateStrs(), store.getCodeStrs(), averageValues, store.amounts.tolist(),
+                                              store.values.tolist(), profits)))
+        monthlyReport = {}
+        query.exec_('SELECT month, total_sales, profit FROM ledger_months ORDER BY rowid')
+        while (query.next()):
+            monthlyReport[query.value(0)] = [query.value(1), query.value(2)]
+        yearExtracts = {}
+        query.exec_('SELECT year, code, amount, value FROM ledger_stocks ORDER BY year, rowid')
+        while (query.next()):
+            yearExtracts.setdefault(query.value(0), {})[query.value(1)] = [query.value(2), query.value(3)]
+        ledger = Ledger(self, [])
+        ledger.restore(lastDateStr, profitsAndLosses, monthlyReport, yearExtracts)
+        if (appendOrders):
+            ledger.appendOrders(self.getOrdersAfterDate(lastDateStr))
+            self.saveLedger(ledger)
+        return ledger
+
+    def getOrdersAfterDate(self, dateStr):
+        query = QSqlQuery(self.db)
+        query.prepare(self.SELECT_ORDERS_AFTER_DATE_IN_ASCENDING_DATE)
+        query.bindValue(0, dateStr)
+        query.exec_()
         return self.getOrdersFromResult(query)
 
-    def eraseOrdersWithinDateRange(self, firstDate, secondDate):
-        query = QSqlQuery()
-        firstDateStr = firstDate.strftime('%Y-%m-%d')
-        secondDateStr = secondDate.strftime('%Y-%m-%d')
-        query.exec_('DELETE FROM orders WHERE date >= "' + firstDateStr + '" AND date <= "' + secondDateStr + '"')
-        return query.numRowsAffected()
+    def getCheckpoint(self, dateStr):
+        # Return [checkpoint date, {code: [amount, value]}] of the latest checkpoint up to date,
+        # or an empty date if there's none
+        query = QSqlQuery(self.db)
+        query.prepare(self.SELECT_LAST_CHECKPOINT_UP_TO_DATE)
+        query.bindValue(0, dateStr)
+        if (not query.exec_() or not query.next() or not query.value(0)):
+            return ['', {}]
+        checkpointDateStr = query.value(0)
+        stocks = {}
+        query.prepare('SELECT code, amount, value FROM checkpoints WHERE date = ?')
+        query.bindValue(0, checkpointDateStr)
+        query.exec_()
+        while (query.next()):
+            if (query.value(0)):
+                stocks[query.value(0)] = [query.value(1), query.value(2)]
+        return [checkpointDateStr, stocks]
+
+    def addCheckpoint(self, dateStr, stocks, dataVersion):
+        # dataVersion is the stored data version stocks were computed at. Another connection may have
+        # changed orders since, erasing checkpoints, so it's checked within the transaction
+        if (not self.db.transaction()):
+            return False
+        if (self.getStoredDataVersion() != dataVersion):
+            self.db.rollback()
+            return False
+        query = QSqlQuery(self.db)
+        query.prepare('INSERT OR REPLACE INTO checkpoints (date, code, amount, value) VALUES (?, ?, ?, ?)')
+        succeeded = True
+        for code, stock in [['', [0, 0]]] + list(stocks.items()):
+            # Stocks no longer held restart their average value on the next buy, skip them
+            if (code and stock[0] == 0):
+                continue
+            query.bindValue(0, dateStr)
+            query.bindValue(1, code)
+            query.bindValue(2, stock[0])
+            query.bindValue(3, stock[1])
+            if (not query.exec_()):
+                succeeded = False
+                break
+        return self.commitOrRollback(succeeded)
+
+    def eraseCheckpointsFromDate(self, dateStr):
+        # Checkpoints up to a date depend on every order until it, so any change to
+        # orders must erase the checkpoints from the change date on
+        query = QSqlQuery(self.db)
+        query.prepare('DELETE FROM checkpoints WHERE date >= ?')
+        query.bindValue(0, dateStr)
+        return query.exec_()
 
     def eraseOrdersById(self, idsToErase):
-        query = QSqlQuery()
+        query = QSqlQuery(self.db)
         whereExpr = ''
         for idToErase in idsToErase:
             whereExpr += ' OR ' if len(whereExpr) > 0 else ''
             whereExpr += 'id = ' + str(idToErase)
+        query.exec_('SELECT MIN(date), MAX(date) FROM orders WHERE ' + whereExpr)
+        firstDateStr, lastDateStr = [query.value(0), query.value(1)] if query.next() else [None, None]
         query.exec_('DELETE FROM orders WHERE ' + whereExpr)
-        return query.numRowsAffected()
+        numErasedOrders = query.numRowsAffected()
+        if (firstDateStr):
+            self.eraseDataFromOrdersWithinDates(firstDateStr, lastDateStr)
+        else:
+            self.bumpDataVersion()
+        return numErasedOrders
 
     def deleteOrders(self):
-        wipeQuery = QSqlQuery()
+        wipeQuery = QSqlQuery(self.db)
         wipeQuery.exec_('DELETE FROM orders')
-        return not wipeQuery.lastError().isValid()
+        self.bumpDataVersion()
+        if (wipeQuery.lastError().isValid()):
+            return False
+        self.eraseCheckpointsFromDate('')
+        wipeQuery.exec_('DELETE FROM imports')
+        wipeQuery.exec_('DELETE FROM brokerage_notes')
+        return True
 
-    def addOrders(self, orders):
-        insertData = "INSERT INTO orders ('date', 'type', 'code', 'name', 'amount', 'value') VALUES "
+    def writeOrders(self, tableName, orders):
+        # Prepare the statement once and bind each order to it, so values are never
+        # parsed as SQL and the statement doesn't grow with the number of orders.
+        # Orders may be any iterable, where a False order stands for an error while reading them.
+        # Returns [numWrittenOrders, firstDateStr, lastDateStr] or [-1, '', ''] on error
+        insertQuery = QSqlQuery(self.db)
+        insertQuery.prepare('INSERT INTO ' + tableName + " ('date', 'type', 'code', 'name', 'amount', 'value') VALUES (?, ?, ?, ?, ?, ?)")
+        numWrittenOrders = 0
+        firstDateStr = ''
+        lastDateStr = ''
         for order in orders:
-            insertData += "("
-            insertData += "'" + order[0].strftime('%Y-%m-%d') + "',"
-            insertData += "'" + order[1] + "',"
-            insertData += "'" + order[2] + "',"
-            insertData += "'" + order[3] + "',"
-            insertData += "'" + str(order[4]) + "',"
-            insertData += "'" + str(order[5]) + "'"
-            insertData += "),"
-
-        # Remove last comma
-        insertData = insertData[:-1]
-        insertData += ';'
-        insertQuery = QSqlQuery()
-        insertQuery.exec_(insertData)
+            if (not order):
+                return [-1, '', '']
+            dateStr = order[0].strftime('%Y-%m-%d')
+            if (not firstDateStr or dateStr < firstDateStr):
+                firstDateStr = dateStr
+            if (dateStr > lastDateStr):
+                lastDateStr = dateStr
+            insertQuery.bindValue(0, dateStr)
+            insertQuery.bindValue(1, order[1])
+            insertQuery.bindValue(2, order[2])
+            insertQuery.bindValue(3, order[3])
+            insertQuery.bindValue(4, order[4])
+            insertQuery.bindValue(5, order[5])
+            if (not insertQuery.exec_()):
+                return [-1, '', '']
+            numWrittenOrders += 1
+        return [numWrittenOrders, firstDateStr, lastDateStr]
+
+    def insertOrders(self, orders):
+        # Must be called within a transaction, returns the number of inserted orders or -1 on error
+        numInsertedOrders, firstDateStr, lastDateStr = self.writeOrders('orders', orders)
+        if (numInsertedOrders <= 0):
+            return numInsertedOrders
+        if (not self.eraseDataFromOrdersWithinDates(firstDateStr, lastDateStr)):
+            return -1
+        return numInsertedOrders
+
+    def eraseDataFromOrdersWithinDates(self, firstDateStr, lastDateStr):
+        # Everything kept from orders must go once orders within dates change
+        self.bumpDataVersion(firstDateStr)
+        return self.eraseCheckpointsFromDate(firstDateStr) and self.eraseImportsWithinDates(firstDateStr, lastDateStr)
+
+    def commitOrRollback(self, succeeded):
+        if (succeeded and self.db.commit()):
+            return True
+        self.db.rollback()
+        return False
+
+    def addOrders(self, orders):
+        # Insert all orders or none of them, returns the number of inserted orders or -1 on error
+        if (not self.db.transaction()):
+            return -1
+        numInsertedOrders = self.insertOrders(orders)
+        if (not self.commitOrRollback(numInsertedOrders >= 0)):
+            return -1
+        return numInsertedOrders
+
+    def importOrders(self, orders):
+        # Store orders read from spreadsheets, replacing the ones registered before within their date
+        # range. Orders may be any iterable, so they are staged in a temporary table until the range is
+        # known, then compared to registered ones day by day (see applyStagedOrders): only days whose
+        # orders differ on either side are erased and inserted again, in a single transaction so a
+        # failure keeps the database untouched.
+        # Returns [numErasedOrders, numInsertedOrders, firstDateStr, lastDateStr] or [-1, -1, '', ''] on error
+        # Staging only writes the temporary database, so other connections can still write while orders
+        # are read, which may take long. Registered orders are only locked while staged ones are applied
+        query = QSqlQuery(self.db)
+        succeeded = (query.exec_('DROP TABLE IF EXISTS temp.staged_orders') and
+                     query.exec_('CREATE TEMP TABLE staged_orders AS SELECT date, type, code, name, amount, value FROM orders WHERE 0'))
+        if (not succeeded or not self.db.transaction()):
+            return [-1, -1, '', '']
+        numStagedOrders, firstDateStr, lastDateStr = self.writeOrders('staged_orders', orders)
+        numErasedOrders = 0
+        numInsertedOrders = 0
+        succeeded = self.commitOrRollback(numStagedOrders >= 0)
+        if (succeeded and numStagedOrders > 0):
+            succeeded = self.db.transaction()
+            if (succeeded):
+                numErasedOrders, numInsertedOrders = self.applyStagedOrders(firstDateStr, lastDateStr)
+                succeeded = numInsertedOrders >= 0
+                if (succeeded and numErasedOrders + numInsertedOrders > 0):
+                    succeeded = self.eraseDataFromOrdersWithinDates(firstDateStr, lastDateStr)
+                succeeded = self.commitOrRollback(succeeded)
+        query.exec_('DROP TABLE IF EXISTS temp.staged_orders')
+        if (not succeeded):
+            return [-1, -1, '', '']
+        return [numErasedOrders, numInsertedOrders, firstDateStr, lastDateStr]
+
+    def applyStagedOrders(self, firstDateStr, lastDateStr):
+        # Orders are read by date and id, so a day is replaced as a whole to keep the order of its
+        # orders: staged and registered orders within dates are numbered within their day, and a day
+        # with an order alone in its group of day, number and key (type, code, amount and value)
+        # differs on both sides. Registered orders of those days are erased and the staged ones
+        # inserted in the order they were staged.
+        # Returns [numErasedOrders, numInsertedOrders] or [-1, -1] on error
+        query = QSqlQuery(self.db)
+        query.exec_('DROP TABLE IF EXISTS temp.changed_days')
+        query.prepare('CREATE TEMP TABLE changed_days AS SELECT DISTINCT date FROM ('
+                      'SELECT date, type, code, amount, value, ROW_NUMBER() OVER (PARTITION BY date ORDER BY rowid) AS number FROM staged_orders '
+                      'UNION ALL SELECT date, type, code, amount, value, ROW_NUMBER() OVER (PARTITION BY date ORDER BY id) FROM orders '
+                      'WHERE date >= ? AND date <= ?) GROUP BY date, number, type, code, amount, value HAVING COUNT(*) = 1')
+        query.bindValue(0, firstDateStr)
+        query.bindValue(1, lastDateStr)
+        if (not query.exec_()):
+            return [-1, -1]
+        ret = [-1, -1]
+        if (query.exec_('DELETE FROM orders WHERE date IN (SELECT date FROM changed_days)')):
+            numErasedOrders = query.numRowsAffected()
+            if (query.exec_('INSERT INTO orders (date, type, code, name, amount, value) SELECT date, type, code, name, amount, value FROM staged_orders '
+                            'WHERE date IN (SELECT date FROM changed_days) ORDER BY date ASC, rowid ASC')):
+                ret = [numErasedOrders, query.numRowsAffected()]
+        query.exec_('DROP TABLE IF EXISTS temp.changed_days')
+        return ret
+
+    def getQuotes(self):
+        # Returns {code: [price, timestamp, source, ttl]}, see updateSchema
+        query = QSqlQuery(self.db)
+        quotes = {}
+        if (query.exec_('SELECT code, price, timestamp, source, ttl FROM quotes')):
+            while (query.next()):
+                quotes[query.value(0)] = [query.value(1), query.value(2), query.value(3), query.value(4)]
+        return quotes
+
+    def updateQuotes(self, prices, timestamp, source, ttl):
+        # Prices are {code: price}, quotes don't change orders so the data version stays
+        if (not self.db.transaction()):
+            return False
+        query = QSqlQuery(self.db)
+        query.prepare('INSERT OR REPLACE INTO quotes (code, price, timestamp, source, ttl) VALUES (?, ?, ?, ?, ?)')
+        succeeded = True
+        for code, price in prices.items():
+            query.bindValue(0, code)
+            query.bindValue(1, price)
+            query.bindValue(2, timestamp)
+            query.bindValue(3, source)
+            query.bindValue(4, ttl)
+            if (not query.exec_()):
+                succeeded = False
+                break
+        return self.commitOrRollback(succeeded)
+
+    def getDailyPricesVersion(self):
+        return self.dailyPricesVersion
+
+    def addDailyPrices(self, prices, source):
+        # Prices are [dateStr, code, close], replacing the ones of the same date and code
+        if (not self.db.transaction()):
+            return False
+        query = QSqlQuery(self.db)
+        query.prepare('INSERT OR REPLACE INTO daily_prices (date, code, close, source) VALUES (?, ?, ?, ?)')
+        succeeded = True
+        for dateStr, code, close in prices:
+            query.bindValue(0, dateStr)
+            query.bindValue(1, code)
+            query.bindValue(2, close)
+            query.bindValue(3, source)
+            if (not query.exec_()):
+                succeeded = False
+                break
+        self.dailyPricesVersion += 1
+        return self.commitOrRollback(succeeded)
+
+    def getLastDailyPriceDates(self):
+        # Returns {code: date of its last daily price}
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        dates = {}
+        if (query.exec_('SELECT code, MAX(date) FROM daily_prices GROUP BY code')):
+            while (query.next()):
+                dates[query.value(0)] = query.value(1)
+        return dates
+
+    def getFirstOrderDates(self):
+        # Returns {code: date of its first order}, answered by the code index
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        dates = {}
+        if (query.exec_('SELECT code, MIN(date) FROM orders GROUP BY code')):
+            while (query.next()):
+                dates[query.value(0)] = query.value(1)
+        return dates
+
+    def getDailyPrices(self, lastDateStr):
+        # Returns [days, codes, closes] of prices up to lastDateStr in ascending date, days since 1970-01-01
+        # and closes as arrays. Columns come concatenated by SQLite as in getOrderStore, a year at a time
+        columns = [[], [], []]
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        query.prepare('SELECT group_concat(CAST(julianday(date) - 2440587.5 AS INTEGER)), group_concat(code), group_concat(close) '
+                      'FROM (SELECT date, code, close FROM daily_prices WHERE date >= ? AND date < ? AND date <= ? ORDER BY date ASC)')
+        firstDateQuery = QSqlQuery(self.db)
+        firstDateQuery.exec_('SELECT MIN(date) FROM daily_prices')
+        firstDateStr = firstDateQuery.value(0) if firstDateQuery.next() else None
+        if (firstDateStr):
+            for year in range(int(firstDateStr[:4]), int(lastDateStr[:4]) + 1):
+                query.bindValue(0, str(year).zfill(4) + '-01-01')
+                query.bindValue(1, str(year + 1).zfill(4) + '-01-01')
+                query.bindValue(2, lastDateStr)
+                if (not query.exec_() or not query.next()):
+                    break
+                if (query.value(0)):
+                    for i in range(len(columns)):
+                        columns[i].append(str(query.value(i)))
+        if (len(columns[0]) == 0):
+            return [np.zeros(0, dtype=np.int32), [], np.zeros(0)]
+        return [np.fromstring(','.join(columns[0]), dtype=np.int32, sep=','), ','.join(columns[1]).split(','),
+                np.fromstring(','.join(columns[2]), dtype=np.float64, sep=',')]
+
+    def getCodesByName(self):
+        # Code of each name of registered orders, codes of the odd lot market are named as the regular ones
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        if (not query.exec_("SELECT name, code FROM orders WHERE name != '' GROUP BY name, code ORDER BY code DESC")):
+            return {}
+        codesByName = {}
+        while (query.next()):
+            code = query.value(1)
+            codesByName[query.value(0)] = code[:-1] if code.endswith('F') and code[:-1][-1:].isdigit() else code
+        return codesByName
+
+    def getPdfTexts(self, fileHash):
+        # Returns the text of each page, or an empty list if not cached
+        query = QSqlQuery(self.db)
+        query.prepare('SELECT text FROM pdf_texts WHERE hash = ? ORDER BY page ASC')
+        query.bindValue(0, fileHash)
+        texts = []
+        if (query.exec_()):
+            while (query.next()):
+                texts.append(query.value(0))
+        return texts
+
+    def addPdfTexts(self, fileHash, texts):
+        if (not self.db.transaction()):
+            return False
+        query = QSqlQuery(self.db)
+        query.prepare('INSERT OR REPLACE INTO pdf_texts (hash, page, text) VALUES (?, ?, ?)')
+        succeeded = True
+        for page, text in enumerate(texts):
+            query.bindValue(0, fileHash)
+            query.bindValue(1, page)
+            query.bindValue(2, text)
+            if (not query.exec_()):
+                succeeded = False
+                break
+        return self.commitOrRollback(succeeded)
+
+    def registerBrokerageNotes(self, notes):
+        # Notes are [fileHash, number, dateStr, fees, numOrders] of notes whose orders were imported
+        if (not self.db.transaction()):
+            return False
+        query = QSqlQuery(self.db)
+        query.prepare('INSERT OR REPLACE INTO brokerage_notes (hash, number, date, fees, num_orders) VALUES (?, ?, ?, ?, ?)')
+        succeeded = True
+        for note in notes:
+            for i, value in enumerate(note):
+                query.bindValue(i, value)
+            if (not query.exec_()):
+                succeeded = False
+                break
+        return self.commitOrRollback(succeeded)
+
+    def isFileImported(self, fileHash):
+        # Whether orders of a file with this content hash are still registered as imported
+        query = QSqlQuery(self.db)
+        query.prepare('SELECT 1 FROM imports WHERE hash = ?')
+        query.bindValue(0, fileHash)
+        return query.exec_() and query.next()
+
+    def registerImports(self, imports):
+        # Imports are [fileHash, firstDateStr, lastDateStr, numOrders] of files whose orders were imported
+        if (not self.db.transaction()):
+            return False
+        query = QSqlQuery(self.db)
+        query.prepare('INSERT OR REPLACE INTO imports (hash, first_date, last_date, num_orders) VALUES (?, ?, ?, ?)')
+        succeeded = True
+        for fileImport in imports:
+            for i, value in enumerate(fileImport):
+                query.bindValue(i, value)
+            if (not query.exec_()):
+                succeeded = False
+                break
+        return self.commitOrRollback(succeeded)
 
-        return not insertQuery.lastError().isValid()
+    def eraseImportsWithinDates(self, firstDateStr, lastDateStr):
+        # Files imported within dates may no longer match their orders
+        query = QSqlQuery(self.db)
+        query.prepare('DELETE FROM imports WHERE last_date >= ? AND first_date <= ?')
+        query.bindValue(0, firstDateStr)
+        query.bindValue(1, lastDateStr)
+        return query.exec_()
@@ -0,0 +1,81 @@
+import sys
+
+import numpy as np
+
+from daily_prices import getMarketCode
+from order_store import OrderStore
+from vectorized_calculator import VectorizedCalculator
+
+class EquityCurve:
+    # Positions marked to market on each trading day, i.e. each day with daily prices. Amounts and
+    # costs (amount * average value) after each order come from VectorizedCalculator, so a (day, code)
+    # matrix of them is the cumulative sum of their changes on the day of each order. Closes are a
+    # (day, code) matrix as well, carried forward from the last day with a price. Positions without
+    # any price yet are valued at their cost
+    def __init__(self, db, store):
+        self.db = db
+        self.store = store
+        self.calculator = VectorizedCalculator(db, store)
+
+    def getCloses(self, lastDateStr):
+        # Returns [days, closes] up to lastDateStr, closes with a column per code of the store and NaN
+        # before its first price. Odd lot codes take the prices of the regular market
+        priceDays, priceCodes, priceCloses = self.db.getDailyPrices(lastDateStr)
+        days, dayIndexes = np.unique(priceDays, return_inverse=True)
+        marketCodes = sorted(set(getMarketCode(code) for code in self.store.codes))
+        marketIndexes = {code: i for i, code in enumerate(marketCodes)}
+        # Prices of codes never traded are left out
+        priceMarketIndexes = np.array([marketIndexes.get(code, -1) for code in priceCodes], dtype=np.int64)
+        traded = priceMarketIndexes >= 0
+        closes = np.full((len(days), len(marketCodes)), np.nan)
+        closes[dayIndexes[traded], priceMarketIndexes[traded]] = priceCloses[traded]
+        lastPricedDays = np.where(np.isnan(closes), 0, np.arange(len(days))[:, np.newaxis])
+        np.maximum.accumulate(lastPricedDays, axis=0, out=lastPricedDays)
+        closes = closes[lastPricedDays, np.arange(len(marketCodes))]
+        return [days, closes[:, [marketIndexes[getMarketCode(code)] for code in self.store.codes]]]
+
+    def getPositionsAndCosts(self, days):
+        # Returns [amounts, costs] held at the end of each day, orders on days without prices count
+        # on the next day with them. Codes sold short hold nothing
+        calculator = self.calculator
+        codes = calculator.sortedCodes
+        positions = np.maximum(calculator.sortedPositions, 0)
+        costs = positions * calculator.sortedAverageValuesAfter
+        codeStarts = np.ones(len(codes), dtype=bool)
+        codeStarts[1:] = codes[1:] != codes[:-1]
+        previousPositions = np.where(codeStarts, 0, np.roll(positions, 1))
+        previousCosts = np.where(codeStarts, 0.0, np.roll(costs, 1))
+        # Orders after the last day fall in an extra row, which is dropped
+        dayIndexes = np.searchsorted(days, self.store.days[calculator.sortedIndexes], 'left')
+        positionChanges = np.zeros((len(days) + 1, len(self.store.codes)))
+        np.add.at(positionChanges, (dayIndexes, codes), positions - previousPositions)
+        costChanges = np.zeros((len(days) + 1, len(self.store.codes)))
+        np.add.at(costChanges, (dayIndexes, codes), costs - previousCosts)
+        return [np.cumsum(positionChanges, axis=0)[:-1], np.cumsum(costChanges, axis=0)[:-1]]
+
+    def getEquityCurve(self, firstDateStr, lastDateStr):
+        # Returns [days, values, costs, unrealized] of each trading day within dates, from the first order on:
+        # the market value of positions, their cost and the profit of selling them, with taxes, at the closes
+        if (len(self.store) == 0):
+            return [np.zeros(0, dtype=np.int32), np.zeros(0), np.zeros(0), np.zeros(0)]
+        days, closes = self.getCloses(lastDateStr)
+        positions, costs = self.getPositionsAndCosts(days)
+        firstDay = self.store.days[0]
+        if (firstDateStr):
+            firstDay = max(firstDay, OrderStore.getDayFromDateStr(firstDateStr))
+        first = int(np.searchsorted(days, firstDay, 'left'))
+        days, closes, positions, costs = days[first:], closes[first:], positions[first:], costs[first:]
+        held = positions > 0
+        priced = held & ~np.isnan(closes)
+        costs = np.where(held, costs, 0.0)
+        values = np.where(priced, positions * closes, costs)
+        sellingValues = self.calculator.calculator.getTransactionValueWithTaxes(positions, closes, True)
+        unrealized = np.where(priced, sellingValues - costs, 0.0)
+        return [days, values.sum(axis=1), costs.sum(axis=1), unrealized.sum(axis=1)]
+
+    def getDailyReport(self, firstDateStr, lastDateStr):
+        # Returns {dateStr: [value, cost, unrealized profit]}, see getEquityCurve
+        days, values, costs, unrealized = self.getEquityCurve(firstDateStr, lastDateStr)
+        dateStrs = np.datetime_as_string(days + OrderStore.EPOCH, unit='D').tolist()
+        return {dateStr: [value, cost, profit] for dateStr, value, cost, profit in
+                zip(dateStrs, values.tolist(), costs.tolist(), unrealized.tolist())}
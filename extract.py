@@ -1,6 +1,5 @@
 import sys
 
-from calculator import Calculator
 from util import gui
 from util.table import NumericItem, formatFloatToMoney
 
@@ -20,10 +19,14 @@ class Extract:
 
         self.stockTable = self.ui.findChild(QTableWidget, 'stock_table')
 
+        self.renderedDataVersion = None
         self.initTable()
         self.updateWindow()
 
     def updateWindow(self):
+        # Nothing to re-render if the database hasn't changed since the last time
+        if (self.db.getDataVersion() == self.renderedDataVersion):
+            return
         self.updateAvailableYears()
         self.updateTable()
 
@@ -54,6 +57,7 @@ class Extract:
         self.updateTable()
 
     def updateTable(self):
+        self.renderedDataVersion = self.db.getDataVersion()
         self.stockTable.setSortingEnabled(False)
         year = self.year.currentData()
         self.fillTable(year)
@@ -62,9 +66,8 @@ class Extract:
     def fillTable(self, year):
         if (not year):
             return
-        ordersUpToYear = self.db.getOrdersInAscendingDateUpToYear(year)
-        calculator = Calculator(self.db)
-        ret = calculator.getYearExtract(ordersUpToYear)
+        # Position at the end of year, as computed by the ledger every tab shares
+        ret = self.db.getLedger().getYearExtract(year)
         # Now extract from return the 
         # TODO: Error out if we have negative number of stocks
         rows = []
@@ -0,0 +1,19 @@
+import collections
+import sys
+
+class FeeSchedule(collections.namedtuple('FeeSchedule', ['taxFee', 'taxRate', 'lossToDiscount', 'buyMultiplier', 'sellMultiplier'])):
+    # B3 rates plus the custom fee/rate and initial loss to discount from config. Buy and sell
+    # multipliers combine all rates, so a transaction value costs a multiplication and an
+    # addition. Immutable (and hashable), Database loads it once, see getFeeSchedule
+    TAX_SALES_PERCENTAGE = 0.0275
+    TAX_EMOLUMENTS_PERCENTAGE = 0.004105
+    TAX_IR_PERCENTAGE = 0.005
+
+    __slots__ = ()
+
+    @staticmethod
+    def fromTaxValues(taxValues):
+        # taxValues as in Database.getTaxValues: [taxFee, taxRate, lossToDiscount]
+        taxFee, taxRate, lossToDiscount = taxValues
+        taxes = (FeeSchedule.TAX_SALES_PERCENTAGE + FeeSchedule.TAX_EMOLUMENTS_PERCENTAGE + FeeSchedule.TAX_IR_PERCENTAGE + taxRate) / 100
+        return FeeSchedule(taxFee, taxRate, lossToDiscount, 1 + taxes, 1 - taxes)
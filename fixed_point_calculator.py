@@ -0,0 +1,192 @@
+import sys
+
+import numpy as np
+
+from calculator import Calculator
+from order_store import OrderStore
+
+# Setting that makes reports use FixedPointCalculator, '1' or '0', see createCalculator
+FIXED_POINT_SETTING = 'fixed_point'
+
+class FixedPointCalculator(Calculator):
+    # Same as Calculator with integer arithmetic. Prices are in centavos and tax rates in units of
+    # 1e-8 (B3's emoluments of 0.004105% don't fit in basis points), so transaction values are
+    # exact integers in units of 1e-10 real (UNITS_PER_REAL) and taxes are never rounded. The
+    # only rounding is of average values, half up to 1 / AVERAGE_SCALE unit, and months are
+    # summed in units. Stocks keep average values as floats as in Calculator, their exact
+    # integers are kept in averages
+    RATE_SCALE = 10 ** 8
+    UNITS_PER_REAL = 100 * RATE_SCALE
+    AVERAGE_SCALE = 10 ** 4
+    AVERAGE_UNITS_PER_REAL = UNITS_PER_REAL * AVERAGE_SCALE
+
+    def __init__(self, db):
+        super().__init__(db)
+        taxes = self.TAX_SALES_PERCENTAGE + self.TAX_EMOLUMENTS_PERCENTAGE + self.TAX_IR_PERCENTAGE + self.getCustomTaxRate()
+        taxRate = round(taxes * self.RATE_SCALE / 100)
+        # A value in centavos times these is in units
+        self.buyRate = self.RATE_SCALE + taxRate
+        self.sellRate = self.RATE_SCALE - taxRate
+        self.taxFee = round(self.getCustomTaxFee() * 100) * self.RATE_SCALE
+        # {code: [value, average]}, average is the integer value was converted from. Stocks are
+        # replaced when restored from checkpoints, so averages only hold while their value does
+        self.averages = {}
+
+    @staticmethod
+    def divideRounding(numerator, denominator):
+        # Integer division rounded half up. An odd denominator never leaves a remainder of
+        # exactly half of it
+        if (denominator < 0):
+            numerator, denominator = -numerator, -denominator
+        return (numerator + denominator // 2) // denominator
+
+    def getTransactionUnitsWithTaxes(self, amount, unitCentavos, isSell):
+        if (isSell):
+            return amount * unitCentavos * self.sellRate - self.taxFee
+        return amount * unitCentavos * self.buyRate + self.taxFee
+
+    def getTransactionValueWithTaxes(self, amount, unitValue, isSell):
+        return self.getTransactionUnitsWithTaxes(amount, round(unitValue * 100), isSell) / self.UNITS_PER_REAL
+
+    def getAverageAfterBuying(self, oldAmount, oldAverage, addingAmount, addingCentavos):
+        # Averages are in 1 / AVERAGE_SCALE units
+        addingUnits = self.getTransactionUnitsWithTaxes(addingAmount, addingCentavos, False)
+        return self.divideRounding(oldAmount * oldAverage + addingUnits * self.AVERAGE_SCALE, oldAmount + addingAmount)
+
+    def updateAverageValue(self, oldAmount, oldValue, addingAmount, addingValue):
+        oldAverage = round(oldValue * self.AVERAGE_UNITS_PER_REAL)
+        return self.getAverageAfterBuying(oldAmount, oldAverage, addingAmount, round(addingValue * 100)) / self.AVERAGE_UNITS_PER_REAL
+
+    def getSaleProfitUnits(self, amount, unitCentavos, average):
+        # Returns [totalSellingUnitsWithoutTaxes, profitUnits] of selling stocks bought at average
+        totalSellingUnits = self.getTransactionUnitsWithTaxes(amount, unitCentavos, True)
+        return [amount * unitCentavos * self.RATE_SCALE, totalSellingUnits - self.divideRounding(amount * average, self.AVERAGE_SCALE)]
+
+    def getAverage(self, code):
+        # Returns the [value, average] of the stock, see averages
+        stock = self.stocks[code]
+        average = self.averages.get(code)
+        if (average is None or average[0] != stock[1]):
+            average = self.averages[code] = [stock[1], round(stock[1] * self.AVERAGE_UNITS_PER_REAL)]
+        return average
+
+    @staticmethod
+    def getColumns(ordersInAscendingDate):
+        # Returns [codes, codeIndexes, isSells, amounts, unitCentavos] of the orders (a list or an
+        # OrderStore), each order's code as an index into codes. OrderStores have them as arrays already
+        if (isinstance(ordersInAscendingDate, OrderStore)):
+            store = ordersInAscendingDate
+            return [store.codes, store.codeIndexes.tolist(), (store.types == OrderStore.SELL).tolist(), store.amounts.tolist(),
+                    np.rint(store.values * 100).astype(np.int64).tolist()]
+        orders = ordersInAscendingDate
+        codes = {}
+        codeIndexes = [codes.setdefault(order[3], len(codes)) for order in orders]
+        return [list(codes), codeIndexes, [order[2] == 'V' for order in orders], [order[5] for order in orders],
+                [round(order[6] * 100) for order in orders]]
+
+    @staticmethod
+    def getDateStrs(ordersInAscendingDate, indexes):
+        if (isinstance(ordersInAscendingDate, OrderStore)):
+            return ordersInAscendingDate.take(indexes).getDateStrs()
+        return [ordersInAscendingDate[index][1] for index in indexes]
+
+    @staticmethod
+    def getOrders(ordersInAscendingDate):
+        # Orders are indexed, so iterables other than OrderStores are listed first
+        if (isinstance(ordersInAscendingDate, (list, OrderStore))):
+            return ordersInAscendingDate
+        return list(ordersInAscendingDate)
+
+    def getSales(self, ordersInAscendingDate):
+        # Updates stocks with the orders as updateStockAverageValueAndAmount does. Returns the columns
+        # [indexes, averageBuyingValues, totalSellingUnitsWithoutTaxes, profitUnits] of sales, indexes
+        # into ordersInAscendingDate (a list or an OrderStore). Every order goes through this loop, so
+        # getAverageAfterBuying and getSaleProfitUnits are inlined, stocks are looked up by code index
+        # and sales are kept as columns of numbers rather than a list per sale
+        ordersInAscendingDate = self.getOrders(ordersInAscendingDate)
+        codes, codeIndexes, isSells, amounts, unitCentavos = self.getColumns(ordersInAscendingDate)
+        # Codes without orders yet aren't added to stocks
+        stocks = [self.stocks.get(code) for code in codes]
+        averages = [self.getAverage(code) if stock else None for code, stock in zip(codes, stocks)]
+        buyRate = self.buyRate
+        sellRate = self.sellRate
+        taxFee = self.taxFee
+        rateScale = self.RATE_SCALE
+        averageScale = self.AVERAGE_SCALE
+        averageUnitsPerReal = self.AVERAGE_UNITS_PER_REAL
+        saveCheckpoints = self.checkpointDate is not None
+        if (saveCheckpoints):
+            dateStrs = self.getDateStrs(ordersInAscendingDate, range(len(codeIndexes)))
+        sales = [[], [], [], []]
+        indexes, averageBuyingValues, totalSellingUnitsWithoutTaxes, profitUnits = sales
+        for index, code, isSell, amount, centavos in zip(range(len(codeIndexes)), codeIndexes, isSells, amounts, unitCentavos):
+            if (saveCheckpoints):
+                self.saveCheckpointIfMonthEnded(dateStrs[index])
+            stock = stocks[code]
+            if (stock is None):
+                stock = stocks[code] = self.stocks[codes[code]] = [0, 0]
+                averages[code] = self.getAverage(codes[code])
+            average = averages[code]
+            if (isSell):
+                # Selling a stock won't change its average value
+                stock[0] -= amount
+                indexes.append(index)
+                averageBuyingValues.append(stock[1])
+                totalSellingUnitsWithoutTaxes.append(amount * centavos * rateScale)
+                totalBuyingUnits = (amount * average[1] + averageScale // 2) // averageScale
+                profitUnits.append(amount * centavos * sellRate - taxFee - totalBuyingUnits)
+                continue
+            newAmount = stock[0] + amount
+            cost = stock[0] * average[1] + (amount * centavos * buyRate + taxFee) * averageScale
+            average[1] = (cost + newAmount // 2) // newAmount if newAmount > 0 else self.divideRounding(cost, newAmount)
+            stock[0] = newAmount
+            stock[1] = average[0] = average[1] / averageUnitsPerReal
+        return sales
+
+    def updateStockAverageValueAndAmount(self, order):
+        self.getSales([order])
+
+    def getSaleProfit(self, order):
+        totalSellingUnitsWithoutTaxes, profitUnits = self.getSaleProfitUnits(order[5], round(order[6] * 100), self.getAverage(order[3])[1])
+        return [totalSellingUnitsWithoutTaxes / self.UNITS_PER_REAL, self.stocks[order[3]][1], profitUnits / self.UNITS_PER_REAL]
+
+    def getYearExtract(self, ordersUpToYear):
+        self.getSales(ordersUpToYear)
+        return self.stocks
+
+    def getProfitsAndLossesOfSales(self, ordersInAscendingDate, sales):
+        # Rows of getProfitsAndLosses from the sales of getSales
+        indexes, averageBuyingValues, totalSellingUnitsWithoutTaxes, profitUnits = sales
+        if (isinstance(ordersInAscendingDate, OrderStore)):
+            store = ordersInAscendingDate.take(indexes)
+            rows = zip(store.getDateStrs(), store.getCodeStrs(), store.amounts.tolist(), store.values.tolist())
+        else:
+            rows = ([order[1], order[3], order[5], order[6]] for order in (ordersInAscendingDate[index] for index in indexes))
+        return [[dateStr, code, averageBuyingValue, amount, value, profit / self.UNITS_PER_REAL]
+                for [dateStr, code, amount, value], averageBuyingValue, profit in zip(rows, averageBuyingValues, profitUnits)]
+
+    def getMonthlyReportOfSales(self, ordersInAscendingDate, sales):
+        # getMonthlyReport from the sales of getSales. Months are summed in units and only then converted
+        indexes, averageBuyingValues, totalSellingUnitsWithoutTaxes, profitUnits = sales
+        ret = {}
+        for dateStr, totalSelling, profit in zip(self.getDateStrs(ordersInAscendingDate, indexes), totalSellingUnitsWithoutTaxes, profitUnits):
+            value = ret.get(dateStr[:7])
+            if (value is None):
+                value = ret[dateStr[:7]] = [0, 0]
+            value[0] += totalSelling
+            value[1] += profit
+        return {self.getMonthKey(month + '-01'): [value[0] / self.UNITS_PER_REAL, value[1] / self.UNITS_PER_REAL] for month, value in ret.items()}
+
+    def getProfitsAndLosses(self, ordersInAscendingDate):
+        ordersInAscendingDate = self.getOrders(ordersInAscendingDate)
+        return self.getProfitsAndLossesOfSales(ordersInAscendingDate, self.getSales(ordersInAscendingDate))
+
+    def getMonthlyReport(self, ordersInAscendingDate):
+        ordersInAscendingDate = self.getOrders(ordersInAscendingDate)
+        return self.getMonthlyReportOfSales(ordersInAscendingDate, self.getSales(ordersInAscendingDate))
+
+def createCalculator(db):
+    # Calculator of the reports, FixedPointCalculator when chosen in settings (see Init)
+    if (db.getSetting(FIXED_POINT_SETTING) == '1'):
+        return FixedPointCalculator(db)
+    return Calculator(db)
@@ -1,8 +1,10 @@
 import sys
 
+from fixed_point_calculator import FIXED_POINT_SETTING
+from parallel_calculator import PARALLEL_SETTING
 from util import gui
 from util.table import formatFloatToMoney
-from PySide2.QtWidgets import QLineEdit, QMessageBox
+from PySide2.QtWidgets import QCheckBox, QLineEdit, QMessageBox
 
 class Init:
     def __init__(self, db):
@@ -12,10 +14,15 @@ class Init:
         self.taxFee = self.ui.findChild(QLineEdit, 'tax_fee')
         self.taxRate = self.ui.findChild(QLineEdit, 'tax_rate')
         self.lossToDiscount = self.ui.findChild(QLineEdit, 'loss_to_discount')
+        self.fixedPoint = self.ui.findChild(QCheckBox, 'fixed_point')
+        self.parallel = self.ui.findChild(QCheckBox, 'parallel')
 
         self.taxFee.editingFinished.connect(self.updateValues)
         self.taxRate.editingFinished.connect(self.updateValues)
         self.lossToDiscount.editingFinished.connect(self.updateValues)
+        # Clicks only, setChecked in updateWindow doesn't update the setting back
+        self.fixedPoint.clicked.connect(self.updateFixedPoint)
+        self.parallel.clicked.connect(self.updateParallel)
 
         self.updateWindow()
 
@@ -38,11 +45,21 @@ class Init:
         self.db.updateTaxValues(taxFee, taxRate, lossToDiscount)
         self.updateWindow()
 
+    def updateFixedPoint(self, checked):
+        self.db.updateSetting(FIXED_POINT_SETTING, '1' if checked else '0')
+        self.updateWindow()
+
+    def updateParallel(self, checked):
+        self.db.updateSetting(PARALLEL_SETTING, '1' if checked else '0')
+        self.updateWindow()
+
     def updateWindow(self):
         taxValues = self.db.getTaxValues()
         self.taxFee.setText(formatFloatToMoney(taxValues[0]))
         self.taxRate.setText(formatFloatToMoney(taxValues[1]))
         self.lossToDiscount.setText(formatFloatToMoney(taxValues[2]))
+        self.fixedPoint.setChecked(self.db.getSetting(FIXED_POINT_SETTING) == '1')
+        self.parallel.setChecked(self.db.getSetting(PARALLEL_SETTING) == '1')
 
     def getUi(self):
         return self.ui
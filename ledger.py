@@ -0,0 +1,120 @@
+import sys
+
+import numpy as np
+
+from fixed_point_calculator import FixedPointCalculator, createCalculator
+from order_store import OrderStore
+from parallel_calculator import createVectorizedCalculator
+
+class Ledger:
+    # Every report shown by the tabs, computed together by walking orders once:
+    # - profitsAndLosses: rows per sale, as Calculator.getProfitsAndLosses
+    # - monthlyReport: {month: [totalSales, profit]}, as Calculator.getMonthlyReport
+    # - yearExtracts: {year: {code: [amount, avgValue]}} at the end of each year with orders
+    # - freeTaxesReports/payingTaxesReports: {year: {month: [...]}}, as Calculator.get*TaxesReport
+    # Orders in an OrderStore are processed with array operations by VectorizedCalculator (or
+    # ParallelCalculator, see createVectorizedCalculator), or a year at a time by
+    # FixedPointCalculator when chosen in settings. The calculator keeps the
+    # stocks after the last order processed (lastDateStr), so orders coming after it can be
+    # appended without processing the previous ones again
+    def __init__(self, db, ordersInAscendingDate):
+        self.calculator = createCalculator(db)
+        self.lastDateStr = ''
+        self.profitsAndLosses = []
+        self.monthlyReport = {}
+        self.yearExtracts = {}
+        if (isinstance(ordersInAscendingDate, OrderStore)):
+            self.processOrderStore(ordersInAscendingDate)
+        else:
+            self.processOrders(ordersInAscendingDate)
+        self.updateTaxesReports()
+
+    def appendOrders(self, ordersInAscendingDate):
+        # Orders must come after lastDateStr. Months are kept in ascending order, so the
+        # losses to discount are carried again through the monthly report only
+        self.processOrders(ordersInAscendingDate)
+        self.updateTaxesReports()
+
+    def restore(self, lastDateStr, profitsAndLosses, monthlyReport, yearExtracts):
+        # Reports saved after processing orders up to lastDateStr, see Database.loadLedger.
+        # The calculator goes on from the stocks at the end of the last year
+        self.lastDateStr = lastDateStr
+        self.profitsAndLosses = profitsAndLosses
+        self.monthlyReport = monthlyReport
+        self.yearExtracts = yearExtracts
+        if (len(yearExtracts) > 0):
+            self.calculator.stocks = {code: list(stock) for code, stock in yearExtracts[max(yearExtracts)].items()}
+        self.updateTaxesReports()
+
+    def updateTaxesReports(self):
+        self.freeTaxesReports = self.calculator.getFreeTaxesReportsPerYear(self.monthlyReport)
+        self.payingTaxesReports = self.calculator.getPayingTaxesReportsPerYear(self.monthlyReport)
+
+    def processOrders(self, ordersInAscendingDate):
+        calculator = self.calculator
+        year = None
+        for order in ordersInAscendingDate:
+            self.lastDateStr = order[1]
+            # Keep the position once all orders of a year are processed
+            orderYear = int(order[1][:4])
+            if (year is not None and orderYear != year):
+                self.saveYearExtract(year)
+            year = orderYear
+            calculator.updateStockAverageValueAndAmount(order)
+            if (order[2] != 'V'):
+                continue
+            totalSellingValueWithoutTaxes, averageBuyingValue, profit = calculator.getSaleProfit(order)
+            self.profitsAndLosses.append([order[1], order[3], averageBuyingValue, order[5], order[6], profit])
+            dateString = calculator.getMonthKey(order[1])
+            if dateString not in self.monthlyReport:
+                self.monthlyReport[dateString] = [0, 0]
+            self.monthlyReport[dateString][0] += totalSellingValueWithoutTaxes
+            self.monthlyReport[dateString][1] += profit
+        if (year is not None):
+            self.saveYearExtract(year)
+
+    def processOrderStore(self, store):
+        if (isinstance(self.calculator, FixedPointCalculator)):
+            self.processOrderStoreByYear(store)
+            return
+        vectorizedCalculator = createVectorizedCalculator(self.calculator.db, store)
+        self.profitsAndLosses = vectorizedCalculator.getProfitsAndLosses()
+        self.monthlyReport = vectorizedCalculator.getMonthlyReport()
+        self.yearExtracts = vectorizedCalculator.getYearExtracts()
+        if (len(store) > 0):
+            self.lastDateStr = store.slice(len(store) - 1, len(store)).getDateStrs()[0]
+            self.calculator.stocks = {code: list(stock) for code, stock in self.yearExtracts[max(self.yearExtracts)].items()}
+
+    def processOrderStoreByYear(self, store):
+        # Sales of each year are computed at once, stocks at the end of it are the year extract
+        calculator = self.calculator
+        years = np.unique((store.days + OrderStore.EPOCH).astype('datetime64[Y]').astype(np.int64) + 1970).tolist()
+        for year in years:
+            yearStore = store.sliceAfterDateUpToYear(str(year - 1).zfill(4) + '-12-31', year)
+            sales = calculator.getSales(yearStore)
+            self.profitsAndLosses.extend(calculator.getProfitsAndLossesOfSales(yearStore, sales))
+            self.monthlyReport.update(calculator.getMonthlyReportOfSales(yearStore, sales))
+            self.saveYearExtract(year)
+        if (len(store) > 0):
+            self.lastDateStr = store.slice(len(store) - 1, len(store)).getDateStrs()[0]
+
+    def saveYearExtract(self, year):
+        self.yearExtracts[year] = {code: list(stock) for code, stock in self.calculator.stocks.items()}
+
+    def getTaxesRows(self):
+        # Free and paying taxes months of every year, as
+        # [year, month, isFree, totalSales, lossToDiscount, discountedLoss, profit, taxToPay]
+        rows = []
+        for year in sorted(set(self.freeTaxesReports) | set(self.payingTaxesReports)):
+            for month, value in self.freeTaxesReports.get(year, {}).items():
+                rows.append([year, month, True, value[0], 0, 0, value[1], 0])
+            for month, value in self.payingTaxesReports.get(year, {}).items():
+                rows.append([year, month, False] + value)
+        return rows
+
+    def getYearExtract(self, year):
+        # Position at the end of year, which is the one of the latest year with orders before it
+        yearsWithOrders = [yearWithOrders for yearWithOrders in self.yearExtracts if yearWithOrders <= year]
+        if (len(yearsWithOrders) == 0):
+            return {}
+        return self.yearExtracts[max(yearsWithOrders)]
@@ -1,7 +1,7 @@
 import sys
 
 from util import gui
-from calculator import Calculator
+from fixed_point_calculator import createCalculator
 from util.table import NumericItem, formatFloatToMoney
 
 from PySide2.QtWidgets import QAbstractItemView, QCalendarWidget, QComboBox, QDialogButtonBox, QLineEdit, QMessageBox, QPushButton, QTableWidget, QTableWidgetItem
@@ -23,6 +23,7 @@ class ListOrder:
         self.addOrderButton = self.ui.findChild(QPushButton, 'add_order')
         self.addOrderButton.clicked.connect(self.openAddOrderDialog)
 
+        self.renderedDataVersion = None
         self.initTable()
         self.updateWindow()
 
@@ -34,22 +35,27 @@ class ListOrder:
         self.orderTable.setSelectionBehavior(QAbstractItemView.SelectRows)
 
     def updateWindow(self):
+        # Nothing to re-render if the database hasn't changed since the last time
+        if (self.db.getDataVersion() == self.renderedDataVersion):
+            return
         self.updateTable()
 
     def updateTable(self):
+        self.renderedDataVersion = self.db.getDataVersion()
         self.orderTable.setSortingEnabled(False)
         self.fillTable()
         self.orderTable.setSortingEnabled(True)
 
     def fillTable(self):
         # Get orders from database
-        orders = self.db.getOrdersInAscendingDate()
+        orders = self.db.getOrderStore()
+        calculator = createCalculator(self.db)
         # Now let's print data into table effectively
         self.orderTable.setRowCount(len(orders))
         row = 0
         for order in orders:
             # We are not using company name since it appears in only some spreadsheets
-            del order[4]
+            order = order[:4] + order[5:]
             # Is it a sell or buy operation?
             isSell = order[2] == 'V'
             # TODO: Extract columns' indexes to variables
@@ -69,7 +75,6 @@ class ListOrder:
                     item = QTableWidgetItem(str(order[i]))
                 self.orderTable.setItem(row, i-1, item)
             # Add total includig taxes
-            calculator = Calculator(self.db)
             totalValue = calculator.getTransactionValueWithTaxes(order[4], order[5], isSell)
             totalItem = NumericItem(formatFloatToMoney(totalValue))
             totalItem.setData(QtCore.Qt.UserRole, totalValue)
@@ -143,7 +148,9 @@ class ListOrder:
         except:
             QMessageBox.critical(self.addOrderUi, 'ERRO', 'Preencha o valor corretamente (separe apenas os centavos com . ou ,)', QMessageBox.StandardButton.Abort)
             return
-        self.db.addOrders([[orderDate, 'C' if orderType == 'Compra' else 'V', orderCode, '', orderAmount, orderValue]])
+        if (self.db.addOrders([[orderDate, 'C' if orderType == 'Compra' else 'V', orderCode, '', orderAmount, orderValue]]) < 0):
+            QMessageBox.critical(self.addOrderUi, 'ERRO', 'Houve um erro ao adicionar a ordem no banco de dados', QMessageBox.StandardButton.Abort)
+            return
         self.updateTable()
         self.addOrderUi.close()
 
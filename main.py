@@ -10,6 +10,7 @@ from register_order import *
 from reports import *
 from util import gui
 
+from PySide2.QtCore import Qt
 from PySide2.QtWidgets import QApplication, QMessageBox, QTabWidget, QVBoxLayout
 
 class Main:
@@ -44,8 +45,10 @@ class Main:
         self.listOrder = ListOrder(self.db)
         listOrderLayout.addWidget(self.listOrder.getUi())
 
-        self.registerOrder = RegisterOrder(self.db)
+        self.registerOrder = RegisterOrder(self.db, self.app)
         self.tabWindow.addTab(self.registerOrder.getUi(), 'Importar ordens')
+        self.registerOrder.ordersImported.connect(self.updateCurrentWindow)
+        self.app.aboutToQuit.connect(self.registerOrder.stopThreads)
 
         self.extract = Extract(self.db)
         self.tabWindow.addTab(self.extract.getUi(), 'Extratos anuais')
@@ -62,10 +65,26 @@ class Main:
 
         # Update windows once tab changes
         self.tabWindow.currentChanged.connect(self.updateWindow)
+        self.tabWindow.currentChanged.connect(self.updatePositionVisibility)
+        self.app.applicationStateChanged.connect(self.updatePositionVisibility)
+
+    def updatePositionVisibility(self):
+        # Prices are only fetched while the position tab is seen
+        visible = self.tabWindow.currentWidget() == self.position.getUi() and self.app.applicationState() != Qt.ApplicationHidden
+        self.position.setVisible(visible)
+
+    def updateCurrentWindow(self):
+        self.updateWindow(self.tabWindow.currentIndex())
 
     def updateWindow(self, index):
+        try:
+            self.updateTab(index)
+        except DatabaseError as e:
+            QMessageBox.critical(self.mainWindow, 'ERRO', 'Não foi possível ler as ordens do banco de dados: ' + str(e), QMessageBox.StandardButton.Abort)
+
+    def updateTab(self, index):
         # Once the tab has gone to list the orders, update it
-        # TODO: Only update/re-render if the database has changed since we started
+        # Each tab only re-renders if the database has changed since it last did
         if (index == 0):
             self.init.updateWindow()
         elif (index == 1):
@@ -0,0 +1,59 @@
+import csv
+import os
+import sys
+
+import numpy as np
+
+from order_store import OrderStore
+
+# Parquet support is optional, it needs pyarrow (see requirements-optional.txt)
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Columns of orders in CSV and Parquet files, as in the orders table without ids
+ORDER_FILE_COLUMNS = ['date', 'type', 'code', 'name', 'amount', 'value']
+ORDER_FILE_TYPES = ['.csv', '.parquet']
+PARQUET_ROW_GROUP_SIZE = 1 << 20
+
+def getOrderFileType(fileName):
+    # Returns '.csv' or '.parquet', or '' if the file isn't an order file (i.e. a spreadsheet)
+    fileType = os.path.splitext(fileName)[1].lower()
+    return fileType if fileType in ORDER_FILE_TYPES else ''
+
+def isParquetSupported():
+    return pyarrow is not None
+
+def exportOrdersToCsv(db, fileName):
+    # Rows are written while read from the database. Values are written as Python prints
+    # them, which always reads back as the same float. Returns the number of orders
+    numOrders = 0
+    with open(fileName, 'w', newline='', encoding='utf-8') as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(ORDER_FILE_COLUMNS)
+        for order in db.iterateOrdersInAscendingDate():
+            writer.writerow(order[1:])
+            numOrders += 1
+    return numOrders
+
+def exportOrdersToParquet(db, fileName):
+    # Columns come from the order store: dates as days since 1970-01-01 are Parquet's date32 and
+    # codes are already dictionary encoded. Names are dictionary encoded as well, as they repeat
+    # for each code, and values are read exactly. Returns the number of orders
+    store = db.getOrderStore()
+    names, values = db.getOrderNamesAndValues()
+    table = pyarrow.table([pyarrow.array(store.days, type=pyarrow.date32()),
+                           pyarrow.array(np.frombuffer(store.types.tobytes(), dtype='S1').astype(str)).dictionary_encode(),
+                           pyarrow.DictionaryArray.from_arrays(store.codeIndexes, pyarrow.array(store.codes, type=pyarrow.string())),
+                           pyarrow.array(names, type=pyarrow.string()).dictionary_encode(),
+                           pyarrow.array(store.amounts),
+                           pyarrow.array(values, type=pyarrow.float64())], names=ORDER_FILE_COLUMNS)
+    pyarrow.parquet.write_table(table, fileName, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    return len(store)
+
+def exportOrders(db, fileName):
+    if (getOrderFileType(fileName) == '.parquet'):
+        return exportOrdersToParquet(db, fileName)
+    return exportOrdersToCsv(db, fileName)
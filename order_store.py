@@ -0,0 +1,85 @@
+import sys
+
+import numpy as np
+
+class OrderStore:
+    # Orders in ascending date, kept as one array per column instead of one list per order:
+    # dates as days since 1970-01-01, codes as indexes into a list of distinct codes and
+    # types as the 'C'/'V' byte. Iterating yields rows laid out as in the database
+    # ([id, date, type, code, name, amount, value]), names aren't kept
+    EPOCH = np.datetime64('1970-01-01', 'D')
+    BUY = ord('C')
+    SELL = ord('V')
+
+    def __init__(self, ids, days, types, codeIndexes, codes, amounts, values):
+        self.ids = ids
+        self.days = days
+        self.types = types
+        self.codeIndexes = codeIndexes
+        self.codes = codes
+        self.amounts = amounts
+        self.values = values
+
+    @staticmethod
+    def fromStrings(ids, days, types, codes, amounts, values):
+        # Build from comma-separated columns (types concatenated without separator),
+        # numbers are parsed straight into arrays and codes encoded on first appearance
+        if (len(ids) == 0):
+            return OrderStore.empty()
+        codeIndexes = {}
+        codeIndexesPerOrder = [codeIndexes.setdefault(code, len(codeIndexes)) for code in codes.split(',')]
+        return OrderStore(np.fromstring(ids, dtype=np.int64, sep=','),
+                          np.fromstring(days, dtype=np.int32, sep=','),
+                          np.frombuffer(types.encode('ascii'), dtype=np.uint8),
+                          np.array(codeIndexesPerOrder, dtype=np.int32),
+                          list(codeIndexes),
+                          np.fromstring(amounts, dtype=np.float64, sep=',').astype(np.int64),
+                          np.fromstring(values, dtype=np.float64, sep=','))
+
+    @staticmethod
+    def empty():
+        return OrderStore(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint8),
+                          np.zeros(0, dtype=np.int32), [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+
+    @staticmethod
+    def getDayFromDateStr(dateStr):
+        return int((np.datetime64(dateStr, 'D') - OrderStore.EPOCH).astype(np.int64))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return zip(self.ids.tolist(), self.getDateStrs(), self.getTypeStrs(), self.getCodeStrs(),
+                   [''] * len(self.ids), self.amounts.tolist(), self.values.tolist())
+
+    def getDateStrs(self):
+        return np.datetime_as_string(self.days + self.EPOCH, unit='D').tolist()
+
+    def getTypeStrs(self):
+        return self.types.tobytes().decode('ascii')
+
+    def getCodeStrs(self):
+        return np.array(self.codes, dtype=object)[self.codeIndexes].tolist()
+
+    def getNumBytes(self):
+        return (self.ids.nbytes + self.days.nbytes + self.types.nbytes + self.codeIndexes.nbytes +
+                self.amounts.nbytes + self.values.nbytes + sum(sys.getsizeof(code) for code in self.codes))
+
+    def slice(self, first, last):
+        # Slicing arrays gives views, no orders are copied
+        return OrderStore(self.ids[first:last], self.days[first:last], self.types[first:last],
+                          self.codeIndexes[first:last], self.codes, self.amounts[first:last], self.values[first:last])
+
+    def take(self, indexes):
+        return OrderStore(self.ids[indexes], self.days[indexes], self.types[indexes],
+                          self.codeIndexes[indexes], self.codes, self.amounts[indexes], self.values[indexes])
+
+    def sliceAfterDateUpToYear(self, dateStr, year):
+        first = 0
+        if (dateStr):
+            first = int(np.searchsorted(self.days, self.getDayFromDateStr(dateStr), 'right'))
+        last = int(np.searchsorted(self.days, self.getDayFromDateStr(str(int(year) + 1).zfill(4) + '-01-01'), 'left'))
+        return self.slice(first, max(first, last))
+
+    def sliceUpToYear(self, year):
+        return self.sliceAfterDateUpToYear('', year)
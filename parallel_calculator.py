@@ -0,0 +1,79 @@
+import multiprocessing
+import sys
+
+import numpy as np
+
+from vectorized_calculator import VectorizedCalculator
+
+# Setting that makes the ledger use ParallelCalculator for large ledgers, '1' or '0', see createVectorizedCalculator
+PARALLEL_SETTING = 'parallel'
+
+class FeeScheduleDatabase:
+    # Stands for the database in worker processes, calculators only read the fee schedule from it
+    def __init__(self, feeSchedule):
+        self.feeSchedule = feeSchedule
+
+    def getFeeSchedule(self):
+        return self.feeSchedule
+
+def computeChunk(feeSchedule, store):
+    # Run in a worker process over the orders of some codes, returns per order arrays
+    # (in the chunk's order) of [averageValueBefore, profit, position, averageValueAfter]
+    vectorizedCalculator = VectorizedCalculator(FeeScheduleDatabase(feeSchedule), store)
+    positions = np.empty(len(store), dtype=np.int64)
+    positions[vectorizedCalculator.sortedIndexes] = vectorizedCalculator.sortedPositions
+    averageValuesAfter = np.empty(len(store))
+    averageValuesAfter[vectorizedCalculator.sortedIndexes] = vectorizedCalculator.sortedAverageValuesAfter
+    return [vectorizedCalculator.averageValuesBefore, vectorizedCalculator.profits, positions, averageValuesAfter]
+
+class ParallelCalculator(VectorizedCalculator):
+    # Same results as VectorizedCalculator, with codes split into chunks of about chunkSize
+    # orders that worker processes compute independently, since the average value of a
+    # code never depends on others. Results are merged back in store (date) order, where
+    # the monthly report and year extracts are computed as usual
+    DEFAULT_CHUNK_SIZE = 100000
+    # Fewer orders than this are computed faster in process than by starting workers and sending them orders
+    MIN_ORDERS = 500000
+
+    def __init__(self, db, store, numWorkers=None, chunkSize=DEFAULT_CHUNK_SIZE):
+        self.numWorkers = numWorkers if numWorkers else multiprocessing.cpu_count()
+        self.chunkSize = chunkSize
+        super().__init__(db, store)
+
+    def getChunks(self):
+        # Return the indexes of the orders of each chunk, a code is never split
+        codeFirstIndexes = np.flatnonzero(np.diff(self.sortedCodes, prepend=-1))
+        chunkFirstIndexes = codeFirstIndexes[np.unique(codeFirstIndexes // self.chunkSize, return_index=True)[1]]
+        chunkLastIndexes = np.append(chunkFirstIndexes[1:], len(self.sortedCodes))
+        return [np.sort(self.sortedIndexes[first:last]) for first, last in zip(chunkFirstIndexes.tolist(), chunkLastIndexes.tolist())]
+
+    def computeAverageValues(self):
+        store = self.store
+        numOrders = len(store)
+        self.sortedIndexes = np.argsort(store.codeIndexes, kind='stable')
+        self.sortedCodes = store.codeIndexes[self.sortedIndexes]
+        chunks = self.getChunks()
+        tasks = [[self.calculator.feeSchedule, store.take(indexes)] for indexes in chunks]
+        if (self.numWorkers == 1 or len(tasks) <= 1):
+            results = [computeChunk(*task) for task in tasks]
+        else:
+            with multiprocessing.Pool(min(self.numWorkers, len(tasks))) as pool:
+                results = pool.starmap(computeChunk, tasks)
+
+        self.averageValuesBefore = np.zeros(numOrders)
+        self.profits = np.zeros(numOrders)
+        positions = np.zeros(numOrders, dtype=np.int64)
+        averageValuesAfter = np.zeros(numOrders)
+        for indexes, result in zip(chunks, results):
+            self.averageValuesBefore[indexes] = result[0]
+            self.profits[indexes] = result[1]
+            positions[indexes] = result[2]
+            averageValuesAfter[indexes] = result[3]
+        self.sortedPositions = positions[self.sortedIndexes]
+        self.sortedAverageValuesAfter = averageValuesAfter[self.sortedIndexes]
+
+def createVectorizedCalculator(db, store):
+    # ParallelCalculator when chosen in settings (see Init) and store has enough orders, one worker per core
+    if (db.getSetting(PARALLEL_SETTING) == '1' and len(store) >= ParallelCalculator.MIN_ORDERS):
+        return ParallelCalculator(db, store)
+    return VectorizedCalculator(db, store)
@@ -2,73 +2,104 @@ import datetime
 import sys
 import time
 
-from calculator import Calculator
+from price_provider import PriceFetcher, YahooPriceProvider, getNextMarketOpening, isMarketOpen
 from util import gui
 from util.table import NumericItem, formatFloatToMoney
 
 from PySide2.QtGui import QColor, QBrush
 from PySide2.QtWidgets import QAbstractItemView, QTableWidget, QTableWidgetItem
 from PySide2.QtCore import QThread, Signal, Slot, Qt, QObject, QTimer
-import yfinance as yf
 
 class FetchPriceWorker(QObject):
-    INTERVAL_TO_FETCH_IN_SECONDS = 10
-    INTERVAL_RETRY_NO_DATA_IN_SECONDS = 1
-    fetchingFinished = Signal(dict)
+    # Codes are {code: expiration time of its quote in seconds since the epoch}, only expired ones are
+    # fetched. Nothing is fetched while inactive, i.e. while prices aren't seen. Quotes expire after
+    # QUOTE_TTL_IN_SECONDS while the market is open, otherwise on its next opening
+    INTERVAL_TO_CHECK_IN_SECONDS = 1
+    QUOTE_TTL_IN_SECONDS = 60
+    # Prices and their TTL in seconds
+    fetchingFinished = Signal(dict, int)
 
-    def __init__(self):
+    def __init__(self, provider):
         super().__init__()
         self.codes = dict()
+        self.fetcher = PriceFetcher(provider)
+        self.active = False
+        # Checks are scheduled for the next expiration, restarting the timer reschedules them
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.fetch)
 
     @Slot(dict)
     def setCodes(self, codes):
         self.codes = codes
+        if (self.active):
+            self.timer.start(0)
+
+    @Slot(bool)
+    def setActive(self, active):
+        self.active = active
+        if (self.active):
+            self.timer.start(0)
+        else:
+            self.timer.stop()
+
+    def getQuoteTtl(self, now):
+        if (isMarketOpen(now)):
+            return __class__.QUOTE_TTL_IN_SECONDS
+        return int(getNextMarketOpening(now) - now)
 
     @Slot()
     def fetch(self):
-        ## Fetch price for each code
-        data = {}
-        try:
-            # Append .SA (Sociedade Anomima) for brazilian stocks
-            stockData = yf.download(" ".join([x + ".SA" for x in self.codes]), period="minute", progress=False)
-            if stockData.shape[0]:
-                closeData = stockData.iloc[0]['Close']
-                # Assemble dictionary with stock name and price in the right order.
-                data = dict(zip([x[:-3] for x in list(closeData.index)], list(closeData)))
-        except:
-            # Avoid threading dying due to no internet connection
-            pass
-
+        ## Fetch price for each code whose quote expired
+        if (not self.active):
+            return
+        now = time.time()
+        codesToFetch = [code for code, expiration in self.codes.items() if expiration <= now]
+        data = self.fetcher.fetch(codesToFetch, now) if codesToFetch else {}
         if data:
-            self.fetchingFinished.emit(data)
-            interval = __class__.INTERVAL_TO_FETCH_IN_SECONDS
-        else:
-            interval = __class__.INTERVAL_RETRY_NO_DATA_IN_SECONDS
+            ttl = self.getQuoteTtl(now)
+            for code in data:
+                self.codes[code] = now + ttl
+            self.fetchingFinished.emit(data, ttl)
 
-        QTimer.singleShot(interval * 1000, self.fetch)
+        # Sleep until a quote expires, a code is retried or the provider's backoff is over
+        if (len(self.codes) == 0):
+            return
+        nextFetchTime = min(self.fetcher.getNextFetchTime(code, expiration) for code, expiration in self.codes.items())
+        interval = max(__class__.INTERVAL_TO_CHECK_IN_SECONDS, nextFetchTime - time.time())
+        self.timer.start(int(interval * 1000))
 
 class FetchPriceController(QObject):
-    fetchingFinished = Signal(dict)
+    fetchingFinished = Signal(dict, int)
     THREAD_SYNC_TIMEOUT_SECONDS = 5
 
     _codesUpdated = Signal(dict)
+    _activeChanged = Signal(bool)
 
-    def __init__(self, parent = None):
+    def __init__(self, provider, parent = None):
         super().__init__(parent)
         self.shouldExit = False
         self.thread = QThread()
+        self.source = provider.getSource()
 
-        self.worker = FetchPriceWorker()
+        self.worker = FetchPriceWorker(provider)
         self.worker.moveToThread(self.thread)
         self.worker.fetchingFinished.connect(self.fetchingFinished)
         self._codesUpdated.connect(self.worker.setCodes)
+        self._activeChanged.connect(self.worker.setActive)
 
         self.thread.started.connect(self.worker.fetch)
         self.thread.finished.connect(self.thread.deleteLater)
 
+    def getSource(self):
+        return self.source
+
     def updateCodes(self, codes):
         self._codesUpdated.emit(codes)
 
+    def setActive(self, active):
+        self._activeChanged.emit(active)
+
     @Slot()
     def quit(self):
         self.thread.quit()
@@ -77,16 +108,24 @@ class FetchPriceController(QObject):
 
 
 class Position(QObject):
-    def __init__(self, parent, db):
+    def __init__(self, parent, db, provider=None):
         super().__init__(parent)
         self.ui = gui.load_ui('./windows/position.ui')
         self.db = db
 
         self.stockTable = self.ui.findChild(QTableWidget, 'stock_table')
-        self.currentValues = {}
+        # Quotes cached from previous runs are shown until fetched again, see Database.getQuotes
+        self.quotes = self.db.getQuotes()
+        self.renderedDataVersion = None
+        # Holdings of the rendered data version, {code: [amount, average value]}, and the cells of
+        # each code that change with its price, updated in place as prices arrive
+        self.holdings = {}
+        self.currentValueItems = {}
+        self.profitItems = {}
+        self.calculator = None
         
-        # Create thread to fetch prices
-        self.fetchPriceController = FetchPriceController(self)
+        # Create thread to fetch prices, from Yahoo unless another provider is given
+        self.fetchPriceController = FetchPriceController(provider if provider else YahooPriceProvider(), self)
         self.fetchPriceController.fetchingFinished.connect(self.updateCurrentPrices)
 
         self.initTable()
@@ -94,14 +133,35 @@ class Position(QObject):
 
         self.fetchPriceController.thread.start()
 
-    def updateCurrentPrices(self, data):
-        self.currentValues = data
-        self.updateWindow()
+    def updateCurrentPrices(self, data, ttl):
+        timestamp = int(time.time())
+        source = self.fetchPriceController.getSource()
+        self.db.updateQuotes(data, timestamp, source, ttl)
+        # Only the cells of the codes fetched change, the table keeps its sorting and selection
+        for code, price in data.items():
+            self.quotes[code] = [price, timestamp, source, ttl]
+            if (code in self.holdings):
+                amount, avgValue = self.holdings[code]
+                currentValue = self.setCurrentValue(self.currentValueItems[code], code)
+                self.setProfitValue(self.profitItems[code], amount, currentValue, avgValue)
+
+    def getQuoteExpiration(self, code):
+        if (code not in self.quotes):
+            return 0
+        price, timestamp, source, ttl = self.quotes[code]
+        return timestamp + ttl
+
+    def setVisible(self, visible):
+        # Prices are only fetched while seen, the cached ones are shown meanwhile
+        self.fetchPriceController.setActive(visible)
 
     def stopThreads(self):
         self.fetchPriceController.quit()
 
     def updateWindow(self):
+        # Nothing to re-render if the database hasn't changed since the last time
+        if (self.db.getDataVersion() == self.renderedDataVersion):
+            return
         self.updateTable()
 
     def initTable(self):
@@ -114,6 +174,7 @@ class Position(QObject):
         self.stockTable.setSelectionBehavior(QAbstractItemView.SelectRows)
 
     def updateTable(self):
+        self.renderedDataVersion = self.db.getDataVersion()
         self.stockTable.setSortingEnabled(False)
         currentDate = datetime.datetime.now()
         self.fillTable(currentDate.year)
@@ -127,64 +188,73 @@ class Position(QObject):
         else:
             return QColor('white')
 
-    def setCurrentValue(self, row, column, code):
+    def setCurrentValue(self, currentValueItem, code):
         # Get current value
         currentValue = 0.0
-        if (code in self.currentValues):
-            currentValue = self.currentValues[code]
-        # Set data on row
-        currentValueItem = NumericItem(formatFloatToMoney(currentValue))
+        if (code in self.quotes):
+            currentValue = self.quotes[code][0]
+        # Set data on item
+        currentValueItem.setText(formatFloatToMoney(currentValue))
         currentValueItem.setData(Qt.UserRole, currentValue)
-        self.stockTable.setItem(row, column, currentValueItem)
+        # Expired quotes are shown until fetched again, told apart by their color
+        if (code in self.quotes and self.getQuoteExpiration(code) <= time.time()):
+            timestampStr = datetime.datetime.fromtimestamp(self.quotes[code][1]).strftime('%d/%m/%Y %H:%M')
+            currentValueItem.setForeground(QBrush(QColor('gray')))
+            currentValueItem.setToolTip('Cotação desatualizada, de ' + timestampStr)
+        else:
+            currentValueItem.setData(Qt.ForegroundRole, None)
+            currentValueItem.setToolTip('')
         return currentValue
 
-    def setProfitValue(self, row, column, amount, currentValue, avgValue):
+    def setProfitValue(self, profitItem, amount, currentValue, avgValue):
         # Get profit value
         profit = 0.0
         if (currentValue > 0):
-            calculator = Calculator(self.db)
-            totalSellingValue = calculator.getTransactionValueWithTaxes(amount, currentValue, True)
+            totalSellingValue = self.calculator.getTransactionValueWithTaxes(amount, currentValue, True)
             profit = totalSellingValue - (amount*avgValue)
-        # Set data on row
-        profitItem = NumericItem(formatFloatToMoney(profit))
+        # Set data on item
+        profitItem.setText(formatFloatToMoney(profit))
         profitItem.setData(Qt.UserRole, profit)
-        self.stockTable.setItem(row, column, profitItem)
-        self.stockTable.item(row, column).setBackground(self.getBackgroundColor(profit))
+        profitItem.setBackground(self.getBackgroundColor(profit))
 
     def fillTable(self, year):
         if (not year):
             return
-        ordersUpToYear = self.db.getOrdersInAscendingDateUpToYear(year)
-        calculator = Calculator(self.db)
-        ret = calculator.getYearExtract(ordersUpToYear)
+        # Holdings only change with the data version, prices update their cells, see updateCurrentPrices
+        ledger = self.db.getLedger()
+        self.calculator = ledger.calculator
+        ret = ledger.getYearExtract(year)
         # Now extract from return the 
         # TODO: Error out if we have negative number of stocks
-        rows = []
+        self.holdings = {}
         for k, v in ret.items():
             amount = v[0]
             avgValue = v[1]
             if (amount > 0):
-                rows.append([k, amount, avgValue])
-        self.stockTable.setRowCount(len(rows))
+                self.holdings[k] = [amount, avgValue]
+        self.stockTable.setRowCount(len(self.holdings))
+        self.currentValueItems = {}
+        self.profitItems = {}
         rowIndex = 0
-        codesToFetch = []
-        for row in rows:
-            codesToFetch.append(row[0])
+        codesToFetch = {}
+        for code, [amount, avgValue] in self.holdings.items():
+            codesToFetch[code] = self.getQuoteExpiration(code)
             # TODO: Extract columns' indexes to variables
-            for i in range(0, 3):
-                if i == 0:
-                    item = QTableWidgetItem(row[0])
-                # Column 1 and 2 are amount and value, respectively, use numerical
-                elif i == 1:
-                    item = NumericItem(str(row[i]))
-                    item.setData(Qt.UserRole, row[i])
-                elif i == 2:
-                    item = NumericItem(formatFloatToMoney(row[i]))
-                    item.setData(Qt.UserRole, row[i])
-                self.stockTable.setItem(rowIndex, i, item)
+            self.stockTable.setItem(rowIndex, 0, QTableWidgetItem(code))
+            # Column 1 and 2 are amount and value, respectively, use numerical
+            item = NumericItem(str(amount))
+            item.setData(Qt.UserRole, amount)
+            self.stockTable.setItem(rowIndex, 1, item)
+            item = NumericItem(formatFloatToMoney(avgValue))
+            item.setData(Qt.UserRole, avgValue)
+            self.stockTable.setItem(rowIndex, 2, item)
             # Set current value and profit
-            currentValue = self.setCurrentValue(rowIndex, 3, row[0])
-            self.setProfitValue(rowIndex, 4, row[1], currentValue, row[2])
+            self.currentValueItems[code] = NumericItem()
+            self.profitItems[code] = NumericItem()
+            currentValue = self.setCurrentValue(self.currentValueItems[code], code)
+            self.setProfitValue(self.profitItems[code], amount, currentValue, avgValue)
+            self.stockTable.setItem(rowIndex, 3, self.currentValueItems[code])
+            self.stockTable.setItem(rowIndex, 4, self.profitItems[code])
             rowIndex = rowIndex + 1
         self.fetchPriceController.updateCodes(codesToFetch)
 
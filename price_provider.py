@@ -0,0 +1,202 @@
+import abc
+import datetime
+import math
+import random
+import sys
+import time
+import zlib
+
+import yfinance as yf
+
+# B3 trades from 10h to 18h of Brasília, with the closing call, on weekdays. Brasília has no daylight
+# saving time since 2019 and holidays aren't considered, prices are just fetched once more on them
+B3_TIMEZONE = datetime.timezone(datetime.timedelta(hours=-3))
+B3_OPENING_TIME = datetime.time(10, 0)
+B3_CLOSING_TIME = datetime.time(18, 0)
+
+def isMarketOpen(now):
+    # now is in seconds since the epoch
+    date = datetime.datetime.fromtimestamp(now, B3_TIMEZONE)
+    return date.weekday() < 5 and B3_OPENING_TIME <= date.time() < B3_CLOSING_TIME
+
+def getNextMarketOpening(now):
+    # Returns the time the market opens after now, in seconds since the epoch
+    date = datetime.datetime.fromtimestamp(now, B3_TIMEZONE)
+    opening = datetime.datetime.combine(date.date(), B3_OPENING_TIME, B3_TIMEZONE)
+    if (opening <= date):
+        opening += datetime.timedelta(days=1)
+    while (opening.weekday() >= 5):
+        opening += datetime.timedelta(days=1)
+    return opening.timestamp()
+
+class PriceProviderError(Exception):
+    pass
+
+class PriceProvider(abc.ABC):
+    # Source of current prices. getPrices is called with at most maxBatchSize codes, returns
+    # {code: price} of the codes found and raises PriceProviderError if the request failed
+    SOURCE = ''
+    DEFAULT_MAX_BATCH_SIZE = 50
+
+    def __init__(self, maxBatchSize=None):
+        self.maxBatchSize = maxBatchSize if maxBatchSize else self.DEFAULT_MAX_BATCH_SIZE
+
+    def getSource(self):
+        return self.SOURCE
+
+    @abc.abstractmethod
+    def getPrices(self, codes):
+        pass
+
+    @abc.abstractmethod
+    def getDailyCloses(self, codes, firstDateStr, lastDateStr):
+        # Returns {code: [[dateStr, close], ...]} of trading days within dates, same batches and errors as getPrices
+        pass
+
+class YahooPriceProvider(PriceProvider):
+    SOURCE = 'yfinance'
+
+    def getPrices(self, codes):
+        try:
+            # Append .SA (Sociedade Anomima) for brazilian stocks
+            stockData = yf.download(" ".join([x + ".SA" for x in codes]), period="minute", progress=False)
+            closeData = stockData.iloc[0]['Close'] if stockData.shape[0] else None
+        except Exception as e:
+            raise PriceProviderError(str(e))
+        # yfinance reports no connection as no data at all
+        if (closeData is None):
+            raise PriceProviderError('No data for ' + " ".join(codes))
+        # Columns aren't indexed by code when a single one is downloaded
+        if (len(codes) == 1):
+            prices = {codes[0]: float(closeData)}
+        else:
+            prices = dict(zip([x[:-3] for x in list(closeData.index)], [float(x) for x in closeData]))
+        # Codes not found have no price
+        return {code: price for code, price in prices.items() if not math.isnan(price)}
+
+    def getDailyCloses(self, codes, firstDateStr, lastDateStr):
+        # The end date isn't included in downloads
+        endDate = datetime.date.fromisoformat(lastDateStr) + datetime.timedelta(days=1)
+        try:
+            stockData = yf.download(" ".join([x + ".SA" for x in codes]), start=firstDateStr, end=endDate.isoformat(),
+                                    interval="1d", auto_adjust=False, progress=False)
+            closeData = stockData['Close'] if stockData.shape[0] else None
+        except Exception as e:
+            raise PriceProviderError(str(e))
+        if (closeData is None):
+            raise PriceProviderError('No data for ' + " ".join(codes))
+        # Columns aren't indexed by code when a single one is downloaded
+        if (closeData.ndim == 1):
+            closeData = closeData.to_frame(codes[0] + ".SA")
+        dateStrs = [date.strftime('%Y-%m-%d') for date in closeData.index]
+        closes = {}
+        for column in closeData.columns:
+            closes[column[:-3]] = [[dateStr, float(close)] for dateStr, close in zip(dateStrs, closeData[column]) if not math.isnan(close)]
+        return closes
+
+class StubPriceProvider(PriceProvider):
+    # Deterministic prices without network access, to test and benchmark fetching. Each request
+    # takes latencyInSeconds, fails with probability failureRate and never finds missingCodes.
+    # Prices start from a value given by the code and walk a bit on each request
+    SOURCE = 'stub'
+
+    def __init__(self, latencyInSeconds=0.0, seed=0, failureRate=0.0, missingCodes=(), maxBatchSize=None):
+        super().__init__(maxBatchSize)
+        self.latencyInSeconds = latencyInSeconds
+        self.seed = seed
+        self.failureRate = failureRate
+        self.missingCodes = set(missingCodes)
+        self.random = random.Random(seed)
+        self.numRequests = 0
+        self.numCodesRequested = 0
+
+    def getPrice(self, code):
+        basePrice = 5.0 + (zlib.crc32(code.encode()) ^ self.seed) % 9500 / 100.0
+        walk = random.Random(str(self.seed) + code + str(self.numRequests)).uniform(-0.01, 0.01)
+        return round(basePrice * (1.0 + walk), 2)
+
+    def getDailyClose(self, code, date):
+        # Swings around the base price over months, the same close whatever the range requested
+        basePrice = 5.0 + (zlib.crc32(code.encode()) ^ self.seed) % 9500 / 100.0
+        swing = 0.2 * math.sin(date.toordinal() / 50.0 + zlib.crc32(code.encode()) % 100)
+        noise = random.Random(str(self.seed) + code + date.isoformat()).uniform(-0.01, 0.01)
+        return round(basePrice * (1.0 + swing + noise), 2)
+
+    def request(self, codes):
+        self.numRequests += 1
+        self.numCodesRequested += len(codes)
+        if (self.latencyInSeconds > 0):
+            time.sleep(self.latencyInSeconds)
+        if (self.random.random() < self.failureRate):
+            raise PriceProviderError('Request ' + str(self.numRequests) + ' failed')
+
+    def getPrices(self, codes):
+        self.request(codes)
+        return {code: self.getPrice(code) for code in codes if code not in self.missingCodes}
+
+    def getDailyCloses(self, codes, firstDateStr, lastDateStr):
+        self.request(codes)
+        date = datetime.date.fromisoformat(firstDateStr)
+        lastDate = datetime.date.fromisoformat(lastDateStr)
+        # Trading days are weekdays
+        dates = []
+        while (date <= lastDate):
+            if (date.weekday() < 5):
+                dates.append(date)
+            date += datetime.timedelta(days=1)
+        return {code: [[date.isoformat(), self.getDailyClose(code, date)] for date in dates] for code in codes if code not in self.missingCodes}
+
+class PriceFetcher:
+    # Fetches prices from a provider in batches. When a request fails, the provider isn't requested
+    # again before backoffUntil, and codes not found are only requested again after their own
+    # backoff. Backoffs double on each consecutive failure, with jitter so that clients started
+    # together don't retry together
+    INITIAL_BACKOFF_IN_SECONDS = 1
+    MAX_BACKOFF_IN_SECONDS = 300
+
+    def __init__(self, provider, seed=None):
+        self.provider = provider
+        self.random = random.Random(seed)
+        self.numFailures = 0
+        self.backoffUntil = 0
+        # {code: [number of consecutive errors, time to request it again]}
+        self.errors = {}
+
+    def getSource(self):
+        return self.provider.getSource()
+
+    def getErrors(self):
+        return self.errors
+
+    def getNextFetchTime(self, code, expiration):
+        # Time after which fetch requests the code, whose quote expires at expiration
+        retryTime = self.errors[code][1] if code in self.errors else 0
+        return max(expiration, retryTime, self.backoffUntil)
+
+    def getBackoff(self, numFailures):
+        backoff = min(__class__.INITIAL_BACKOFF_IN_SECONDS * 2 ** (numFailures - 1), __class__.MAX_BACKOFF_IN_SECONDS)
+        return self.random.uniform(backoff / 2, backoff)
+
+    def fetch(self, codes, now):
+        # Returns {code: price} of the codes fetched, which are the ones found before a request failed
+        if (now < self.backoffUntil):
+            return {}
+        codes = [code for code in codes if code not in self.errors or self.errors[code][1] <= now]
+        prices = {}
+        for start in range(0, len(codes), self.provider.maxBatchSize):
+            batch = codes[start:start + self.provider.maxBatchSize]
+            try:
+                batchPrices = self.provider.getPrices(batch)
+            except PriceProviderError:
+                self.numFailures += 1
+                self.backoffUntil = now + self.getBackoff(self.numFailures)
+                break
+            self.numFailures = 0
+            for code in batch:
+                if (code in batchPrices):
+                    prices[code] = batchPrices[code]
+                    self.errors.pop(code, None)
+                else:
+                    numErrors = self.errors[code][0] + 1 if code in self.errors else 1
+                    self.errors[code] = [numErrors, now + self.getBackoff(numErrors)]
+        return prices
@@ -0,0 +1,179 @@
+import datetime
+import multiprocessing
+import re
+import sys
+
+from pdfminer.layout import LAParams
+
+from process_order import ErrorType, ProcessOrder, getFileHash, getFloatFromStr
+from util import pdf
+
+NOTE_FILE_TYPE = '.pdf'
+
+# Brokerage notes in SINACOR's layout, which most brokers use. Each page repeats the note
+# number and date, trades are listed one per line and fees are in the financial summary
+NOTE_HEADER_PATTERN = re.compile(r'Nr\.?\s*nota\s+Folha\s+Data\s+preg[ãa]o\s+(\d[\d.]*)\s+\d+\s+(\d{2}/\d{2}/\d{4})', re.IGNORECASE)
+# Type, market, title (with term and observation), amount, price, total and debit/credit
+TRADE_PATTERN = re.compile(r'^\s*1-BOVESPA\s+(\S+)\s+(\S+)\s+(.+?)\s+(\d[\d.]*)\s+(\d[\d.]*,\d+)\s+(\d[\d.]*,\d{2})\s+([DC])\s*$', re.MULTILINE)
+# Observations printed after the title, D stands for day trade
+OBSERVATION_PATTERN = re.compile(r'^(.+?)\s+([#DFBAHXPYLTIC2]{1,2})$')
+TICKER_PATTERN = re.compile(r'^[A-Z]{4}\d{1,2}$')
+# The financial summary is printed beside the business summary, so fees may follow other values on their line
+FEE_PATTERN = re.compile(r'(?:^|(?<=\s))(Taxa de liquida[çc][ãa]o|Taxa de Registro|Taxa de termo/op[çc][õo]es|Taxa A\.N\.A\.|Emolumentos|Taxa Operacional|'
+                         r'Corretagem|Execu[çc][ãa]o|Taxa de Cust[óo]dia|Impostos|I\.?S\.?S\.?[^\d\n]*|Outros)\s+(\d[\d.]*,\d{2})\s*([DC])?\s*$',
+                         re.MULTILINE | re.IGNORECASE)
+# Notes are tables with columns far apart, pdfminer's default layout would split each row into blocks of
+# columns. Letting characters of a line join at any distance keeps each row of the table in a line of text
+NOTE_LAPARAMS = LAParams(char_margin=1000.0, line_margin=0.1)
+
+def getNormalizedName(name):
+    return ' '.join(name.split())
+
+class ProcessNote(ProcessOrder):
+    # Orders of brokerage notes (notas de corretagem) in PDF, whose pages are converted to text
+    # beforehand, see processNotes. Notes name titles as CEI spreadsheets do, so codes are looked
+    # up by name in codesByName, unless the title has the code in it
+    def __init__(self, file, pageTexts, codesByName):
+        super().__init__(file)
+        self.pageTexts = pageTexts
+        self.codesByName = codesByName
+        # [number, dateStr, fees, numOrders] of each note in the file
+        self.notes = []
+
+    def getErrorFieldMessage(self):
+        if (not self.errorField):
+            return ""
+        return 'valor: "' + str(self.errorField[0]) + '", página: ' + str(self.errorField[1])
+
+    def setNoteErrorField(self, errorType, value, pageNum):
+        # Returns False, as the order
+        self.errorType = errorType
+        self.errorField = [value, pageNum + 1]
+        return False
+
+    def iterateOrders(self, f):
+        if (self.pageTexts is None):
+            self.errorType = ErrorType.INVALID_PDF
+            yield False
+            return
+        notes = {}
+        for pageNum, text in enumerate(self.pageTexts):
+            header = NOTE_HEADER_PATTERN.search(text)
+            if (not header):
+                self.errorType = ErrorType.NOTE_NOT_FOUND
+                self.errorField = ['', pageNum + 1]
+                yield False
+                return
+            date = datetime.datetime.strptime(header.group(2), '%d/%m/%Y')
+            # Notes with many trades span pages
+            note = notes.setdefault(header.group(1), [header.group(1), date.strftime('%Y-%m-%d'), 0, 0])
+            for trade in TRADE_PATTERN.finditer(text):
+                order = self.processTrade(pageNum, date, trade)
+                yield order
+                if (not order):
+                    return
+                note[3] += 1
+            for fee in FEE_PATTERN.finditer(text):
+                value = getFloatFromStr(fee.group(2))
+                note[2] += -value if fee.group(3) and fee.group(3).upper() == 'C' else value
+        self.notes = [[number, dateStr, round(fees, 2), numOrders] for number, dateStr, fees, numOrders in notes.values()]
+
+    def processTrade(self, pageNum, date, trade):
+        stockType, marketType, title, stockAmount, stockValue = trade.group(1, 2, 3, 4, 5)
+        if (stockType != 'C' and stockType != 'V'):
+            return self.setNoteErrorField(ErrorType.INVALID_TYPE, stockType, pageNum)
+        if (marketType != 'VISTA' and marketType != 'FRACIONARIO'):
+            return self.setNoteErrorField(ErrorType.INVALID_MARKET_TYPE, marketType, pageNum)
+
+        # Titles may end with an observation, unless the whole title is a known name (e.g. funds "... CI")
+        stockName = getNormalizedName(title)
+        observation = OBSERVATION_PATTERN.match(stockName)
+        if (stockName not in self.codesByName and observation):
+            if ('D' in observation.group(2)):
+                return self.setNoteErrorField(ErrorType.DAY_TRADE_FOUND, title, pageNum)
+            stockName = observation.group(1)
+        stockCode = self.getCode(stockName)
+        if (not stockCode):
+            return self.setNoteErrorField(ErrorType.UNKNOWN_STOCK_CODE, title, pageNum)
+        # CEI names codes of the odd lot market after the ones of the regular market
+        if (marketType == 'FRACIONARIO'):
+            stockCode += 'F'
+
+        try:
+            stockAmount = int(getFloatFromStr(stockAmount))
+        except ValueError:
+            return self.setNoteErrorField(ErrorType.INVALID_STOCK_AMOUNT, stockAmount, pageNum)
+        try:
+            stockValue = getFloatFromStr(stockValue)
+        except ValueError:
+            return self.setNoteErrorField(ErrorType.INVALID_STOCK_VALUE, stockValue, pageNum)
+        return [date, stockType, stockCode, stockName, stockAmount, stockValue]
+
+    def getCode(self, stockName):
+        stockCode = self.codesByName.get(stockName)
+        if (stockCode):
+            return stockCode
+        for word in stockName.split():
+            if (TICKER_PATTERN.match(word)):
+                return word
+        return None
+
+def getPageText(task):
+    # Run in a worker process, task is [fileName, pageNum]. Returns None if the page can't be
+    # converted, as in notes protected by password
+    try:
+        return pdf.to_text(task[0], [task[1]], NOTE_LAPARAMS)
+    except Exception:
+        return None
+
+def getPageTexts(db, files, fileHashes, numWorkers=None):
+    # Returns {fileName: texts of each page}, or None for files that can't be read. Texts are cached
+    # by file hash, so only pages of files never seen before are converted, each one in a worker process
+    texts = {}
+    tasks = []
+    for fileName in files:
+        texts[fileName] = db.getPdfTexts(fileHashes[fileName])
+        if (texts[fileName]):
+            continue
+        try:
+            tasks.extend([[fileName, pageNum] for pageNum in range(pdf.get_num_pages(fileName))])
+            texts[fileName] = []
+        except Exception:
+            texts[fileName] = None
+    numWorkers = min(numWorkers if numWorkers else multiprocessing.cpu_count(), len(tasks))
+    if (numWorkers <= 1):
+        results = [getPageText(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(numWorkers) as pool:
+            results = pool.map(getPageText, tasks)
+
+    for [fileName, pageNum], text in zip(tasks, results):
+        if (texts[fileName] is not None):
+            texts[fileName] = texts[fileName] + [text] if text is not None else None
+    for fileName in set(task[0] for task in tasks):
+        if (texts[fileName]):
+            db.addPdfTexts(fileHashes[fileName], texts[fileName])
+    return texts
+
+def processNotes(db, files, numWorkers=None):
+    # Returns [orders, errors, imports, notes] as processFiles does, with [fileHash, number, dateStr,
+    # fees, numOrders] of each note, see Database.registerBrokerageNotes
+    fileHashes = {fileName: getFileHash(fileName) for fileName in files}
+    texts = getPageTexts(db, files, fileHashes, numWorkers)
+    codesByName = {getNormalizedName(name): code for name, code in db.getCodesByName().items()}
+    orders = []
+    errors = []
+    imports = []
+    notes = []
+    for fileName in files:
+        processor = ProcessNote(fileName, texts[fileName], codesByName)
+        fileOrders = processor.processFile(fileName)
+        if (processor.getErrorType() != ErrorType.NO_ERROR):
+            errors.append([fileName, processor.getFullErrorMessage()])
+            continue
+        orders.extend(fileOrders)
+        if (processor.getImport(fileHashes[fileName])):
+            imports.append(processor.getImport(fileHashes[fileName]))
+        notes.extend([[fileHashes[fileName]] + note for note in processor.notes])
+    orders.sort(key=lambda order: order[0])
+    return [orders, errors, imports, notes]
@@ -1,8 +1,13 @@
+import contextlib
+import csv
 import datetime
+import hashlib
+import multiprocessing
 import sys
 import xlrd
 
 from enum import Enum
+from order_file import ORDER_FILE_COLUMNS, getOrderFileType, isParquetSupported, pyarrow
 from xlrd.timemachine import xrange
 
 class ErrorType(Enum):
@@ -15,12 +20,22 @@ class ErrorType(Enum):
     INVALID_STOCK_AMOUNT = 6
     INVALID_STOCK_VALUE = 7
     DAY_TRADE_FOUND = 8
+    INVALID_ORDER_FILE_COLUMNS = 9
+    PARQUET_NOT_SUPPORTED = 10
+    NOTE_NOT_FOUND = 11
+    UNKNOWN_STOCK_CODE = 12
+    INVALID_PDF = 13
 
 class SupportedSpreadsheets(Enum):
     NONE = 0
     EXTRACT = 1
     BM_FBOVESPA = 2
 
+EXTRACT_HEADER = ['Data Negócio', 'C/V', 'Mercado', 'Prazo', 'Código', 'Especificação do Ativo',
+                  'Quantidade', 'Preço (R$)', 'Valor Total (R$)']
+BOVESPA_HEADER = ['Cód', 'Data Negócio', 'Qtde.Compra', 'Qtd.Venda', 'Preço Médio Compra',
+                  'Preço Médio Venda', 'Qtde. Liquida', 'Posição']
+
 class ColumnsTypeExtract():
     # FORMAT: ['Data Negócio', 'C/V', 'Mercado', 'Prazo', 'Código', 'Especificação do Ativo',
     #          'Quantidade', 'Preço (R$)', 'Valor Total (R$)']
@@ -34,6 +49,9 @@ class ColumnsTypeExtract():
     STOCK_AMOUNT = 5
     STOCK_VALUE = 6
 
+# Header names of ColumnsTypeExtract fields, in order
+EXTRACT_COLUMNS = ['Data Negócio', 'C/V', 'Mercado', 'Código', 'Especificação do Ativo', 'Quantidade', 'Preço (R$)']
+
 class ColumnsTypeBovespa():
     # FORMAT: ['Cód', 'Data Negócio', 'Qtde.Compra', 'Qtd.Venda', 'Preço Médio Compra', 
     #          'Preço Médio Venda', 'Qtde. Liquida', 'Posição']
@@ -45,14 +63,38 @@ class ColumnsTypeBovespa():
     STOCK_VALUE_BUY = 4
     STOCK_VALUE_SELL = 5
 
+# Header names of ColumnsTypeBovespa fields, in order
+BOVESPA_COLUMNS = BOVESPA_HEADER[:6]
+
 def getFloatFromStr(strValue):
     return float(strValue.replace('.', '').replace(',', '.'))
 
+def getParquetColumnValues(column):
+    # Converting dictionary encoded columns value by value is slow, values are taken from the dictionary instead
+    if (isinstance(column, pyarrow.DictionaryArray)):
+        dictionary = column.dictionary.to_pylist()
+        return [dictionary[index] for index in column.indices.to_numpy(zero_copy_only=False).tolist()]
+    return column.to_pylist()
+
+def getFileHash(fileName):
+    # Content hash, so files already imported are recognized whatever their name
+    fileHash = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            fileHash.update(block)
+    return fileHash.hexdigest()
+
 class ProcessOrder:
     def __init__(self, file):
         self.file = file
         self.errorType = ErrorType.NO_ERROR
         self.errorField = None
+        # Rows after the header, an upper bound of the orders in the sheet
+        self.numRows = 0
+        # Orders read so far and their dates, see getImport
+        self.numOrders = 0
+        self.firstDate = None
+        self.lastDate = None
 
     def getErrorType(self):
         return self.errorType
@@ -82,90 +124,165 @@ class ProcessOrder:
             return "Campo de preço da ação inválido"
         if (self.errorType == ErrorType.DAY_TRADE_FOUND):
             return "Essa calculadora não suporta day trade, que foi identificado na planilha"
+        if (self.errorType == ErrorType.INVALID_ORDER_FILE_COLUMNS):
+            return "Colunas inválidas no arquivo de ordens, esperado " + ', '.join(ORDER_FILE_COLUMNS)
+        if (self.errorType == ErrorType.PARQUET_NOT_SUPPORTED):
+            return "Importar arquivos Parquet requer o pacote pyarrow"
+        if (self.errorType == ErrorType.NOTE_NOT_FOUND):
+            return "Não foi possível encontrar o número e a data do pregão na nota de corretagem"
+        if (self.errorType == ErrorType.UNKNOWN_STOCK_CODE):
+            return "Código desconhecido para o título da nota de corretagem, importe antes uma planilha da CEI com ele"
+        if (self.errorType == ErrorType.INVALID_PDF):
+            return "Não foi possível ler o PDF, que pode estar protegido por senha"
         else:
             assert(0)
             return ""
 
+    def getFullErrorMessage(self):
+        errorMsg = self.getErrorMessage()
+        errorFieldMsg = self.getErrorFieldMessage()
+        if (len(errorFieldMsg) > 0):
+            errorMsg += ' (' + errorFieldMsg + ')'
+        return errorMsg
+
+    def getImport(self, fileHash):
+        # Returns [fileHash, firstDateStr, lastDateStr, numOrders] of the orders read, as Database.registerImports
+        # takes them, or None if there were none
+        if (self.numOrders == 0):
+            return None
+        return [fileHash, self.firstDate.strftime('%Y-%m-%d'), self.lastDate.strftime('%Y-%m-%d'), self.numOrders]
+
     def processFile(self, f):
+        # Return all orders of the file, or False on error
         orders = []
+        for order in self.iterateFile(f):
+            if (not order):
+                return False
+            orders.append(order)
+        return orders
 
-        self.xlsFile = xlrd.open_workbook(f)
-        self.sheet = self.xlsFile.sheet_by_index(0)
+    def iterateFile(self, f):
+        # Yield orders one row at a time, so they can be stored while the file is read. On
+        # error, yield False and stop
+        for order in self.iterateOrders(f):
+            if (order):
+                self.numOrders += 1
+                if (self.firstDate is None or order[0] < self.firstDate):
+                    self.firstDate = order[0]
+                if (self.lastDate is None or order[0] > self.lastDate):
+                    self.lastDate = order[0]
+            yield order
+            if (not order):
+                return
 
+    def iterateOrders(self, f):
+        # Order files exported by order_file are read as well
+        fileType = getOrderFileType(f)
+        if (fileType == '.csv'):
+            return self.iterateCsvFile(f)
+        elif (fileType == '.parquet'):
+            return self.iterateParquetFile(f)
+        return self.iterateSpreadsheetFile(f)
+
+    def iterateSpreadsheetFile(self, f):
+        # Sheets are only loaded when needed and released at the end
+        self.xlsFile = xlrd.open_workbook(f, on_demand=True)
+        try:
+            yield from self.iterateSheet(self.xlsFile.sheet_by_index(0))
+        finally:
+            self.xlsFile.release_resources()
+
+    def iterateSheet(self, sheet):
+        self.sheet = sheet
         self.headerType = SupportedSpreadsheets.NONE
-        foundEnd = False
+        self.dates = {}
+        headerRowNum = self.findHeader()
+        if (self.headerType == SupportedSpreadsheets.NONE):
+            self.errorType = ErrorType.HEADER_NOT_FOUND
+            yield False
+            return
+        self.numRows = self.sheet.nrows - headerRowNum - 1
+        for rowNum in xrange(headerRowNum + 1, self.sheet.nrows):
+            # If empty line, we reached the end
+            if (self.isRowEmpty(rowNum)):
+                return
+            # Process this row and get an order from it
+            order = self.processRow(rowNum)
+            yield order
+            if (not order):
+                return
+        self.errorType = ErrorType.END_NOT_FOUND
+        yield False
+
+    def findHeader(self):
+        # Return the header row and keep the column of each field, so rows after it are
+        # read straight from their cells. Returns -1 if not found
         for rowNum in xrange(self.sheet.nrows):
-            # TODO: Extract some methods here and fixed lines' contents
-            rowValues = list(filter(None, self.sheet.row_values(rowNum)))
-            order = False
-            if (self.headerType != SupportedSpreadsheets.NONE):
-                # If empty line, we reached the end
-                if (len(rowValues) == 0):
-                    foundEnd = True
-                    break
-                # Process this row and get an order from it
-                order = self.processRow(rowNum, rowValues)
-                if (not order):
-                    return False
-                orders.append(order)
-            elif (rowValues == ['Data Negócio', 'C/V', 'Mercado', 'Prazo', 'Código', 'Especificação do Ativo',
-                                'Quantidade', 'Preço (R$)', 'Valor Total (R$)']):
+            rowValues = self.sheet.row_values(rowNum)
+            names = list(filter(None, rowValues))
+            if (names == EXTRACT_HEADER):
                 self.headerType = SupportedSpreadsheets.EXTRACT
-                continue
-            elif (rowValues == ['Cód', 'Data Negócio', 'Qtde.Compra', 'Qtd.Venda', 'Preço Médio Compra', 
-                                'Preço Médio Venda', 'Qtde. Liquida', 'Posição']):
+                self.columns = [rowValues.index(name) for name in EXTRACT_COLUMNS]
+                return rowNum
+            elif (names == BOVESPA_HEADER):
                 self.headerType = SupportedSpreadsheets.BM_FBOVESPA
-                continue
+                self.columns = [rowValues.index(name) for name in BOVESPA_COLUMNS]
+                return rowNum
+        return -1
 
-        if (self.headerType == SupportedSpreadsheets.NONE):
-            self.errorType = ErrorType.HEADER_NOT_FOUND
-            return False
-        elif (not foundEnd):
-            self.errorType = ErrorType.END_NOT_FOUND
+    def isRowEmpty(self, rowNum):
+        # Rows with orders always have a date, only check every cell when there's none
+        if (self.sheet.cell_value(rowNum, self.columns[0 if self.headerType == SupportedSpreadsheets.EXTRACT else 1])):
             return False
+        for column in xrange(self.sheet.ncols):
+            if (self.sheet.cell_value(rowNum, column)):
+                return False
+        return True
 
-        return orders
+    def getValue(self, rowNum, column):
+        # Value without spaces of the given field (Columns*) of the row
+        value = self.sheet.cell_value(rowNum, self.columns[column])
+        if (isinstance(value, str)):
+            return value.strip()
+        return value
+
+    def setErrorField(self, errorType, rowNum, column):
+        self.errorType = errorType
+        self.errorField = [self.getValue(rowNum, column), rowNum + 1, self.columns[column] + 1]
 
-    def processRow(self, rowNum, rowValues):
-        # Extract values without spaces
-        values = []
-        for value in rowValues:
-            if (isinstance(value, str)):
-                values.append(value.strip())
-            else:
-                values.append(value)
+    def processRow(self, rowNum):
         # Forward row to the respective processor
         if (self.headerType == SupportedSpreadsheets.EXTRACT):
-            return self.processExtractRow(rowNum, values)
+            return self.processExtractRow(rowNum)
         elif (self.headerType == SupportedSpreadsheets.BM_FBOVESPA):
-            return self.proccessBovespaRow(rowNum, values)
+            return self.proccessBovespaRow(rowNum)
         return False
 
-    def proccessBovespaRow(self, rowNum, values):
-        # Extract date
-        date = None
-        try:
-            date = datetime.datetime(*xlrd.xldate_as_tuple(values[ColumnsTypeBovespa.DATE], self.xlsFile.datemode))
-        except:
-            self.errorType = ErrorType.INVALID_DATE
-            self.errorField = [values[ColumnsTypeBovespa.DATE], rowNum + 1, ColumnsTypeBovespa.DATE + 1]
-            return False
+    def proccessBovespaRow(self, rowNum):
+        # Extract date, each one is converted only once
+        dateValue = self.getValue(rowNum, ColumnsTypeBovespa.DATE)
+        date = self.dates.get(dateValue)
+        if (date is None):
+            try:
+                date = datetime.datetime(*xlrd.xldate_as_tuple(dateValue, self.xlsFile.datemode))
+            except:
+                self.setErrorField(ErrorType.INVALID_DATE, rowNum, ColumnsTypeBovespa.DATE)
+                return False
+            self.dates[dateValue] = date
 
         # Extrat code and type
-        stockCode = values[ColumnsTypeBovespa.STOCK_CODE]
+        stockCode = self.getValue(rowNum, ColumnsTypeBovespa.STOCK_CODE)
 
         # Extract amount of buy
-        stockAmountBuy = getFloatFromStr(values[ColumnsTypeBovespa.STOCK_AMOUNT_BUY])
-        stockValueBuy = getFloatFromStr(values[ColumnsTypeBovespa.STOCK_VALUE_BUY])
-        stockAmountSell = getFloatFromStr(values[ColumnsTypeBovespa.STOCK_AMOUNT_SELL])
-        stockValueSell = getFloatFromStr(values[ColumnsTypeBovespa.STOCK_VALUE_SELL])
+        stockAmountBuy = getFloatFromStr(self.getValue(rowNum, ColumnsTypeBovespa.STOCK_AMOUNT_BUY))
+        stockValueBuy = getFloatFromStr(self.getValue(rowNum, ColumnsTypeBovespa.STOCK_VALUE_BUY))
+        stockAmountSell = getFloatFromStr(self.getValue(rowNum, ColumnsTypeBovespa.STOCK_AMOUNT_SELL))
+        stockValueSell = getFloatFromStr(self.getValue(rowNum, ColumnsTypeBovespa.STOCK_VALUE_SELL))
         if (stockAmountBuy == 0 and stockAmountSell == 0):
-            self.errorType = ErrorType.INVALID_STOCK_AMOUNT
-            self.errorField = [values[ColumnsTypeBovespa.STOCK_AMOUNT_SELL], rowNum + 1, ColumnsTypeBovespa.STOCK_AMOUNT_SELL + 1]
+            self.setErrorField(ErrorType.INVALID_STOCK_AMOUNT, rowNum, ColumnsTypeBovespa.STOCK_AMOUNT_SELL)
             return False
         elif (stockValueBuy == 0 and stockValueSell == 0):
-            self.errorType = ErrorType.INVALID_STOCK_VALUE
-            self.errorField = [values[ColumnsTypeBovespa.STOCK_VALUE_SELL], rowNum + 1, ColumnsTypeBovespa.STOCK_VALUE_SELL + 1]
+            self.setErrorField(ErrorType.INVALID_STOCK_VALUE, rowNum, ColumnsTypeBovespa.STOCK_VALUE_SELL)
             return False
 
         # Check for day-trade (no support)
@@ -180,43 +297,138 @@ class ProcessOrder:
 
         return [date, stockType, stockCode, '', stockAmount, stockValue]
 
-    def processExtractRow(self, rowNum, values):
+    def processExtractRow(self, rowNum):
         # Check market type
-        if (values[ColumnsTypeExtract.MARKET_TYPE] != 'Mercado a Vista' and values[ColumnsTypeExtract.MARKET_TYPE] != 'Merc. Fracionário'):
-            self.errorType = ErrorType.INVALID_MARKET_TYPE
-            self.errorField = [values[ColumnsTypeExtract.MARKET_TYPE], rowNum + 1, ColumnsTypeExtract.MARKET_TYPE + 1]
+        marketType = self.getValue(rowNum, ColumnsTypeExtract.MARKET_TYPE)
+        if (marketType != 'Mercado a Vista' and marketType != 'Merc. Fracionário'):
+            self.setErrorField(ErrorType.INVALID_MARKET_TYPE, rowNum, ColumnsTypeExtract.MARKET_TYPE)
             return False
 
-        # Extract date
-        date = None
-        try:
-            date = datetime.datetime.strptime(values[ColumnsTypeExtract.DATE], '%d/%m/%y')
-        except:
-            self.errorType = ErrorType.INVALID_DATE
-            self.errorField = [values[ColumnsTypeExtract.DATE], rowNum + 1, ColumnsTypeExtract.DATE + 1]
-            return False
+        # Extract date, each one is parsed only once
+        dateStr = self.getValue(rowNum, ColumnsTypeExtract.DATE)
+        date = self.dates.get(dateStr)
+        if (date is None):
+            try:
+                date = datetime.datetime.strptime(dateStr, '%d/%m/%y')
+            except:
+                self.setErrorField(ErrorType.INVALID_DATE, rowNum, ColumnsTypeExtract.DATE)
+                return False
+            self.dates[dateStr] = date
 
         # Extract type
-        stockType = values[ColumnsTypeExtract.ORDER_TYPE]
+        stockType = self.getValue(rowNum, ColumnsTypeExtract.ORDER_TYPE)
         if (stockType != 'C' and stockType != 'V'):
-            self.errorType = ErrorType.INVALID_TYPE
-            self.errorField = [values[ColumnsTypeExtract.ORDER_TYPE], rowNum + 1, ColumnsTypeExtract.ORDER_TYPE + 1]
+            self.setErrorField(ErrorType.INVALID_TYPE, rowNum, ColumnsTypeExtract.ORDER_TYPE)
             return False
 
         # Extract code and name
-        stockCode = values[ColumnsTypeExtract.STOCK_CODE]
-        stockName = values[ColumnsTypeExtract.STOCK_NAME]
+        stockCode = self.getValue(rowNum, ColumnsTypeExtract.STOCK_CODE)
+        stockName = self.getValue(rowNum, ColumnsTypeExtract.STOCK_NAME)
 
         # Extract stock value and amount
-        stockAmount = values[ColumnsTypeExtract.STOCK_AMOUNT]
-        stockValue = values[ColumnsTypeExtract.STOCK_VALUE]
+        stockAmount = self.getValue(rowNum, ColumnsTypeExtract.STOCK_AMOUNT)
+        stockValue = self.getValue(rowNum, ColumnsTypeExtract.STOCK_VALUE)
         if (not isinstance(stockAmount, float)):
-            self.errorType = ErrorType.INVALID_STOCK_AMOUNT
-            self.errorField = [values[ColumnsTypeExtract.STOCK_AMOUNT], rowNum + 1, ColumnsTypeExtract.STOCK_AMOUNT + 1]
+            self.setErrorField(ErrorType.INVALID_STOCK_AMOUNT, rowNum, ColumnsTypeExtract.STOCK_AMOUNT)
             return False
         elif (not isinstance(stockValue, float)):
-            self.errorType = ErrorType.INVALID_STOCK_VALUE
-            self.errorField = [values[ColumnsTypeExtract.STOCK_VALUE], rowNum + 1, ColumnsTypeExtract.STOCK_VALUE + 1]
+            self.setErrorField(ErrorType.INVALID_STOCK_VALUE, rowNum, ColumnsTypeExtract.STOCK_VALUE)
             return False
 
         return [date, stockType, stockCode, stockName, stockAmount, stockValue]
+
+    def iterateCsvFile(self, f):
+        self.dates = {}
+        with open(f, newline='', encoding='utf-8') as csvFile:
+            reader = csv.reader(csvFile)
+            if (next(reader, None) != ORDER_FILE_COLUMNS):
+                self.errorType = ErrorType.INVALID_ORDER_FILE_COLUMNS
+                yield False
+                return
+            for rowNum, values in enumerate(reader, 1):
+                yield self.processOrderFileRow(rowNum, values)
+
+    def iterateParquetFile(self, f):
+        if (not isParquetSupported()):
+            self.errorType = ErrorType.PARQUET_NOT_SUPPORTED
+            yield False
+            return
+        self.dates = {}
+        parquetFile = pyarrow.parquet.ParquetFile(f)
+        if (parquetFile.schema_arrow.names != ORDER_FILE_COLUMNS):
+            self.errorType = ErrorType.INVALID_ORDER_FILE_COLUMNS
+            yield False
+            return
+        self.numRows = parquetFile.metadata.num_rows
+        # Dates are read as strings, so they're parsed as the ones in CSV files
+        rowNum = 1
+        for batch in parquetFile.iter_batches():
+            columns = [batch.column(0).cast(pyarrow.string())] + batch.columns[1:]
+            for values in zip(*[getParquetColumnValues(column) for column in columns]):
+                yield self.processOrderFileRow(rowNum, values)
+                rowNum += 1
+
+    def processOrderFileRow(self, rowNum, values):
+        # Values are strings in CSV files and typed in Parquet ones, rows are numbered after the header
+        if (len(values) != len(ORDER_FILE_COLUMNS)):
+            self.errorType = ErrorType.INVALID_ORDER_FILE_COLUMNS
+            return False
+        dateStr, stockType, stockCode, stockName, stockAmount, stockValue = values
+        date = self.dates.get(dateStr)
+        if (date is None):
+            try:
+                date = datetime.datetime.strptime(dateStr, '%Y-%m-%d')
+            except:
+                return self.setOrderFileErrorField(ErrorType.INVALID_DATE, rowNum, values, 0)
+            self.dates[dateStr] = date
+        if (stockType != 'C' and stockType != 'V'):
+            return self.setOrderFileErrorField(ErrorType.INVALID_TYPE, rowNum, values, 1)
+        try:
+            stockAmount = int(stockAmount)
+        except:
+            return self.setOrderFileErrorField(ErrorType.INVALID_STOCK_AMOUNT, rowNum, values, 4)
+        try:
+            stockValue = float(stockValue)
+        except:
+            return self.setOrderFileErrorField(ErrorType.INVALID_STOCK_VALUE, rowNum, values, 5)
+        return [date, stockType, stockCode, stockName if stockName else '', stockAmount, stockValue]
+
+    def setOrderFileErrorField(self, errorType, rowNum, values, column):
+        # Returns False, as the row
+        self.errorType = errorType
+        self.errorField = [values[column], rowNum + 1, column + 1]
+        return False
+
+def getFileOrders(fileName):
+    # Run in a worker process, returns [orders, errorMessage, import] with an empty message on
+    # success, see ProcessOrder.getImport
+    processor = ProcessOrder(fileName)
+    orders = processor.processFile(fileName)
+    if (processor.getErrorType() != ErrorType.NO_ERROR):
+        return [[], processor.getFullErrorMessage(), None]
+    return [orders, '', processor.getImport(getFileHash(fileName))]
+
+def iterateFiles(files, errors, imports, numWorkers=None, fileProcessed=None):
+    # Parse files concurrently, one per worker process, and yield orders of each file in the given
+    # order once it's parsed, so only the orders of a file are held at a time. Orders aren't sorted,
+    # Database.importOrders sorts them by date keeping the order of files and rows within a day.
+    # [fileName, errorMessage] of each file that failed is appended to errors and the import of each
+    # file with orders to imports. If errors has any once every file is parsed, a False order is
+    # yielded at the end. fileProcessed, if given, is called with the number of orders of each file
+    # and may return False to stop parsing, which yields a False order as well
+    numWorkers = min(numWorkers if numWorkers else multiprocessing.cpu_count(), len(files))
+    with multiprocessing.Pool(numWorkers) if numWorkers > 1 else contextlib.nullcontext() as pool:
+        for fileName, [fileOrders, errorMessage, fileImport] in zip(files, pool.imap(getFileOrders, files) if pool else map(getFileOrders, files)):
+            if (fileProcessed and fileProcessed(len(fileOrders)) is False):
+                # Leaving the pool terminates workers still parsing
+                yield False
+                return
+            if (errorMessage):
+                errors.append([fileName, errorMessage])
+            if (fileImport):
+                imports.append(fileImport)
+            # Orders after an error would be rolled back anyway
+            if (len(errors) == 0):
+                yield from fileOrders
+    if (len(errors) > 0):
+        yield False
@@ -1,7 +1,6 @@
 import sys
 
 from util import gui
-from calculator import Calculator
 from util.table import NumericItem, formatFloatToMoney
 
 from PySide2.QtGui import QColor, QBrush
@@ -21,6 +20,7 @@ class Profit:
         self.totalSales = self.ui.findChild(QLabel, 'total_sales')
         self.totalProfit = self.ui.findChild(QLabel, 'total_profit')
 
+        self.renderedDataVersion = None
         self.initTable()
         self.updateWindow()
 
@@ -52,18 +52,20 @@ class Profit:
             return 'black'
 
     def updateWindow(self):
+        # Nothing to re-render if the database hasn't changed since the last time
+        if (self.db.getDataVersion() == self.renderedDataVersion):
+            return
         self.updateTable()
 
     def updateTable(self):
+        self.renderedDataVersion = self.db.getDataVersion()
         self.orderTable.setSortingEnabled(False)
         self.fillTable()
         self.orderTable.setSortingEnabled(True)
 
     def fillTable(self):
-        # Calculate profits and losses per sell operation
-        calculator = Calculator(self.db)
-        orders = self.db.getOrdersInAscendingDate()
-        rows = calculator.getProfitsAndLosses(orders)
+        # Profits and losses per sell operation
+        rows = self.db.getLedger().profitsAndLosses
         # Print data
         self.orderTable.setRowCount(len(rows))
         rowIndex = 0
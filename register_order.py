@@ -1,12 +1,17 @@
+import datetime
+import itertools
 import os
 import sys
 import platform
 
-from process_order import ProcessOrder
+from database import Database
+from order_file import exportOrders, getOrderFileType, isParquetSupported
+from process_note import NOTE_FILE_TYPE, processNotes
+from process_order import ErrorType, ProcessOrder, getFileHash, iterateFiles
 from util import gui
 
-from PySide2.QtWidgets import QWidget, QDialogButtonBox, QMessageBox, QFileDialog, QGridLayout, QPushButton, QVBoxLayout
-from PySide2.QtCore import SIGNAL, Qt, QObject
+from PySide2.QtWidgets import QWidget, QDialogButtonBox, QMessageBox, QFileDialog, QGridLayout, QProgressBar, QPushButton, QVBoxLayout
+from PySide2.QtCore import SIGNAL, QThread, Signal, Slot, Qt, QObject
 
 class FileDialog(QFileDialog):
     def __init__(self, parent):
@@ -23,7 +28,7 @@ class FileDialog(QFileDialog):
         pass
 
     def setup(self):
-        self.setNameFilter('Extrato CEI Negociação de Ativos ou BM&FBOVESPA (*.xls)')
+        self.setNameFilter('Extrato CEI Negociação de Ativos, BM&FBOVESPA, notas de corretagem ou ordens exportadas (*.xls *.pdf *.csv *.parquet)')
 
     def hideButtons(self):
         # Hide open and cancel buttons that may wipe the file dialog widget
@@ -34,8 +39,134 @@ class FileDialog(QFileDialog):
             if (buttonBox.button(QDialogButtonBox.Cancel)):
                 buttonBox.button(QDialogButtonBox.Cancel).hide()
 
-class RegisterOrder:
-    def __init__(self, db):
+class ImportWorker(QObject):
+    # Parses and stores orders of files with its own database connection, as connections can't be
+    # shared between threads. Progress is [numParsedOrders, numStoredOrders, numOrders], where
+    # numOrders is 0 while unknown. Once finished, the result is [importResult, errors, cancelled],
+    # see Database.importOrders and iterateFiles, importResult being None if nothing was imported
+    CONNECTION_NAME = 'import'
+    PROGRESS_INTERVAL_IN_ORDERS = 1000
+    progressChanged = Signal(int, int, int)
+    importFinished = Signal(list)
+
+    def __init__(self, fileName):
+        super().__init__()
+        self.fileName = fileName
+        self.cancelled = False
+        self.numParsedOrders = 0
+
+    def cancel(self):
+        # Called from the GUI thread while importFiles runs, so it can't be a queued slot
+        self.cancelled = True
+
+    @Slot(list)
+    def importFiles(self, files):
+        self.cancelled = False
+        self.numParsedOrders = 0
+        db = Database(self.fileName, __class__.CONNECTION_NAME)
+        result = self.importFilesToDatabase(db, files)
+        db.close()
+        self.importFinished.emit(result + [self.cancelled])
+
+    def importFilesToDatabase(self, db, files):
+        # Files already imported with the same content are skipped
+        fileHashes = {fileName: getFileHash(fileName) for fileName in files}
+        files = [fileName for fileName in files if not db.isFileImported(fileHashes[fileName])]
+        if (len(files) == 0):
+            return [None, []]
+
+        # Brokerage notes are converted page by page instead
+        noteFiles = [fileName for fileName in files if os.path.splitext(fileName)[1].lower() == NOTE_FILE_TYPE]
+        files = [fileName for fileName in files if fileName not in noteFiles]
+        errors = []
+        notes = []
+        if (len(files) == 1 and len(noteFiles) == 0):
+            # A single file is stored while it's read
+            processor = ProcessOrder(files[0])
+            importResult = db.importOrders(self.trackProgress(processor.iterateFile(files[0]), processor))
+            if (processor.getErrorType() != ErrorType.NO_ERROR):
+                errors.append([files[0], processor.getFullErrorMessage()])
+            imports = [processor.getImport(fileHashes[files[0]])]
+        else:
+            # Notes come first, their pages are converted and kept by the database outside of the import.
+            # Files are parsed concurrently and stored as each one is parsed, the import only succeeds
+            # if all of them are valid
+            if (len(noteFiles) > 0):
+                noteOrders, errors, imports, notes = processNotes(db, noteFiles)
+                self.fileProcessed(len(noteOrders))
+            else:
+                noteOrders, errors, imports = [[], [], []]
+            fileOrders = iterateFiles(files, errors, imports, fileProcessed=self.fileProcessed)
+            importResult = db.importOrders(self.trackProgress(itertools.chain(fileOrders, noteOrders), None))
+            fileOrders.close()
+            if (len(errors) > 0 or self.cancelled):
+                return [None, errors]
+        if (len(errors) == 0 and importResult[1] >= 0):
+            db.registerImports([fileImport for fileImport in imports if fileImport])
+            db.registerBrokerageNotes(notes)
+        return [importResult, errors]
+
+    def fileProcessed(self, numOrders):
+        self.numParsedOrders += numOrders
+        self.progressChanged.emit(self.numParsedOrders, 0, 0)
+        return not self.cancelled
+
+    def trackProgress(self, orders, processor):
+        # Yield orders while reporting progress, a False order on cancel makes the import roll back.
+        # Orders are read from processor when given, otherwise files are parsed as they're stored
+        # (see iterateFiles) and orders parsed so far are the total until then
+        numStoredOrders = 0
+        for order in orders:
+            if (self.cancelled):
+                yield False
+                return
+            if (numStoredOrders % __class__.PROGRESS_INTERVAL_IN_ORDERS == 0):
+                numOrders = self.numParsedOrders
+                if (processor):
+                    self.numParsedOrders = processor.numOrders
+                    numOrders = processor.numRows
+                self.progressChanged.emit(self.numParsedOrders, numStoredOrders, numOrders)
+            yield order
+            numStoredOrders += 1
+
+class ImportController(QObject):
+    progressChanged = Signal(int, int, int)
+    importFinished = Signal(list)
+    THREAD_SYNC_TIMEOUT_SECONDS = 5
+
+    _filesSelected = Signal(list)
+
+    def __init__(self, fileName, parent = None):
+        super().__init__(parent)
+        self.thread = QThread()
+
+        self.worker = ImportWorker(fileName)
+        self.worker.moveToThread(self.thread)
+        self.worker.progressChanged.connect(self.progressChanged)
+        self.worker.importFinished.connect(self.importFinished)
+        self._filesSelected.connect(self.worker.importFiles)
+
+        self.thread.finished.connect(self.thread.deleteLater)
+
+    def importFiles(self, files):
+        self._filesSelected.emit(files)
+
+    def cancel(self):
+        self.worker.cancel()
+
+    @Slot()
+    def quit(self):
+        self.worker.cancel()
+        self.thread.quit()
+        if not self.thread.wait(self.THREAD_SYNC_TIMEOUT_SECONDS * 1000):
+            self.thread.terminate()
+
+class RegisterOrder(QObject):
+    # Emitted once imported orders are stored, so tabs may be refreshed
+    ordersImported = Signal()
+
+    def __init__(self, db, parent = None):
+        super().__init__(parent)
         self.ui = gui.load_ui('./windows/register_order.ui')
         self.db = db
 
@@ -51,8 +182,22 @@ class RegisterOrder:
         self.wipeOrdersButton = self.ui.findChild(QPushButton, 'wipe_orders_button')
         self.wipeOrdersButton.clicked.connect(self.wipeOrders)
 
+        self.exportOrdersButton = self.ui.findChild(QPushButton, 'export_orders_button')
+        self.exportOrdersButton.clicked.connect(self.exportOrders)
+
+        self.importProgressBar = self.ui.findChild(QProgressBar, 'import_progress_bar')
+        self.cancelImportButton = self.ui.findChild(QPushButton, 'cancel_import_button')
+        self.cancelImportButton.clicked.connect(self.cancelImport)
+
+        # Create thread to import files
+        self.importController = ImportController(self.db.getFileName(), self)
+        self.importController.progressChanged.connect(self.updateImportProgress)
+        self.importController.importFinished.connect(self.finishImport)
+
         self.updateWindow()
 
+        self.importController.thread.start()
+
     def updateWindow(self):
         None
 
@@ -81,38 +226,65 @@ class RegisterOrder:
         if (len(files) == 0):
             return
 
-        orders = []
-        for f in files:
-            processor = ProcessOrder(f)
-            ret = processor.processFile(f)
-            if (not ret):
-                errorMsg = processor.getErrorMessage()
-                errorFieldMsg = processor.getErrorFieldMessage()
-                if (len(errorFieldMsg) > 0):
-                    errorMsg += ' (' + errorFieldMsg + ')'
-                QMessageBox.critical(self.ui, 'ERRO', errorMsg, QMessageBox.StandardButton.Abort)
-                return
-            orders.extend(ret)
+        self.setImporting(True)
+        self.importController.importFiles(files)
+
+    def setImporting(self, importing):
+        self.importProgressBar.setVisible(importing)
+        self.importProgressBar.setRange(0, 0)
+        self.importProgressBar.setFormat('')
+        self.cancelImportButton.setVisible(importing)
+        self.cancelImportButton.setEnabled(True)
+        self.processFilesButton.setEnabled(not importing)
+        self.wipeOrdersButton.setEnabled(not importing)
+        self.exportOrdersButton.setEnabled(not importing)
+        self.fileDialog.setEnabled(not importing)
 
-        self.updateOrders(orders)
+    def updateImportProgress(self, numParsedOrders, numStoredOrders, numOrders):
+        # Unknown totals show a busy bar
+        self.importProgressBar.setRange(0, max(numOrders, numStoredOrders))
+        self.importProgressBar.setValue(numStoredOrders)
+        self.importProgressBar.setFormat('Lidas ' + str(numParsedOrders) + ' ordens, gravadas ' + str(numStoredOrders))
 
-    def updateOrders(self, orders):
-        if (len(orders) == 0):
+    def cancelImport(self):
+        self.cancelImportButton.setEnabled(False)
+        self.importController.cancel()
+
+    def stopThreads(self):
+        self.importController.quit()
+
+    def finishImport(self, result):
+        importResult, errors, cancelled = result
+        self.setImporting(False)
+        if (cancelled):
+            QMessageBox.information(self.ui, 'CANCELADO', 'Importação cancelada, nenhuma ordem foi alterada.')
+            return
+        if (len(errors) > 0):
+            errorMsg = '\n'.join(os.path.basename(fileName) + ': ' + fileErrorMsg for fileName, fileErrorMsg in errors)
+            QMessageBox.critical(self.ui, 'ERRO', errorMsg, QMessageBox.StandardButton.Abort)
+            return
+        if (importResult is None):
+            QMessageBox.information(self.ui, 'SUCESSO', 'As planilhas selecionadas já foram importadas, nenhuma ordem foi alterada.')
+            return
+
+        if (importResult[1] >= 0):
+            self.ordersImported.emit()
+        self.showImportResult(*importResult)
+
+    def showImportResult(self, numDeletedOrders, numInsertedOrders, firstDateStr, lastDateStr):
+        if (numInsertedOrders < 0):
+            QMessageBox.critical(self.ui, 'ERRO', 'Houve um erro ao atualizar o banco de dados. Nenhuma ordem foi alterada.', QMessageBox.StandardButton.Abort)
+            return
+        if (not firstDateStr):
             QMessageBox.critical(self.ui, 'ERRO', 'A planilha não contém nada a ser importado', QMessageBox.StandardButton.Abort)
             return
-        # First erase orders within date-range
-        dateRange = [order[0] for order in orders]
-        dateRange.sort()
-        numDeletedOrders = self.db.eraseOrdersWithinDateRange(dateRange[0], dateRange[-1])
-        firstDateStr = dateRange[0].strftime('%d/%m/%Y')
-        secondDateStr = dateRange[-1].strftime('%d/%m/%Y')
-        QMessageBox.information(self.ui, 'REMOÇÕES', 'Removidas ' + str(numDeletedOrders) + ' ordens entre ' + firstDateStr + ' e ' + secondDateStr + '!')
-        # Finally insert all orders
-        if (not self.db.addOrders(orders)):
-            QMessageBox.critical(self.ui, 'ERRO', 'Houve um erro ao atualizar o banco de dados. Todas ordens foram removidas.', QMessageBox.StandardButton.Abort)
-            self.db.deleteOrders()
-        else:
-            QMessageBox.information(self.ui, 'SUCESSO', 'Planilha importada com sucesso!\nInseridas ' + str(len(orders)) + ' ordens!')
+        firstDateStr = datetime.datetime.strptime(firstDateStr, '%Y-%m-%d').strftime('%d/%m/%Y')
+        lastDateStr = datetime.datetime.strptime(lastDateStr, '%Y-%m-%d').strftime('%d/%m/%Y')
+        if (numDeletedOrders == 0 and numInsertedOrders == 0):
+            QMessageBox.information(self.ui, 'SUCESSO', 'Planilha importada com sucesso!\nAs ordens entre ' + firstDateStr + ' e ' + lastDateStr + ' já estavam registradas.')
+            return
+        QMessageBox.information(self.ui, 'REMOÇÕES', 'Removidas ' + str(numDeletedOrders) + ' ordens entre ' + firstDateStr + ' e ' + lastDateStr + '!')
+        QMessageBox.information(self.ui, 'SUCESSO', 'Planilha importada com sucesso!\nInseridas ' + str(numInsertedOrders) + ' ordens!')
 
     def wipeOrders(self):
         if (not self.confirmRequest('Apagar operações', True)):
@@ -122,5 +294,24 @@ class RegisterOrder:
         else:
             QMessageBox.information(self.ui, 'SUCESSO', 'Todas as ordens foram removidas!')
 
+    def exportOrders(self):
+        if (self.db.getNumOrders() == 0):
+            QMessageBox.critical(self.ui, 'ERRO', 'Não há ordens cadastradas para exportar', QMessageBox.StandardButton.Abort)
+            return
+        fileName = QFileDialog.getSaveFileName(self.ui, 'Exportar ordens', 'ordens.csv', 'CSV (*.csv);;Parquet (*.parquet)')[0]
+        if (not fileName):
+            return
+        if (not getOrderFileType(fileName)):
+            fileName += '.csv'
+        if (getOrderFileType(fileName) == '.parquet' and not isParquetSupported()):
+            QMessageBox.critical(self.ui, 'ERRO', 'Exportar arquivos Parquet requer o pacote pyarrow', QMessageBox.StandardButton.Abort)
+            return
+        try:
+            numOrders = exportOrders(self.db, fileName)
+        except OSError:
+            QMessageBox.critical(self.ui, 'ERRO', 'Não foi possível salvar o arquivo ' + fileName, QMessageBox.StandardButton.Abort)
+            return
+        QMessageBox.information(self.ui, 'SUCESSO', str(numOrders) + ' ordens exportadas!')
+
     def getUi(self):
         return self.ui
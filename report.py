@@ -1,3 +1,4 @@
+import datetime
 import json
 import sys
 
@@ -19,7 +20,31 @@ class Report:
         layout = self.ui.findChild(QVBoxLayout, 'layout')
         layout.addWidget(self.webView)
 
+    def setHtml(self, html):
+        self.webView.setHtml(html)
+
+    def show(self):
+        self.ui.show()
+        self.ui.raise_()
+        self.ui.activateWindow()
+
+    def showHtml(self, html):
+        self.setHtml(html)
+        self.show()
+
     def showMonthlyReport(self, data):
+        self.showHtml(self.getMonthlyReportHtml(data))
+
+    def showYearlyFreeTaxesReport(self, data, year):
+        self.showHtml(self.getYearlyFreeTaxesReportHtml(data, year))
+
+    def showYearlyTaxesReport(self, data, year):
+        self.showHtml(self.getYearlyTaxesReportHtml(data, year))
+
+    def showEquityReport(self, data, year):
+        self.showHtml(self.getEquityReportHtml(data, year))
+
+    def getMonthlyReportHtml(self, data):
         months = list(data.keys())
         sales = []
         profit = []
@@ -28,10 +53,9 @@ class Report:
             profit.append(round(value[1], 2))
         data = [{'name': 'Total de vendas', 'data': sales, 'tooltip': {'valuePrefix': 'R$'}, 'color': 'blue'},
                 {'name': 'Lucro/prejuízo', 'data': profit, 'tooltip': {'valuePrefix': 'R$'}, 'color': 'green'}]
-        self.webView.setHtml(self.env.get_template('report_monthly.html').render(chart_data=json.dumps(data), chart_months=json.dumps(months)))
-        self.ui.show()
+        return self.env.get_template('report_monthly.html').render(chart_data=json.dumps(data), chart_months=json.dumps(months))
 
-    def showYearlyFreeTaxesReport(self, data, year):
+    def getYearlyFreeTaxesReportHtml(self, data, year):
         xValues = list(data.keys())
         xValues.append('Total')
         sales = []
@@ -47,13 +71,12 @@ class Report:
         profit.append(round(total_profit, 2))
         data = [{'name': 'Total de vendas', 'data': sales, 'tooltip': {'valuePrefix': 'R$'}, 'color': 'blue'},
                 {'name': 'Lucro/prejuízo', 'data': profit, 'tooltip': {'valuePrefix': 'R$'}, 'color': 'green'}]
-        self.webView.setHtml(self.env.get_template('report_taxes.html').render(chart_data=json.dumps(data),
-                                                                               chart_months=json.dumps(xValues),
-                                                                               chart_title='Relatório anual de lucros livres de impostos',
-                                                                               chart_year='ANO ' + str(year)))
-        self.ui.show()
+        return self.env.get_template('report_taxes.html').render(chart_data=json.dumps(data),
+                                                                 chart_months=json.dumps(xValues),
+                                                                 chart_title='Relatório anual de lucros livres de impostos',
+                                                                 chart_year='ANO ' + str(year))
 
-    def showYearlyTaxesReport(self, data, year):
+    def getYearlyTaxesReportHtml(self, data, year):
         months = list(data.keys())
         sales = []
         lossToDiscount = []
@@ -71,8 +94,24 @@ class Report:
                 {'name': 'Prejuizo acumulado', 'data': lossToDiscount, 'tooltip': {'valuePrefix': 'R$'}, 'color': 'red'},
                 {'name': 'Prejuizo abatido', 'data': discountedLoss, 'tooltip': {'valuePrefix': 'R$'}, 'color': 'orange'},
                 {'name': 'Imposto', 'data': taxToPay, 'tooltip': {'valuePrefix': 'R$'}, 'color': 'black'}]
-        self.webView.setHtml(self.env.get_template('report_taxes.html').render(chart_data=json.dumps(data),
-                                                                               chart_months=json.dumps(months),
-                                                                               chart_title='Relatório anual de impostos a serem pagos',
-                                                                               chart_year='ANO ' + str(year)))
-        self.ui.show()
+        return self.env.get_template('report_taxes.html').render(chart_data=json.dumps(data),
+                                                                 chart_months=json.dumps(months),
+                                                                 chart_title='Relatório anual de impostos a serem pagos',
+                                                                 chart_year='ANO ' + str(year))
+
+    def getEquityReportHtml(self, data, year):
+        # Days go as milliseconds since the epoch, as Highcharts takes them
+        epoch = datetime.date(1970, 1, 1)
+        days = [(datetime.date.fromisoformat(dateStr) - epoch).days * 86400000 for dateStr in data.keys()]
+        values = []
+        costs = []
+        profit = []
+        for value in data.values():
+            values.append(round(value[0], 2))
+            costs.append(round(value[1], 2))
+            profit.append(round(value[2], 2))
+        data = [{'name': 'Patrimônio', 'data': list(zip(days, values)), 'tooltip': {'valuePrefix': 'R$'}, 'color': 'blue'},
+                {'name': 'Custo das posições', 'data': list(zip(days, costs)), 'tooltip': {'valuePrefix': 'R$'}, 'color': 'orange'},
+                {'name': 'Lucro/prejuízo não realizado', 'data': list(zip(days, profit)), 'tooltip': {'valuePrefix': 'R$'}, 'color': 'green'}]
+        return self.env.get_template('report_equity.html').render(chart_data=json.dumps(data),
+                                                                  chart_subtitle='ANO ' + str(year) if year else 'Todos os dias operados')
@@ -0,0 +1,26 @@
+import collections
+import sys
+
+class ReportCache:
+    # Least recently used reports, at most maxSize of them. Keys end with the data version
+    # and the fee schedule hash reports were computed with, see Reports.generateReport
+    def __init__(self, maxSize=16):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        if (key not in self.entries):
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while (len(self.entries) > self.maxSize):
+            self.entries.popitem(last=False)
+
+    def evictOutdated(self, dataVersion, feeScheduleHash):
+        # Reports of older orders or config will never be asked again
+        for key in [key for key in self.entries if key[-2:] != (dataVersion, feeScheduleHash)]:
+            del self.entries[key]
@@ -1,12 +1,20 @@
+import csv
+import datetime
 import sys
 
-from calculator import Calculator
+from daily_prices import backfillDailyPrices, importDailyPricesFromCsv
+from equity_curve import EquityCurve
+from price_provider import YahooPriceProvider
 from report import Report
+from report_cache import ReportCache
 from util import gui
 
-from PySide2.QtWidgets import QComboBox, QMessageBox, QPushButton
+from PySide2.QtCore import Qt
+from PySide2.QtWidgets import QApplication, QComboBox, QFileDialog, QMessageBox, QPushButton
 
 class Reports:
+    MAX_CACHED_REPORTS = 4
+
     def __init__(self, db):
         self.ui = gui.load_ui('./windows/reports.ui')
         self.db = db
@@ -17,18 +25,35 @@ class Reports:
         self.button = self.ui.findChild(QPushButton, 'report_button')
         self.button.clicked.connect(self.generateReport)
 
+        self.exportButton = self.ui.findChild(QPushButton, 'export_button')
+        self.exportButton.clicked.connect(self.exportTaxesReports)
+
+        self.backfillPricesButton = self.ui.findChild(QPushButton, 'backfill_prices_button')
+        self.backfillPricesButton.clicked.connect(self.backfillDailyPrices)
+
+        self.importPricesButton = self.ui.findChild(QPushButton, 'import_prices_button')
+        self.importPricesButton.clicked.connect(self.importDailyPrices)
+
         self.year = self.ui.findChild(QComboBox, 'year')
         self.year.hide()
 
+        self.renderedDataVersion = None
+        # Each report cached keeps its window and web view
+        self.reportCache = ReportCache(self.MAX_CACHED_REPORTS)
         self.updateAvailableReports()
 
     def getAvailableReports(self):
         return {'': 'Selecione um relatório',
                 'monthly' : 'Relatório mensal de lucros e prejuízos',
                 'yearly_free_taxes': 'Relatório por ano de lucros livres de impostos',
-                'yearly_taxes': 'Relatório por ano de lucros com impostos a serem pagos'}
+                'yearly_taxes': 'Relatório por ano de lucros com impostos a serem pagos',
+                'equity': 'Evolução diária do patrimônio e lucros não realizados'}
 
     def updateWindow(self):
+        # Nothing to re-render if the database hasn't changed since the last time
+        if (self.db.getDataVersion() == self.renderedDataVersion):
+            return
+        self.renderedDataVersion = self.db.getDataVersion()
         self.updateAvailableYears()
 
     def updateAvailableYears(self):
@@ -45,8 +70,8 @@ class Reports:
 
     def reportTypeChanged(self, index):
         reportType = self.reportOptions.currentData()
-        # Show the year for the reports that demand selecting one
-        if (reportType == 'yearly_free_taxes' or reportType == 'yearly_taxes'):
+        # Show the year for the reports that demand selecting one, the equity report is of every day otherwise
+        if (reportType == 'yearly_free_taxes' or reportType == 'yearly_taxes' or reportType == 'equity'):
             self.year.show()
         else:
             self.year.hide()
@@ -55,39 +80,108 @@ class Reports:
         if (not self.reportOptions.currentData()):
             QMessageBox.critical(self.ui, 'ERRO', 'Por favor selecione um tipo de relatório', QMessageBox.StandardButton.Abort)
             return
-        calculator = Calculator(self.db)
         reportType = self.reportOptions.currentData()
-
-        # Given the report type, generate it
-        reportData = {}
-        year = self.year.currentData()
-        if (reportType == 'monthly'):
-            reportData = calculator.getMonthlyReport(self.db.getOrdersInAscendingDate())
-        elif (reportType == 'yearly_free_taxes' or reportType == 'yearly_taxes'):
+        year = None
+        if (reportType == 'yearly_free_taxes' or reportType == 'yearly_taxes'):
+            year = self.year.currentData()
             if not year:
                 QMessageBox.critical(self.ui, 'ERRO', 'Selecione um ano', QMessageBox.StandardButton.Abort)
                 return
-            if (reportType == 'yearly_free_taxes'):
-                reportData = calculator.getFreeTaxesReport(self.db.getOrdersInAscendingDate(), year)
-            else:
-                reportData = calculator.getPayingTaxesReport(self.db.getOrdersInAscendingDate(), year)
-        else:
-            assert(0)
-
-        if (len(reportData) == 0):
+        elif (reportType == 'equity'):
+            year = self.year.currentData()
+
+        # The same report of the same orders and taxes is only computed and rendered once, its window
+        # is shown again. Reports without data are cached as an empty string
+        dataVersion = self.db.getDataVersion()
+        feeScheduleHash = hash(self.db.getFeeSchedule())
+        self.reportCache.evictOutdated(dataVersion, feeScheduleHash)
+        # Daily prices change apart from orders, only the equity report depends on them
+        dailyPricesVersion = self.db.getDailyPricesVersion() if reportType == 'equity' else None
+        key = (reportType, year, dailyPricesVersion, dataVersion, feeScheduleHash)
+        report = self.reportCache.get(key)
+        if (report is None):
+            reportData = self.getReportData(reportType, year)
+            report = ''
+            if (len(reportData) > 0):
+                self.report = Report()
+                self.report.setHtml(self.getReportHtml(reportType, reportData, year))
+                report = self.report
+            self.reportCache.put(key, report)
+
+        if (not report):
             QMessageBox.critical(self.ui, 'ERRO', 'Não há dados cadastrados para gerar o relatório mensal de lucros e prejuízos', QMessageBox.StandardButton.Abort)
             return
+        self.report = report
+        self.report.show()
 
-        self.showReport(reportType, reportData, year)
+    def getReportData(self, reportType, year):
+        # Given the report type, get it from the ledger
+        ledger = self.db.getLedger()
+        if (reportType == 'monthly'):
+            return ledger.monthlyReport
+        elif (reportType == 'yearly_free_taxes'):
+            return ledger.freeTaxesReports.get(year, {})
+        elif (reportType == 'yearly_taxes'):
+            return ledger.payingTaxesReports.get(year, {})
+        elif (reportType == 'equity'):
+            equityCurve = EquityCurve(self.db, self.db.getOrderStore())
+            if (year):
+                return equityCurve.getDailyReport(str(year) + '-01-01', str(year) + '-12-31')
+            return equityCurve.getDailyReport('', datetime.date.today().isoformat())
+        assert(0)
+
+    def exportTaxesReports(self):
+        # Every year comes from the same pass over the orders, see Ledger
+        rows = self.db.getLedger().getTaxesRows()
+        if (len(rows) == 0):
+            QMessageBox.critical(self.ui, 'ERRO', 'Não há dados cadastrados para exportar os impostos', QMessageBox.StandardButton.Abort)
+            return
+        fileName = QFileDialog.getSaveFileName(self.ui, 'Exportar impostos', 'impostos.csv', 'CSV (*.csv)')[0]
+        if (not fileName):
+            return
+        try:
+            with open(fileName, 'w', newline='', encoding='utf-8') as csvFile:
+                writer = csv.writer(csvFile, delimiter=';')
+                writer.writerow(['Ano', 'Mês', 'Tipo', 'Total de vendas', 'Prejuízo a compensar', 'Prejuízo compensado', 'Lucro/prejuízo', 'Imposto a pagar'])
+                for row in rows:
+                    writer.writerow(row[:2] + ['Isento' if row[2] else 'Tributável'] + ['%.2f' % value for value in row[3:]])
+        except OSError:
+            QMessageBox.critical(self.ui, 'ERRO', 'Não foi possível salvar o arquivo ' + fileName, QMessageBox.StandardButton.Abort)
+            return
+        QMessageBox.information(self.ui, 'SUCESSO', 'Impostos de ' + str(len(set(row[0] for row in rows))) + ' anos exportados!')
+
+    def backfillDailyPrices(self):
+        # Prices are downloaded from the first order of each code, or from its last price
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            numPrices, failedCodes = backfillDailyPrices(self.db, YahooPriceProvider(), datetime.date.today().isoformat())
+        finally:
+            QApplication.restoreOverrideCursor()
+        if (len(failedCodes) > 0):
+            QMessageBox.warning(self.ui, 'AVISO', str(numPrices) + ' cotações baixadas, não foi possível baixar as de: ' + ', '.join(failedCodes))
+            return
+        QMessageBox.information(self.ui, 'SUCESSO', str(numPrices) + ' cotações baixadas!')
+
+    def importDailyPrices(self):
+        fileName = QFileDialog.getOpenFileName(self.ui, 'Importar cotações diárias', '', 'CSV (*.csv)')[0]
+        if (not fileName):
+            return
+        numPrices, errorMessage = importDailyPricesFromCsv(self.db, fileName)
+        if (errorMessage):
+            QMessageBox.critical(self.ui, 'ERRO', errorMessage, QMessageBox.StandardButton.Abort)
+            return
+        QMessageBox.information(self.ui, 'SUCESSO', str(numPrices) + ' cotações importadas!')
 
-    def showReport(self, reportType, reportData, year):
-        self.report = Report()
+    def getReportHtml(self, reportType, reportData, year):
         if (reportType == 'monthly'):
-            self.report.showMonthlyReport(reportData)
+            return self.report.getMonthlyReportHtml(reportData)
         elif (reportType == 'yearly_free_taxes'):
-            self.report.showYearlyFreeTaxesReport(reportData, year)
+            return self.report.getYearlyFreeTaxesReportHtml(reportData, year)
         elif (reportType == 'yearly_taxes'):
-            self.report.showYearlyTaxesReport(reportData, year)
+            return self.report.getYearlyTaxesReportHtml(reportData, year)
+        elif (reportType == 'equity'):
+            return self.report.getEquityReportHtml(reportData, year)
+        assert(0)
 
     def getUi(self):
         return self.ui
@@ -0,0 +1,28 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database import Database
+
+from PySide2.QtCore import QCoreApplication
+
+# Empty database shipped with the needed schema
+SCHEMA_DATABASE = os.path.join(ROOT, 'examples', 'database.db')
+
+@pytest.fixture(scope='session')
+def app():
+    return QCoreApplication.instance() or QCoreApplication(sys.argv)
+
+@pytest.fixture
+def db(app, tmp_path):
+    fileName = str(tmp_path / 'database.db')
+    shutil.copyfile(SCHEMA_DATABASE, fileName)
+    database = Database(fileName, 'test')
+    database.deleteOrders()
+    yield database
+    database.close()
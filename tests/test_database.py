@@ -0,0 +1,145 @@
+import datetime
+import sys
+import time
+
+import pytest
+
+from benchmark import generateOrders
+from calculator import Calculator
+from database import Database, DatabaseError
+from ledger import Ledger
+
+from PySide2.QtSql import QSqlQuery
+
+def test_order_store_raises_if_a_query_fails(db, monkeypatch):
+    db.addOrders(generateOrders(100))
+    assert len(db.getOrderStore()) == 100
+    # Years are still listed while the orders can't be read anymore
+    monkeypatch.setattr(db, 'getYearsWithOrders', lambda: ['2010'])
+    assert QSqlQuery(db.db).exec_('ALTER TABLE orders RENAME TO old_orders')
+    db.bumpDataVersion()
+    with pytest.raises(DatabaseError):
+        db.getOrderStore()
+    # Nothing is kept, so the next call queries again
+    assert db.orderStoreDataVersion != db.getDataVersion()
+
+def assertSameLedger(ledger, expectedLedger):
+    assert ledger.lastDateStr == expectedLedger.lastDateStr
+    assert ledger.profitsAndLosses == expectedLedger.profitsAndLosses
+    assert ledger.monthlyReport == expectedLedger.monthlyReport
+    assert ledger.yearExtracts == expectedLedger.yearExtracts
+    assert ledger.getTaxesRows() == expectedLedger.getTaxesRows()
+
+@pytest.fixture
+def otherDb(db):
+    # Next session on the same file
+    database = Database(db.getFileName(), 'other')
+    yield database
+    database.close()
+
+def test_ledger_is_saved_for_the_next_session(db, otherDb, monkeypatch):
+    orders = generateOrders(6000)
+    db.addOrders(orders[:4000])
+    ledger = db.getLedger()
+    monkeypatch.setattr(Ledger, 'processOrderStore', None)
+    assertSameLedger(otherDb.getLedger(), ledger)
+    # Orders after the last date are appended to the saved ledger
+    db.addOrders(orders[4000:])
+    ledger = db.getLedger()
+    assertSameLedger(otherDb.getLedger(), ledger)
+    # Commits that don't change orders keep the ledger
+    assert otherDb.addCheckpoint('2000-01-31', {}, otherDb.storedDataVersion)
+    assert db.getLedger() is ledger
+
+def test_saved_ledger_is_dropped_on_earlier_changes(db, otherDb):
+    orders = generateOrders(6000)
+    db.addOrders(orders)
+    db.getLedger()
+    db.addOrders([[orders[0][0], 'C', 'NEW', '', 100, 10.0]])
+    ledger = otherDb.getLedger()
+    assertSameLedger(ledger, Ledger(db, db.getOrderStore()))
+    db.updateTaxValues(2.5, 0.5, 0.0)
+    assert otherDb.getLedger() is not ledger
+    assertSameLedger(otherDb.getLedger(), Ledger(db, db.getOrderStore()))
+
+def getOrderIdsAndKeys(db):
+    return [[order[0], order[1], order[2], order[3], order[5], order[6]] for order in db.iterateOrdersInAscendingDate()]
+
+def test_import_replaces_changed_days_keeping_their_order(db):
+    date = datetime.datetime(2021, 1, 4)
+    assert db.importOrders([[date, 'C', 'A', '', 100, 10.0], [date, 'V', 'A', '', 50, 12.0]])[:2] == [0, 2]
+    # The buy is corrected, the sale must still come after it
+    orders = [[date, 'C', 'A', '', 200, 10.0], [date, 'V', 'A', '', 50, 12.0]]
+    assert db.importOrders(orders) == [2, 2, '2021-01-04', '2021-01-04']
+    assert [order[2:] for order in getOrderIdsAndKeys(db)] == [['C', 'A', 200, 10.0], ['V', 'A', 50, 12.0]]
+    ledger = db.getLedger()
+    db.deleteOrders()
+    db.addOrders(orders)
+    assert ledger.profitsAndLosses == Ledger(db, db.getOrderStore()).profitsAndLosses
+    assert ledger.profitsAndLosses[0][2] > 10
+
+def test_import_of_the_same_orders_changes_nothing(db):
+    orders = generateOrders(1000)
+    db.importOrders(orders)
+    idsAndKeys = getOrderIdsAndKeys(db)
+    dataVersion = db.getDataVersion()
+    assert db.importOrders(orders)[:2] == [0, 0]
+    assert getOrderIdsAndKeys(db) == idsAndKeys
+    assert db.getDataVersion() == dataVersion
+
+def test_import_of_overlapping_dates(db):
+    days = [datetime.datetime(2021, 1, day) for day in range(4, 8)]
+    db.importOrders([[days[0], 'C', 'A', '', 100, 10.0], [days[1], 'C', 'B', '', 100, 20.0],
+                     [days[1], 'C', 'A', '', 100, 11.0], [days[2], 'C', 'B', '', 100, 21.0]])
+    before = getOrderIdsAndKeys(db)
+    # The first day is out of range, the second one is the same, the third one changes order and the last one is new
+    result = db.importOrders([[days[1], 'C', 'B', '', 100, 20.0], [days[1], 'C', 'A', '', 100, 11.0],
+                              [days[2], 'V', 'A', '', 100, 12.0], [days[2], 'C', 'B', '', 100, 21.0],
+                              [days[3], 'V', 'B', '', 200, 22.0]])
+    assert result == [1, 3, '2021-01-05', '2021-01-07']
+    after = getOrderIdsAndKeys(db)
+    assert after[:3] == before[:3]
+    assert [order[1:] for order in after[3:]] == [['2021-01-06', 'V', 'A', 100, 12.0], ['2021-01-06', 'C', 'B', 100, 21.0],
+                                                  ['2021-01-07', 'V', 'B', 200, 22.0]]
+
+def test_other_connections_write_while_orders_are_staged(db, otherDb):
+    orders = generateOrders(1000)
+    def iterateOrders():
+        yield from orders[:500]
+        # A long import must not block the GUI connection until SQLite's busy timeout
+        start = time.time()
+        assert otherDb.updateQuotes({'TICK0': 10.0}, 0, 'test', 60)
+        assert otherDb.addCheckpoint('2000-01-31', {}, otherDb.storedDataVersion)
+        assert time.time() - start < 1
+        yield from orders[500:]
+    assert db.importOrders(iterateOrders())[:2] == [0, 1000]
+    assert len(otherDb.getOrderStore()) == 1000
+
+def test_checkpoints_of_older_data_are_not_saved(db, otherDb):
+    orders = generateOrders(2000)
+    db.addOrders(orders[:1000])
+    calculator = Calculator(otherDb)
+    lastYear = int(orders[999][0].year)
+    ordersUpToYear = calculator.getOrdersAfterCheckpoint(lastYear, lastYear)
+    # Orders change while the other connection replays them
+    db.addOrders(orders[1000:])
+    calculator.getYearExtract(ordersUpToYear)
+    assert otherDb.getCheckpoint(str(lastYear) + '-12-31') == ['', {}]
+    calculator = Calculator(otherDb)
+    calculator.getYearExtract(calculator.getOrdersAfterCheckpoint(lastYear, lastYear))
+    assert otherDb.getCheckpoint(str(lastYear) + '-12-31')[0] != ''
+
+def test_ledger_year_extracts(db):
+    # Extract and Position show these, years after the last order keep its position
+    orders = generateOrders(3000, ordersPerDay=1)
+    db.addOrders(orders)
+    store = db.getOrderStore()
+    ledger = db.getLedger()
+    assert ledger.getYearExtract(2009) == {}
+    for year in range(2010, orders[-1][0].year + 2):
+        extract = ledger.getYearExtract(year)
+        expectedExtract = Calculator(db).getYearExtract(store.sliceUpToYear(year))
+        assert sorted(extract) == sorted(expectedExtract)
+        for code, stock in expectedExtract.items():
+            assert extract[code][0] == stock[0]
+            assert abs(extract[code][1] - stock[1]) < 1e-6
@@ -0,0 +1,91 @@
+import math
+import sys
+
+import pytest
+
+from benchmark import DecimalCalculator
+from fixed_point_calculator import FIXED_POINT_SETTING, FixedPointCalculator
+from test_vectorized_calculator import LEDGER_SHAPES, TAXES, generateLedger
+
+SEEDS = range(10)
+
+def assertClose(a, b):
+    assert math.isclose(a, b, rel_tol=0, abs_tol=1e-6), (a, b)
+
+@pytest.mark.parametrize('taxFee, taxRate', TAXES)
+@pytest.mark.parametrize('shape', LEDGER_SHAPES)
+@pytest.mark.parametrize('seed', SEEDS)
+def test_same_results_as_decimal(db, seed, shape, taxFee, taxRate):
+    db.updateTaxValues(taxFee, taxRate, 0.0)
+    db.addOrders(generateLedger(seed, *shape))
+    store = db.getOrderStore()
+
+    expectedReport = DecimalCalculator(db).getMonthlyReport(store)
+    report = FixedPointCalculator(db).getMonthlyReport(store)
+    assert list(report) == list(expectedReport)
+    for month in expectedReport:
+        assertClose(report[month][0], float(expectedReport[month][0]))
+        assertClose(report[month][1], float(expectedReport[month][1]))
+
+    expectedProfits = DecimalCalculator(db).getProfitsAndLosses(store)
+    profits = FixedPointCalculator(db).getProfitsAndLosses(store)
+    assert len(profits) == len(expectedProfits)
+    for row, expectedRow in zip(profits, expectedProfits):
+        assert row[:2] == expectedRow[:2]
+        assert row[3:5] == expectedRow[3:5]
+        assertClose(row[2], float(expectedRow[2]))
+        assertClose(row[5], float(expectedRow[5]))
+    # Rows give the same results as the arrays of the store
+    assert FixedPointCalculator(db).getProfitsAndLosses(list(store)) == profits
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_one_order_at_a_time(db, seed):
+    db.updateTaxValues(2.5, 0.5, 0.0)
+    db.addOrders(generateLedger(seed, *LEDGER_SHAPES[2]))
+    store = db.getOrderStore()
+    calculator = FixedPointCalculator(db)
+    profits = []
+    for order in store:
+        calculator.updateStockAverageValueAndAmount(order)
+        if (order[2] == 'V'):
+            totalSellingValueWithoutTaxes, averageBuyingValue, profit = calculator.getSaleProfit(order)
+            profits.append([order[1], order[3], averageBuyingValue, order[5], order[6], profit])
+    assert profits == FixedPointCalculator(db).getProfitsAndLosses(store)
+    assert calculator.stocks == FixedPointCalculator(db).getYearExtract(store)
+
+def test_checkpoints(db):
+    db.addOrders(generateLedger(0, *LEDGER_SHAPES[3]))
+    store = db.getOrderStore()
+    lastYear = int(store.getDateStrs()[-1][:4])
+    for year in range(lastYear - 2, lastYear + 1):
+        expectedExtract = FixedPointCalculator(db).getYearExtract(store.sliceUpToYear(year))
+        expectedExtract = {code: stock for code, stock in expectedExtract.items() if stock[0] != 0}
+        # Saves checkpoints first, then starts from them. Checkpoints keep average values as floats,
+        # which hold fewer digits than averages
+        for i in range(2):
+            calculator = FixedPointCalculator(db)
+            extract = calculator.getYearExtract(calculator.getOrdersAfterCheckpoint(year, year))
+            extract = {code: stock for code, stock in extract.items() if stock[0] != 0}
+            assert sorted(extract) == sorted(expectedExtract)
+            for code, stock in extract.items():
+                assert stock[0] == expectedExtract[code][0]
+                assertClose(stock[1], expectedExtract[code][1])
+
+def test_ledger_setting(db):
+    orders = generateLedger(1, *LEDGER_SHAPES[1])
+    db.addOrders(orders[:600])
+    assert not isinstance(db.getLedger().calculator, FixedPointCalculator)
+    db.updateSetting(FIXED_POINT_SETTING, '1')
+    ledger = db.getLedger()
+    assert isinstance(ledger.calculator, FixedPointCalculator)
+    # Appended orders continue from the stocks of the last ones
+    db.addOrders(orders[600:])
+    ledger = db.getLedger()
+    store = db.getOrderStore()
+    assert ledger.profitsAndLosses == FixedPointCalculator(db).getProfitsAndLosses(store)
+    expectedReport = FixedPointCalculator(db).getMonthlyReport(store)
+    assert list(ledger.monthlyReport) == list(expectedReport)
+    for month in expectedReport:
+        assertClose(ledger.monthlyReport[month][1], expectedReport[month][1])
+    for year, extract in ledger.yearExtracts.items():
+        assert extract == FixedPointCalculator(db).getYearExtract(store.sliceUpToYear(year))
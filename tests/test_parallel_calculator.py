@@ -0,0 +1,49 @@
+import sys
+
+import pytest
+
+from parallel_calculator import PARALLEL_SETTING, ParallelCalculator, createVectorizedCalculator
+from test_vectorized_calculator import LEDGER_SHAPES, TAXES, assertClose, generateLedger
+from vectorized_calculator import VectorizedCalculator
+
+@pytest.mark.parametrize('taxFee, taxRate', TAXES)
+@pytest.mark.parametrize('shape', LEDGER_SHAPES)
+@pytest.mark.parametrize('numWorkers, chunkSize', [[1, 100], [2, 100], [2, ParallelCalculator.DEFAULT_CHUNK_SIZE]])
+def test_same_results_as_vectorized_calculator(db, numWorkers, chunkSize, shape, taxFee, taxRate):
+    db.updateTaxValues(taxFee, taxRate, 0.0)
+    db.addOrders(generateLedger(0, *shape))
+    store = db.getOrderStore()
+    vectorizedCalculator = VectorizedCalculator(db, store)
+    parallelCalculator = ParallelCalculator(db, store, numWorkers, chunkSize)
+
+    expectedProfits = vectorizedCalculator.getProfitsAndLosses()
+    profits = parallelCalculator.getProfitsAndLosses()
+    assert [row[:2] + row[3:5] for row in profits] == [row[:2] + row[3:5] for row in expectedProfits]
+    for row, expectedRow in zip(profits, expectedProfits):
+        assertClose(row[2], expectedRow[2])
+        assertClose(row[5], expectedRow[5])
+    expectedReport = vectorizedCalculator.getMonthlyReport()
+    report = parallelCalculator.getMonthlyReport()
+    assert list(report) == list(expectedReport)
+    for month in expectedReport:
+        assertClose(report[month][0], expectedReport[month][0])
+        assertClose(report[month][1], expectedReport[month][1])
+    expectedExtracts = vectorizedCalculator.getYearExtracts()
+    extracts = parallelCalculator.getYearExtracts()
+    assert list(extracts) == list(expectedExtracts)
+    for year, extract in expectedExtracts.items():
+        assert sorted(extracts[year]) == sorted(extract)
+        for code, stock in extract.items():
+            assert extracts[year][code][0] == stock[0]
+            assertClose(extracts[year][code][1], stock[1])
+
+def test_setting_and_threshold(db, monkeypatch):
+    db.addOrders(generateLedger(0, *LEDGER_SHAPES[1]))
+    store = db.getOrderStore()
+    monkeypatch.setattr(ParallelCalculator, 'MIN_ORDERS', len(store))
+    assert not isinstance(createVectorizedCalculator(db, store), ParallelCalculator)
+    db.updateSetting(PARALLEL_SETTING, '1')
+    assert isinstance(createVectorizedCalculator(db, store), ParallelCalculator)
+    assert db.getLedger().profitsAndLosses == ParallelCalculator(db, store).getProfitsAndLosses()
+    monkeypatch.setattr(ParallelCalculator, 'MIN_ORDERS', len(store) + 1)
+    assert not isinstance(createVectorizedCalculator(db, store), ParallelCalculator)
@@ -0,0 +1,88 @@
+import datetime
+import sys
+import time
+
+import pytest
+
+from database import Database
+from position import FetchPriceWorker
+from price_provider import B3_TIMEZONE
+from test_price_provider import RecordingProvider
+
+# A monday and a friday, times of Brasília
+MARKET_OPEN = datetime.datetime(2021, 3, 1, 12, 0, tzinfo=B3_TIMEZONE).timestamp()
+MARKET_CLOSED = datetime.datetime(2021, 3, 5, 19, 0, tzinfo=B3_TIMEZONE).timestamp()
+NEXT_OPENING = datetime.datetime(2021, 3, 8, 10, 0, tzinfo=B3_TIMEZONE).timestamp()
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Time seen by the worker, set by tests
+    clock = [MARKET_OPEN]
+    monkeypatch.setattr(time, 'time', lambda: clock[0])
+    return clock
+
+@pytest.fixture
+def worker(app):
+    worker = FetchPriceWorker(RecordingProvider())
+    worker.fetched = []
+    worker.fetchingFinished.connect(lambda data, ttl: worker.fetched.append([data, ttl]))
+    yield worker
+    worker.timer.stop()
+
+def test_quotes_are_kept_in_the_database(db):
+    db.updateQuotes({'CODE0': 10.5, 'CODE1': 20.25}, 1000, 'stub', 60)
+    db.updateQuotes({'CODE0': 11.0}, 1060, 'stub', 120)
+    otherDb = Database(db.getFileName(), 'other')
+    try:
+        assert otherDb.getQuotes() == {'CODE0': [11.0, 1060, 'stub', 120], 'CODE1': [20.25, 1000, 'stub', 60]}
+    finally:
+        otherDb.close()
+
+def test_only_expired_quotes_are_fetched(worker, clock):
+    now = clock[0]
+    worker.setActive(True)
+    worker.setCodes({'CODE0': now + 30, 'CODE1': now, 'CODE2': 0})
+    worker.fetch()
+    assert worker.fetcher.provider.batches == [['CODE1', 'CODE2']]
+    assert [sorted(data) for data, ttl in worker.fetched] == [['CODE1', 'CODE2']]
+    assert worker.codes == {'CODE0': now + 30, 'CODE1': now + 60, 'CODE2': now + 60}
+    # Cached quotes aren't fetched again before they expire
+    clock[0] = now + 10
+    worker.fetch()
+    assert len(worker.fetcher.provider.batches) == 1
+    clock[0] = now + 30
+    worker.fetch()
+    assert worker.fetcher.provider.batches[1:] == [['CODE0']]
+
+def test_quote_ttl_follows_market_hours(worker):
+    assert worker.getQuoteTtl(MARKET_OPEN) == FetchPriceWorker.QUOTE_TTL_IN_SECONDS
+    # Quotes fetched when the market is closed last until it opens again
+    assert worker.getQuoteTtl(MARKET_CLOSED) == NEXT_OPENING - MARKET_CLOSED
+
+@pytest.mark.parametrize('now, interval', [[MARKET_OPEN, FetchPriceWorker.QUOTE_TTL_IN_SECONDS],
+                                           [MARKET_CLOSED, NEXT_OPENING - MARKET_CLOSED]])
+def test_next_fetch_is_scheduled_on_expiration(worker, clock, now, interval):
+    clock[0] = now
+    worker.setActive(True)
+    worker.setCodes({'CODE0': 0, 'CODE1': 0})
+    worker.fetch()
+    assert worker.fetched[0][1] == interval
+    assert worker.timer.isActive()
+    assert worker.timer.interval() == interval * 1000
+
+def test_nothing_is_fetched_while_not_seen(worker, clock):
+    worker.setCodes({'CODE0': 0})
+    assert not worker.timer.isActive()
+    worker.fetch()
+    assert worker.fetcher.provider.batches == []
+    # Seeing prices fetches them at once, hiding them stops the checks
+    worker.setActive(True)
+    assert worker.timer.isActive()
+    assert worker.timer.interval() == 0
+    worker.fetch()
+    assert worker.fetcher.provider.batches == [['CODE0']]
+    worker.setActive(False)
+    assert not worker.timer.isActive()
+    clock[0] += FetchPriceWorker.QUOTE_TTL_IN_SECONDS
+    worker.fetch()
+    assert len(worker.fetcher.provider.batches) == 1
@@ -0,0 +1,90 @@
+import sys
+
+import pytest
+
+from price_provider import PriceFetcher, PriceProviderError, StubPriceProvider
+
+CODES = ['CODE' + str(i) for i in range(10)]
+
+class RecordingProvider(StubPriceProvider):
+    # Records the batches requested and fails the requests whose numbers are in failingRequests
+    def __init__(self, failingRequests=(), **kwargs):
+        super().__init__(**kwargs)
+        self.failingRequests = set(failingRequests)
+        self.batches = []
+
+    def getPrices(self, codes):
+        self.batches.append(list(codes))
+        if (len(self.batches) in self.failingRequests):
+            raise PriceProviderError('Request ' + str(len(self.batches)) + ' failed')
+        return super().getPrices(codes)
+
+@pytest.mark.parametrize('maxBatchSize', [1, 3, 10, 50])
+def test_batches(maxBatchSize):
+    provider = RecordingProvider(maxBatchSize=maxBatchSize)
+    prices = PriceFetcher(provider, seed=0).fetch(CODES, 0)
+    assert sorted(prices) == sorted(CODES)
+    assert all(len(batch) <= maxBatchSize for batch in provider.batches)
+    assert sum(provider.batches, []) == CODES
+    assert len(provider.batches) == (len(CODES) + maxBatchSize - 1) // maxBatchSize
+
+@pytest.mark.parametrize('seed', range(5))
+def test_backoff_bounds(seed):
+    # Doubles on each failure from the initial backoff up to the max one, jitter takes up to half of it
+    fetcher = PriceFetcher(StubPriceProvider(), seed=seed)
+    for numFailures in range(1, 15):
+        backoff = min(PriceFetcher.INITIAL_BACKOFF_IN_SECONDS * 2 ** (numFailures - 1), PriceFetcher.MAX_BACKOFF_IN_SECONDS)
+        for i in range(20):
+            assert backoff / 2 <= fetcher.getBackoff(numFailures) <= backoff
+    # Fetchers seeded apart don't retry together
+    backoffs = [PriceFetcher(StubPriceProvider(), seed=seed).getBackoff(5) for seed in range(5)]
+    assert len(set(backoffs)) == len(backoffs)
+
+def test_failed_request_backs_off_the_provider():
+    provider = RecordingProvider(failingRequests=[2, 3], maxBatchSize=4)
+    fetcher = PriceFetcher(provider, seed=0)
+    # The batches after a failed one aren't requested
+    prices = fetcher.fetch(CODES, 100)
+    assert sorted(prices) == CODES[:4]
+    assert len(provider.batches) == 2
+    assert 100 + 0.5 <= fetcher.backoffUntil <= 100 + 1
+    assert fetcher.getNextFetchTime('CODE5', 0) == fetcher.backoffUntil
+    # Nothing is requested before backoffUntil
+    assert fetcher.fetch(CODES, fetcher.backoffUntil - 0.01) == {}
+    assert len(provider.batches) == 2
+    # Consecutive failures double the backoff
+    now = fetcher.backoffUntil
+    assert fetcher.fetch(CODES[4:], now) == {}
+    assert now + 1 <= fetcher.backoffUntil <= now + 2
+    # A successful request resets it
+    now = fetcher.backoffUntil
+    assert sorted(fetcher.fetch(CODES[4:], now)) == CODES[4:]
+    assert fetcher.numFailures == 0
+    assert fetcher.getNextFetchTime('CODE5', 0) == now
+
+def test_codes_not_found_back_off_on_their_own():
+    provider = RecordingProvider(missingCodes=['CODE1', 'CODE2'], maxBatchSize=4)
+    fetcher = PriceFetcher(provider, seed=0)
+    prices = fetcher.fetch(CODES, 100)
+    assert sorted(prices) == sorted(set(CODES) - {'CODE1', 'CODE2'})
+    assert sorted(fetcher.getErrors()) == ['CODE1', 'CODE2']
+    for code in ['CODE1', 'CODE2']:
+        numErrors, retryTime = fetcher.getErrors()[code]
+        assert numErrors == 1
+        assert 100 + 0.5 <= retryTime <= 100 + 1
+        assert fetcher.getNextFetchTime(code, 0) == retryTime
+    # Other codes are still fetched, the missing ones only after their retry time
+    provider.batches = []
+    fetcher.fetch(CODES, 100.1)
+    assert sum(provider.batches, []) == [code for code in CODES if code not in ['CODE1', 'CODE2']]
+    retryTime = max(fetcher.getErrors()[code][1] for code in ['CODE1', 'CODE2'])
+    provider.batches = []
+    fetcher.fetch(['CODE1', 'CODE2'], retryTime)
+    assert sum(provider.batches, []) == ['CODE1', 'CODE2']
+    # Their backoff doubles with each error, and ends once found
+    numErrors, nextRetryTime = fetcher.getErrors()['CODE1']
+    assert numErrors == 2
+    assert retryTime + 1 <= nextRetryTime <= retryTime + 2
+    provider.missingCodes = set()
+    assert sorted(fetcher.fetch(['CODE1', 'CODE2'], nextRetryTime + 2)) == ['CODE1', 'CODE2']
+    assert fetcher.getErrors() == {}
@@ -0,0 +1,71 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+from process_note import FEE_PATTERN, TRADE_PATTERN, ProcessNote, getPageText
+from process_order import ErrorType
+
+# Notes laid out as SINACOR prints them, in PDF and as text converted by getPageText, one page per form feed
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+CODES_BY_NAME = {'AMBEV S/A ON': 'ABEV3', 'PETROBRAS PN N2': 'PETR4', 'XPML11 CI': 'XPML11'}
+
+def getFixtureTexts(name):
+    with open(os.path.join(FIXTURES, name + '.txt'), encoding='utf-8') as textFile:
+        return [page + '\x0c' for page in textFile.read().split('\x0c')[:-1]]
+
+def processTexts(pageTexts, codesByName=CODES_BY_NAME):
+    processor = ProcessNote('note.pdf', pageTexts, codesByName)
+    return [processor, processor.processFile('note.pdf')]
+
+def test_trade_and_fee_patterns():
+    pageTexts = getFixtureTexts('sinacor_note')
+    trades = [trade.group(1, 2, 3, 4, 5, 6, 7) for text in pageTexts for trade in TRADE_PATTERN.finditer(text)]
+    assert trades == [('C', 'VISTA', 'AMBEV S/A ON', '1.000', '18,50', '18.500,00', 'D'),
+                      ('V', 'FRACIONARIO', 'PETROBRAS PN N2 #', '5', '30,10', '150,50', 'C'),
+                      ('C', 'VISTA', 'XPML11 CI', '3', '100,00', '300,00', 'D')]
+    # Fees beside the business summary are found as well, totals aren't fees. Blocks of the summary
+    # may come in any order
+    fees = sorted(fee.group(1, 2, 3) for fee in FEE_PATTERN.finditer(pageTexts[1]))
+    assert fees == sorted([('Taxa de liquidação', '4,99', 'D'), ('Taxa de Registro', '0,00', 'D'),
+                           ('Taxa de termo/opções', '0,00', 'D'), ('Taxa A.N.A.', '0,00', 'D'), ('Emolumentos', '0,95', 'D'),
+                           ('Taxa Operacional', '10,00', 'D'), ('Execução', '0,00', None), ('Taxa de Custódia', '0,00', None),
+                           ('Impostos', '0,50', None), ('Outros', '0,00', 'C')])
+
+def test_note():
+    processor, orders = processTexts(getFixtureTexts('sinacor_note'))
+    assert processor.getErrorType() == ErrorType.NO_ERROR
+    date = datetime.datetime(2021, 3, 15)
+    assert orders == [[date, 'C', 'ABEV3', 'AMBEV S/A ON', 1000, 18.5],
+                      [date, 'V', 'PETR4F', 'PETROBRAS PN N2', 5, 30.1],
+                      [date, 'C', 'XPML11', 'XPML11 CI', 3, 100.0]]
+    # The note spans both pages
+    assert processor.notes == [['12345', '2021-03-15', 16.44, 3]]
+
+def test_unknown_titles_by_ticker():
+    processor, orders = processTexts(getFixtureTexts('sinacor_note'), {'AMBEV S/A ON': 'ABEV3'})
+    assert processor.getErrorType() == ErrorType.UNKNOWN_STOCK_CODE
+    assert processor.errorField == ['PETROBRAS PN N2 #', 1]
+    processor, orders = processTexts([getFixtureTexts('sinacor_note')[1]], {})
+    assert processor.getErrorType() == ErrorType.NO_ERROR
+    assert [order[2:4] for order in orders] == [['XPML11', 'XPML11']]
+
+@pytest.mark.parametrize('codesByName', [CODES_BY_NAME, {}])
+def test_day_trade(codesByName):
+    # Titles as tickers are looked up without the observation, but day trades are found first
+    processor, orders = processTexts(getFixtureTexts('sinacor_day_trade'), codesByName)
+    assert orders is False
+    assert processor.getErrorType() == ErrorType.DAY_TRADE_FOUND
+    assert processor.errorField == ['PETR4 D', 1]
+    processor, orders = processTexts([text.replace('PETROBRAS PN N2 #', 'PETROBRAS PN N2 D') for text in getFixtureTexts('sinacor_note')])
+    assert processor.getErrorType() == ErrorType.DAY_TRADE_FOUND
+    assert processor.errorField == ['PETROBRAS PN N2 D', 1]
+
+@pytest.mark.parametrize('name', ['sinacor_note', 'sinacor_day_trade'])
+def test_pdf_pages_keep_table_rows(name):
+    # Rows of the table are kept in a line each, as the fixture texts have them
+    pageTexts = getFixtureTexts(name)
+    pdfTexts = [getPageText([os.path.join(FIXTURES, name + '.pdf'), pageNum]) for pageNum in range(len(pageTexts))]
+    assert [TRADE_PATTERN.findall(text) for text in pdfTexts] == [TRADE_PATTERN.findall(text) for text in pageTexts]
+    assert [FEE_PATTERN.findall(text) for text in pdfTexts] == [FEE_PATTERN.findall(text) for text in pageTexts]
@@ -0,0 +1,20 @@
+import sys
+
+from benchmark import generateOrders
+from database import Database
+
+from PySide2.QtSql import QSqlQuery
+
+def assertHotQueriesUseIndexes(db):
+    assert db.checkQueryPlans() == {}
+    for queryStr in Database.HOT_QUERIES:
+        assert any('INDEX' in detail for detail in db.getQueryPlan(queryStr)), queryStr
+
+def test_hot_queries_use_indexes(db):
+    assertHotQueriesUseIndexes(db)
+
+def test_hot_queries_use_indexes_once_analyzed(db):
+    # The planner may change its mind once it knows the data distribution
+    db.addOrders(generateOrders(5000))
+    QSqlQuery(db.db).exec_('ANALYZE')
+    assertHotQueriesUseIndexes(db)
@@ -0,0 +1,70 @@
+import csv
+import shutil
+import sys
+
+import pytest
+
+from benchmark import generateOrders
+from conftest import SCHEMA_DATABASE
+from database import Database
+from order_file import ORDER_FILE_COLUMNS, exportOrders, isParquetSupported
+from process_order import getFileHash
+from register_order import ImportWorker
+
+def writeOrderFile(fileName, rows):
+    with open(fileName, 'w', newline='', encoding='utf-8') as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(ORDER_FILE_COLUMNS)
+        writer.writerows(rows)
+    return fileName
+
+def test_files_are_sorted_by_date_in_the_database(db, tmp_path):
+    # Orders of a same day keep the order of files and rows
+    files = [writeOrderFile(str(tmp_path / 'first.csv'), [['2021-03-02', 'C', 'ABEV3', '', 100, 15.5],
+                                                          ['2021-03-01', 'C', 'PETR4', '', 200, 30.0],
+                                                          ['2021-03-02', 'V', 'ABEV3', '', 100, 16.0]]),
+             writeOrderFile(str(tmp_path / 'second.csv'), [['2021-03-01', 'C', 'ITSA4', '', 300, 10.0],
+                                                           ['2021-03-02', 'C', 'ABEV3', '', 100, 15.5]])]
+    importResult, errors = ImportWorker(db.getFileName()).importFilesToDatabase(db, files)
+    assert errors == []
+    assert importResult == [0, 5, '2021-03-01', '2021-03-02']
+    assert [order[1:4] + order[5:] for order in db.iterateOrdersInAscendingDate()] == \
+           [['2021-03-01', 'C', 'PETR4', 200, 30.0], ['2021-03-01', 'C', 'ITSA4', 300, 10.0],
+            ['2021-03-02', 'C', 'ABEV3', 100, 15.5], ['2021-03-02', 'V', 'ABEV3', 100, 16.0],
+            ['2021-03-02', 'C', 'ABEV3', 100, 15.5]]
+
+def test_files_are_imported_only_if_all_are_valid(db, tmp_path):
+    files = [writeOrderFile(str(tmp_path / 'valid.csv'), [['2021-03-01', 'C', 'PETR4', '', 200, 30.0]]),
+             writeOrderFile(str(tmp_path / 'invalid.csv'), [['2021-03-01', 'X', 'PETR4', '', 200, 30.0]]),
+             writeOrderFile(str(tmp_path / 'other.csv'), [['2021-03-02', 'C', 'PETR4', '', 200, 30.0]])]
+    importResult, errors = ImportWorker(db.getFileName()).importFilesToDatabase(db, files)
+    assert importResult is None
+    assert [fileName for fileName, errorMessage in errors] == [files[1]]
+    assert list(db.iterateOrdersInAscendingDate()) == []
+    assert not any(db.isFileImported(getFileHash(fileName)) for fileName in files)
+
+@pytest.mark.parametrize('fileType', ['.csv', pytest.param('.parquet', marks=pytest.mark.skipif(not isParquetSupported(), reason='needs pyarrow'))])
+def test_exported_orders_import_back_the_same(db, tmp_path, fileType):
+    # Names with separators and quotes, values with every digit of a float
+    orders = generateOrders(3000, ordersPerDay=7)
+    names = ['', 'AMBEV S/A ON', 'PETROBRAS PN, N2', 'ITAÚSA "PN" EDJ']
+    for i, order in enumerate(orders):
+        order[3] = names[i % len(names)]
+        if (i % 5 == 0):
+            order[5] = order[5] / 3
+    db.addOrders(orders)
+    expectedOrders = [order[1:] for order in db.iterateOrdersInAscendingDate()]
+    fileName = str(tmp_path / ('orders' + fileType))
+    assert exportOrders(db, fileName) == len(orders)
+
+    otherFileName = str(tmp_path / 'other.db')
+    shutil.copyfile(SCHEMA_DATABASE, otherFileName)
+    otherDb = Database(otherFileName, 'other')
+    try:
+        otherDb.deleteOrders()
+        importResult, errors = ImportWorker(otherFileName).importFilesToDatabase(otherDb, [fileName])
+        assert errors == []
+        assert importResult[:2] == [0, len(orders)]
+        assert [order[1:] for order in otherDb.iterateOrdersInAscendingDate()] == expectedOrders
+    finally:
+        otherDb.close()
@@ -0,0 +1,87 @@
+import datetime
+import math
+import random
+import sys
+
+import pytest
+
+from calculator import Calculator
+from vectorized_calculator import VectorizedCalculator
+
+SEEDS = range(25)
+# [numOrders, numCodes, ordersPerDay, sell ratio, ratio of sales closing the position, ratio of sales going short]
+LEDGER_SHAPES = [[300, 3, 5, 0.4, 0.0, 0.0],
+                 [1000, 20, 20, 0.5, 0.3, 0.0],
+                 [1000, 5, 3, 0.5, 0.2, 0.1],
+                 [2000, 50, 40, 0.6, 0.1, 0.05]]
+# [tax fee, tax rate]
+TAXES = [[0.0, 0.0], [2.5, 0.5]]
+
+def generateLedger(seed, numOrders, numCodes, ordersPerDay, sellRatio, closeRatio, shortRatio):
+    # Orders over a few codes, so positions are closed to exactly 0, reopened and sold short often
+    rng = random.Random(seed)
+    codes = ['TICK' + str(i) for i in range(numCodes)]
+    amounts = dict.fromkeys(codes, 0)
+    date = datetime.date(2015, 1, 1)
+    orders = []
+    for i in range(numOrders):
+        if (i % ordersPerDay == 0):
+            date += datetime.timedelta(days=rng.randint(1, 20))
+        code = rng.choice(codes)
+        value = round(rng.uniform(0.5, 150), 2)
+        if (rng.random() < sellRatio):
+            if (amounts[code] > 0 and rng.random() < closeRatio):
+                amount = amounts[code]
+            elif (rng.random() < shortRatio):
+                amount = max(amounts[code], 0) + rng.randint(1, 300)
+            elif (amounts[code] > 0):
+                amount = rng.randint(1, amounts[code])
+            else:
+                continue
+            orders.append([date, 'V', code, '', amount, value])
+            amounts[code] -= amount
+        else:
+            amount = rng.randint(1, 500)
+            # Calculator can't average a buy that covers a short position exactly
+            if (amounts[code] + amount == 0):
+                amount += 1
+            orders.append([date, 'C', code, '', amount, value])
+            amounts[code] += amount
+    return orders
+
+def assertClose(a, b):
+    assert math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6), (a, b)
+
+@pytest.mark.parametrize('taxFee, taxRate', TAXES)
+@pytest.mark.parametrize('shape', LEDGER_SHAPES)
+@pytest.mark.parametrize('seed', SEEDS)
+def test_same_results_as_calculator(db, seed, shape, taxFee, taxRate):
+    db.updateTaxValues(taxFee, taxRate, 0.0)
+    db.addOrders(generateLedger(seed, *shape))
+    store = db.getOrderStore()
+    vectorizedCalculator = VectorizedCalculator(db, store)
+
+    expectedProfits = Calculator(db).getProfitsAndLosses(store)
+    profits = vectorizedCalculator.getProfitsAndLosses()
+    assert len(profits) == len(expectedProfits)
+    for row, expectedRow in zip(profits, expectedProfits):
+        # Date, code, average value, amount, value and profit
+        assert row[:2] == expectedRow[:2]
+        assert row[3] == expectedRow[3]
+        for i in [2, 4, 5]:
+            assertClose(row[i], expectedRow[i])
+
+    expectedReport = Calculator(db).getMonthlyReport(store)
+    report = vectorizedCalculator.getMonthlyReport()
+    assert list(report) == list(expectedReport)
+    for month in expectedReport:
+        assertClose(report[month][0], expectedReport[month][0])
+        assertClose(report[month][1], expectedReport[month][1])
+
+    extracts = vectorizedCalculator.getYearExtracts()
+    for year in sorted(extracts):
+        expectedExtract = Calculator(db).getYearExtract([order for order in store if order[1] < str(year + 1) + '-01-01'])
+        assert sorted(extracts[year]) == sorted(expectedExtract)
+        for code, [amount, averageValue] in expectedExtract.items():
+            assert extracts[year][code][0] == amount
+            assertClose(extracts[year][code][1], averageValue)
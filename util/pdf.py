@@ -5,18 +5,25 @@ from pdfminer.converter import TextConverter
 from pdfminer.layout import LAParams
 from pdfminer.pdfpage import PDFPage
 
-def to_text(path):
+def get_num_pages(path):
+    fp = open(path, 'rb')
+    num_pages = sum(1 for page in PDFPage.get_pages(fp))
+    fp.close()
+    return num_pages
+
+def to_text(path, pagenos=None, laparams=None):
+    # pagenos are zero based, all pages are converted if not given. laparams defaults to pdfminer's
     rsrcmgr = PDFResourceManager()
     retstr = io.StringIO()
     codec = 'utf-8'
-    laparams = LAParams()
+    laparams = laparams if laparams else LAParams()
     device = TextConverter(rsrcmgr, retstr, codec=codec, laparams=laparams)
     fp = open(path, 'rb')
     interpreter = PDFPageInterpreter(rsrcmgr, device)
     password = ""
     maxpages = 0
     caching = True
-    pagenos = set()
+    pagenos = set(pagenos) if pagenos else set()
 
     for page in PDFPage.get_pages(fp, pagenos, maxpages=maxpages,
                                   password=password,
@@ -0,0 +1,150 @@
+import datetime
+import sys
+
+import numpy as np
+
+from calculator import Calculator
+from order_store import OrderStore
+
+class VectorizedCalculator:
+    # Same results as Calculator, computed with array operations over an OrderStore.
+    # Orders are sorted by (code, date), so each code is a contiguous run where the cost
+    # of the position (amount * average value) follows
+    #   buy:  cost = cost + buying value with taxes
+    #   sell: cost = cost * newAmount / oldAmount
+    # which is a linear recurrence solved with cumulative sums of costs divided by the
+    # cumulative product of the selling ratios (kept as logarithms). Runs restart when
+    # the position is closed, since the next buy sets a new average value. Codes whose
+    # position ever goes negative are replayed by Calculator, one order at a time
+    MAX_LOG_SCALE = 5.0
+
+    def __init__(self, db, store):
+        self.calculator = Calculator(db)
+        self.store = store
+        self.computeAverageValues()
+
+    def getSegmentedCumsum(self, values, starts):
+        # Cumulative sum restarting at each start (the first element must be one). Each
+        # segment's total is subtracted where the next one starts, so running sums never
+        # grow beyond a single segment and keep their precision
+        firstIndexes = np.flatnonzero(starts)
+        if (len(firstIndexes) == 0):
+            return np.cumsum(values)
+        resetValues = values.copy()
+        resetValues[firstIndexes[1:]] -= np.add.reduceat(values, firstIndexes)[:-1]
+        return np.cumsum(resetValues)
+
+    def computeAverageValues(self):
+        store = self.store
+        numOrders = len(store)
+        self.sortedIndexes = np.argsort(store.codeIndexes, kind='stable')
+        codes = store.codeIndexes[self.sortedIndexes]
+        isSell = store.types[self.sortedIndexes] == OrderStore.SELL
+        amounts = store.amounts[self.sortedIndexes]
+        values = store.values[self.sortedIndexes]
+
+        # Running amount of each code
+        codeStarts = np.ones(numOrders, dtype=bool)
+        codeStarts[1:] = codes[1:] != codes[:-1]
+        signedAmounts = np.where(isSell, -amounts, amounts)
+        positions = self.getSegmentedCumsum(signedAmounts, codeStarts)
+        previousPositions = positions - signedAmounts
+
+        # Position restarts whenever a buy comes after it was closed
+        segmentStarts = codeStarts | (previousPositions == 0)
+        closed = positions == 0
+        logRatios = np.zeros(numOrders)
+        partialSells = isSell & (positions > 0) & (previousPositions > 0)
+        logRatios[partialSells] = np.log(positions[partialSells] / previousPositions[partialSells])
+        logScales = self.getSegmentedCumsum(logRatios, segmentStarts)
+
+        # Split segments into groups where scales stay within MAX_LOG_SCALE, so dividing by
+        # them never blows up. Groups after the first of a segment carry the cost the
+        # previous group ended with, scaled by the selling ratios since then
+        chunks = np.floor(-logScales / self.MAX_LOG_SCALE)
+        groupStarts = segmentStarts.copy()
+        groupStarts[1:] |= chunks[1:] != chunks[:-1]
+        groupFirstIndexes = np.flatnonzero(groupStarts)
+        scales = np.exp(logScales - logScales[groupFirstIndexes][np.cumsum(groupStarts) - 1])
+        buyingValues = np.where(isSell, 0.0, self.calculator.getTransactionValueWithTaxes(amounts, values, False))
+        costs = scales * self.getSegmentedCumsum(buyingValues / scales, groupStarts)
+        groupLastIndexes = np.append(groupFirstIndexes[1:], numOrders)
+        for groupStart, groupEnd in zip(groupFirstIndexes.tolist(), groupLastIndexes.tolist()):
+            if (not segmentStarts[groupStart]):
+                carriedCost = costs[groupStart - 1] * np.exp(logRatios[groupStart])
+                costs[groupStart:groupEnd] += carriedCost * scales[groupStart:groupEnd]
+        costs[closed] = 0.0
+
+        previousCosts = np.zeros(numOrders)
+        previousCosts[1:] = costs[:-1]
+        previousCosts[segmentStarts] = 0.0
+        averageValuesBefore = np.zeros(numOrders)
+        np.divide(previousCosts, previousPositions, out=averageValuesBefore, where=previousPositions > 0)
+        # Closing a position keeps its average value
+        averageValuesAfter = averageValuesBefore.copy()
+        np.divide(costs, positions, out=averageValuesAfter, where=positions > 0)
+
+        # Replay codes going short (or buying nothing) the way Calculator does
+        invalid = (positions < 0) | (~isSell & closed)
+        for code in np.unique(codes[invalid]):
+            first = int(np.searchsorted(codes, code, 'left'))
+            last = int(np.searchsorted(codes, code, 'right'))
+            calculator = Calculator(self.calculator.db)
+            for i in range(first, last):
+                averageValuesBefore[i] = calculator.stocks[''][1] if '' in calculator.stocks else 0.0
+                calculator.updateStockAverageValueAndAmount([0, '', 'V' if isSell[i] else 'C', '', '', int(amounts[i]), float(values[i])])
+                averageValuesAfter[i] = calculator.stocks[''][1]
+
+        sellingValues = self.calculator.getTransactionValueWithTaxes(amounts, values, True)
+        profits = np.where(isSell, sellingValues - averageValuesBefore * amounts, 0.0)
+
+        # Keep (code, date) sorted positions for year extracts, everything else in store order
+        self.sortedCodes = codes
+        self.sortedPositions = positions
+        self.sortedAverageValuesAfter = averageValuesAfter
+        self.averageValuesBefore = np.empty(numOrders)
+        self.averageValuesBefore[self.sortedIndexes] = averageValuesBefore
+        self.profits = np.empty(numOrders)
+        self.profits[self.sortedIndexes] = profits
+
+    def getProfitsAndLosses(self):
+        store = self.store
+        sells = np.flatnonzero(store.types == OrderStore.SELL)
+        sellStore = store.take(sells)
+        return [list(row) for row in zip(sellStore.getDateStrs(), sellStore.getCodeStrs(), self.averageValuesBefore[sells].tolist(),
+                                         sellStore.amounts.tolist(), sellStore.values.tolist(), self.profits[sells].tolist())]
+
+    def getMonthlyReport(self):
+        store = self.store
+        sells = np.flatnonzero(store.types == OrderStore.SELL)
+        months = (store.days[sells] + OrderStore.EPOCH).astype('datetime64[M]').astype(np.int64)
+        distinctMonths, monthIndexes = np.unique(months, return_inverse=True)
+        sales = np.bincount(monthIndexes, weights=store.amounts[sells] * store.values[sells], minlength=len(distinctMonths))
+        profits = np.bincount(monthIndexes, weights=self.profits[sells], minlength=len(distinctMonths))
+        ret = {}
+        for month, monthSales, monthProfit in zip(distinctMonths.tolist(), sales.tolist(), profits.tolist()):
+            dateString = datetime.date(1970 + month // 12, month % 12 + 1, 1).strftime('%b %y')
+            ret[dateString] = [monthSales, monthProfit]
+        return ret
+
+    def getYearExtracts(self):
+        # Return {year: {code: [amount, avgValue]}} at the end of each year with orders.
+        # Orders are sorted by (code, date), so combining both in a single key lets us find
+        # the last order of every code before the end of a year with a single search
+        store = self.store
+        ret = {}
+        if (len(store) == 0):
+            return ret
+        dayOffset = np.int64(2 ** 31)
+        keys = (self.sortedCodes.astype(np.int64) << 32) | (store.days[self.sortedIndexes].astype(np.int64) + dayOffset)
+        codes = np.unique(self.sortedCodes)
+        firstIndexes = np.searchsorted(self.sortedCodes, codes, 'left')
+        years = np.unique((store.days + OrderStore.EPOCH).astype('datetime64[Y]').astype(np.int64) + 1970)
+        for year in years.tolist():
+            endDay = OrderStore.getDayFromDateStr(str(year + 1).zfill(4) + '-01-01')
+            lastIndexes = np.searchsorted(keys, (codes.astype(np.int64) << 32) | (endDay + dayOffset), 'left') - 1
+            held = lastIndexes >= firstIndexes
+            ret[year] = {store.codes[code]: [amount, averageValue] for code, amount, averageValue in
+                         zip(codes[held].tolist(), self.sortedPositions[lastIndexes[held]].tolist(),
+                             self.sortedAverageValuesAfter[lastIndexes[held]].tolist())}
+        return ret